@@ -1,119 +1,1147 @@
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import faiss
-import pickle
-import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import re
+import json
+import math
+import hashlib
+import queue
+import shutil
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import numpy as np
+import lexical
+import embedders
+import embedding_cache
+import tracing
+
+# Every update is written as a new generation directory and published by rewriting CURRENT,
+# so readers keep a consistent (and still mapped) snapshot while a rebuild runs
+INDEX_DIR = "rag_index"
+CURRENT_PATH = os.path.join(INDEX_DIR, "CURRENT")
+INDEX_FILE = "rag_index.faiss"
+PATHS_FILE = "rag_paths.json"
+CHUNK_FILE_IDS_FILE = "rag_chunk_file_ids.npy"
+CHUNK_INDICES_FILE = "rag_chunk_indices.npy"
+CHUNK_OFFSETS_FILE = "rag_chunks.offsets.npy"
+MANIFEST_FILE = "rag_manifest.json"
+SCAN_FILE = "rag_scan.json"  # the manifest minus chunk ids: all an update needs to see nothing changed
+
+SOURCE_SUFFIXES = ('.txt', '.md', '.pdf')
+EMBED_BATCH_SIZE = 256  # chunks per encode call
+# sentence-transformers, onnx or onnx-int8 (see embedders.py); falls back to sentence-transformers
+EMBED_BACKEND = os.environ.get("LOCAI_EMBEDDER", "onnx-int8")
+EMBED_MODEL_BATCH_SIZE = None  # batch size inside encode; None auto-tunes on the first build
+EMBED_CACHE_DIR = "embed_cache"  # inside INDEX_DIR; vectors of every chunk embedded before
+EMBED_CACHE_MAX_BYTES = 512 * 2**20  # ~700k MiniLM vectors in float16
+PARALLEL_MIN_FILES = 8  # below this, extracting in-process beats starting a pool
+
+# Chunks are measured in embedder tokens; MiniLM truncates at 256 word-pieces including [CLS]/[SEP],
+# so a chunk never carries text the embedder would silently drop
+EMBEDDER_MAX_TOKENS = 256
+CHUNK_TOKENS = EMBEDDER_MAX_TOKENS - 2
+CHUNK_OVERLAP_TOKENS = 32
+
+# Index type by chunk count: exact search while it is cheap, HNSW for low latency,
+# IVF-PQ once full float32 vectors no longer fit comfortably in RAM
+INDEX_FLAT_MAX_CHUNKS = 50_000
+INDEX_HNSW_MAX_CHUNKS = 1_000_000
+HNSW_REBUILD_TOMBSTONES = 0.2  # HNSW can't delete; rebuild once this share of it is dead
+
+# Tried in order: zero-copy mapping of the codes (newer faiss), then the classic read-only mapping,
+# which is what IVF indexes get when the zero-copy path rejects their inverted lists
+INDEX_MAP_MODES = [
+    ("mmap-ifc", ('IO_FLAG_MMAP_IFC',)),
+    ("mmap", ('IO_FLAG_MMAP', 'IO_FLAG_READ_ONLY')),
+]
+
+QUERY_EMBEDDING_CACHE_SIZE = 512
+RETRIEVAL_CACHE_SIZE = 256
+RRF_K = 60  # reciprocal-rank fusion damping; 60 is the usual choice
+
+def read_text_file(file_path):
+    suffix = Path(file_path).suffix.lower()
+    if suffix == '.txt' or suffix == '.md':
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+    elif suffix == '.pdf':
+        import fitz  # PyMuPDF, imported here to keep startup fast
+        with fitz.open(file_path) as doc:
+            return "".join(page.get_text() for page in doc)
+    # elif suffix == '.png': # for png files of text (receipts, etc.)
+        #     # FIXME & ADD @ ~ line 90
+        #     with open(file_path, 'rb') as f:
+        #         return f.read()
+    return None
+
+def iter_source_files(folder_path):
+    for file_path in Path(folder_path).rglob("*"):
+        if file_path.suffix.lower() in SOURCE_SUFFIXES and file_path.is_file():
+            yield str(file_path)
 
 def load_text_files(folder_path):
     text_data = []
-    for file_path in Path(folder_path).rglob("*"):
-        if file_path.suffix.lower() == '.txt' or file_path.suffix.lower() == '.md':
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                text_data.append((str(file_path), f.read()))
-        elif file_path.suffix.lower() == '.pdf':
-            with fitz.open(file_path) as doc:
-                content = ""
-                for page in doc:
-                    content += page.get_text()
-                text_data.append((str(file_path), content))
-        # elif file_path.suffix.lower() == '.png': # for png files of text (receipts, etc.)
-            #     # FIXME & ADD @ ~ line 90
-            #     with open(file_path, 'rb') as f:
-            #         content = f.read()
-            #         text_data.append((str(file_path), content))
+    for file_path in iter_source_files(folder_path):
+        text_data.append((file_path, read_text_file(file_path)))
 
     return text_data
 
-def chunk_text(text, chunk_size=500, overlap=50):
-    words = text.split()
+model_path = "./models/all-MiniLM-L6-v2" # . for source and .. for build
+embedder = None
+embedder_lock = threading.Lock()
+
+def get_embedder():
+    # Created on first use: extraction workers import this module and must not load the model,
+    # and the GUI warms it up in the background after the window is shown
+    global embedder
+    with embedder_lock:
+        if embedder is None:
+            embedder = embedders.create_embedder(EMBED_BACKEND, model_path, batch_size=EMBED_MODEL_BATCH_SIZE)
+    return embedder
+
+tokenizer = None
+
+def get_tokenizer():
+    # Only the tokenizer is loaded (cheap, no torch), so extraction workers can chunk in tokens
+    global tokenizer
+    if tokenizer is None:
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        # Chunk sizes count content tokens: no padding or truncation from the model's tokenizer.json
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+    return tokenizer
+
+def embedder_id():
+    # Recorded in the manifest: vectors of different backends (fp32, ONNX, int8) don't mix in one index
+    return f"{model_path}|{get_embedder().name}"
+
+def chunk_params(chunk_tokens=None, overlap_tokens=None):
+    # Stored in the manifest; an index built with different params is rebuilt
+    return {
+        'tokenizer': model_path,
+        'chunk_tokens': chunk_tokens or CHUNK_TOKENS,
+        'overlap_tokens': CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens,
+    }
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+def split_sentences(text):
+    # Paragraphs first, then sentences; True marks the first sentence of a paragraph
+    for paragraph in re.split(r"\n\s*\n", text):
+        first = True
+        for sentence in SENTENCE_END_RE.split(paragraph):
+            sentence = " ".join(sentence.split())
+            if sentence:
+                yield sentence, first
+                first = False
+
+def chunk_text(text, chunk_size=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    # Packs whole sentences into chunks of at most chunk_size tokens; the next chunk
+    # starts with the trailing sentences of the previous one, up to overlap tokens
+    sentences = list(split_sentences(text))
+    if not sentences:
+        return []
+    encodings = get_tokenizer().encode_batch([sentence for sentence, _ in sentences], add_special_tokens=False)
+
+    units = []  # (text, tokens, starts_paragraph)
+    for (sentence, first), encoding in zip(sentences, encodings):
+        if len(encoding.ids) <= chunk_size:
+            units.append((sentence, len(encoding.ids), first))
+            continue
+        # A sentence longer than a whole chunk is cut at token boundaries
+        for start in range(0, len(encoding.ids), chunk_size):
+            piece = encoding.offsets[start:start + chunk_size]
+            units.append((sentence[piece[0][0]:piece[-1][1]], len(piece), first and start == 0))
+
     chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
+    current = []
+    size = 0
+    for unit in units:
+        if current and size + unit[1] > chunk_size:
+            chunks.append(join_units(current))
+            carried = []
+            carried_size = 0
+            for prev in reversed(current):
+                if carried_size + prev[1] > overlap or carried_size + prev[1] + unit[1] > chunk_size:
+                    break
+                carried.insert(0, prev)
+                carried_size += prev[1]
+            current, size = carried, carried_size
+        current.append(unit)
+        size += unit[1]
+    if current:
+        chunks.append(join_units(current))
     return chunks
 
-model_path = "./models/all-MiniLM-L6-v2" # . for source and .. for build
-embedder = SentenceTransformer(model_path)
+def join_units(units):
+    text = units[0][0]
+    for unit_text, _, starts_paragraph in units[1:]:
+        text += ("\n\n" if starts_paragraph else " ") + unit_text
+    return text
 
-def embed_chunks(chunks):
-    return embedder.encode(chunks, convert_to_numpy=True)
+def cache_namespace(model, params):
+    # Cached vectors are only valid for the same model, backend and chunking settings
+    return f"{model_path}|{model.name}|{json.dumps(params, sort_keys=True)}"
 
-def build_faiss_index(embeddings, chunks, metadata):
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+def embed_chunks(chunks, cache=None, params=None):
+    # With a cache, only chunks never embedded before go through the model
+    model = get_embedder()
+    if cache is not None:
+        keys = embedding_cache.chunk_keys(chunks, cache_namespace(model, params))
+        embeddings, hits = cache.get(keys)
+        if hits.all():
+            return embeddings
+        misses = np.flatnonzero(~hits)
+        fresh = embed_chunks([chunks[i] for i in misses])
+        cache.put(keys[misses], fresh)
+        if embeddings is None:
+            return fresh
+        embeddings[misses] = fresh
+        return embeddings
+    if model.batch_size is None and len(chunks) >= max(embedders.BATCH_SIZE_CANDIDATES):
+        print(f"Embedding batch size tuned to {embedders.autotune_batch_size(model, chunks[:max(embedders.BATCH_SIZE_CANDIDATES)])}")
+    return model.encode(chunks, convert_to_numpy=True)
 
-    faiss.write_index(index, "rag_index.faiss")
-    
-    # Only save metadata with file positions, not full chunks
-    with open("rag_metadata.pkl", "wb") as f:
-        pickle.dump({'metadata': metadata}, f)
+class ChunkStore:
+    # Chunk text lives in one contiguous utf-8 blob; chunk i is blob[offsets[i]:offsets[i+1]]
+    def __init__(self, text_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        if os.path.getsize(text_path) > 0:
+            self.blob = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            self.blob = np.zeros(0, dtype=np.uint8)  # mmap can't map an empty file
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    @staticmethod
+    def compact(live_ids, offsets_path, src_text_path, dst_text_path):
+        # Copy only live chunks into a new blob; removed ids stay valid as empty slices
+        old_offsets = np.load(offsets_path)
+        live = np.zeros(len(old_offsets) - 1, dtype=bool)
+        live[np.asarray(list(live_ids), dtype=np.int64)] = True
+        offsets = np.zeros_like(old_offsets)
+        with open(src_text_path, "rb") as src, open(dst_text_path, "wb") as dst:
+            for i in range(len(live)):
+                size = 0
+                if live[i]:
+                    src.seek(int(old_offsets[i]))
+                    size = int(old_offsets[i + 1] - old_offsets[i])
+                    dst.write(src.read(size))
+                offsets[i + 1] = offsets[i] + size
+        np.save(offsets_path, offsets)
+
+    @staticmethod
+    def live_fraction(live_ids, offsets_path):
+        offsets = np.load(offsets_path, mmap_mode='r')
+        total = int(offsets[-1])
+        if total == 0:
+            return 1.0
+        ids = np.asarray(list(live_ids), dtype=np.int64)
+        live = int((offsets[ids + 1] - offsets[ids]).sum()) if len(ids) else 0
+        return live / total
+
+class ChunkWriter:
+    # Append-only writer for the chunk store. Bytes already in the blob are never
+    # touched, so a reader of the previous generation is unaffected; offsets are saved on close
+    def __init__(self, text_path, offsets_path, base_offsets_path=None):
+        self.offsets_path = offsets_path
+        if base_offsets_path is None:
+            self.offsets = [np.zeros(1, dtype=np.int64)]
+            self.file = open(text_path, "wb")
+        else:
+            self.offsets = [np.load(base_offsets_path)]
+            # Overwrite from the last published byte on; anything past it was left by a cancelled build
+            self.file = open(text_path, "r+b")
+            self.file.seek(int(self.offsets[0][-1]))
+        self.end = int(self.offsets[0][-1])
+
+    def add(self, chunks):
+        sizes = np.empty(len(chunks), dtype=np.int64)
+        for i, chunk in enumerate(chunks):
+            data = chunk.encode('utf-8')
+            self.file.write(data)
+            sizes[i] = len(data)
+        ends = self.end + np.cumsum(sizes)
+        if len(ends):
+            self.end = int(ends[-1])
+        self.offsets.append(ends)
+
+    def close(self):
+        self.file.close()
+        np.save(self.offsets_path, np.concatenate(self.offsets))
+
+class ChunkMetadata:
+    # Columnar chunk metadata: an interned path table plus per-chunk file id and chunk
+    # index arrays (file id -1 = removed). Loaded arrays are memory-mapped and read-only;
+    # builds load them into growable arrays instead
+    def __init__(self, paths=None, file_ids=None, chunk_indices=None, files=None):
+        self.paths = paths if paths is not None else []
+        self.path_ids = {path: i for i, path in enumerate(self.paths)}
+        self.file_ids = file_ids if file_ids is not None else array('i')
+        self.chunk_indices = chunk_indices if chunk_indices is not None else array('i')
+        self.files = files if files is not None else {}
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __getitem__(self, chunk_id):
+        file_id = int(self.file_ids[chunk_id])
+        if file_id < 0:
+            return None
+        return self.paths[file_id], int(self.chunk_indices[chunk_id])
+
+    def append(self, file_path, chunk_idx):
+        file_id = self.path_ids.get(file_path)
+        if file_id is None:
+            file_id = self.path_ids[file_path] = len(self.paths)
+            self.paths.append(file_path)
+        self.file_ids.append(file_id)
+        self.chunk_indices.append(chunk_idx)
+
+    def remove(self, chunk_id):
+        self.file_ids[chunk_id] = -1
+
+    def live_mask(self):
+        return np.asarray(self.file_ids, dtype=np.int32) >= 0
+
+    def live_ids(self):
+        return np.flatnonzero(self.live_mask())
+
+    def save(self, generation, files, arrays=True):
+        # arrays=False only refreshes file signatures, leaving the mapped arrays untouched
+        paths = self.paths
+        if arrays:
+            # Paths no chunk points at any more are dropped from the table
+            file_ids = np.asarray(self.file_ids, dtype=np.int32)
+            used = np.unique(file_ids[file_ids >= 0])
+            remap = np.full(len(self.paths) + 1, -1, dtype=np.int32)  # last slot maps -1 to -1
+            remap[used] = np.arange(len(used), dtype=np.int32)
+            paths = [self.paths[i] for i in used]
+            np.save(generation_path(generation, CHUNK_FILE_IDS_FILE), remap[file_ids])
+            np.save(generation_path(generation, CHUNK_INDICES_FILE), np.asarray(self.chunk_indices, dtype=np.int32))
+        table = {
+            'paths': paths,
+            'signatures': [list(files[path]) if path in files else None for path in paths],
+        }
+        write_json_atomic(generation_path(generation, PATHS_FILE), table)
+
+    @classmethod
+    def load(cls, generation, writable=False):
+        with open(generation_path(generation, PATHS_FILE), "r", encoding="utf-8") as f:
+            table = json.load(f)
+        mmap_mode = None if writable else 'r'
+        file_ids = np.load(generation_path(generation, CHUNK_FILE_IDS_FILE), mmap_mode=mmap_mode)
+        chunk_indices = np.load(generation_path(generation, CHUNK_INDICES_FILE), mmap_mode=mmap_mode)
+        if writable:
+            file_ids = array('i', file_ids.astype(np.int32).tobytes())
+            chunk_indices = array('i', chunk_indices.astype(np.int32).tobytes())
+        files = {path: tuple(sig) for path, sig in zip(table['paths'], table['signatures']) if sig is not None}
+        return cls(table['paths'], file_ids, chunk_indices, files)
+
+def write_json_atomic(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def generation_dir(generation):
+    return os.path.join(INDEX_DIR, f"gen-{generation:06d}")
+
+def generation_path(generation, name):
+    return os.path.join(generation_dir(generation), name)
+
+def current_generation():
+    try:
+        with open(CURRENT_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def publish_generation(generation):
+    tmp_path = CURRENT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(tmp_path, CURRENT_PATH)
+
+def cleanup_generations(keep):
+    # Keep the published generations and the blobs they reference; anything else is left
+    # over from older or cancelled builds. Files still mapped on Windows are retried next time
+    keep_dirs = {os.path.basename(generation_dir(g)) for g in keep}
+    keep_blobs = set()
+    keep_segments = set()
+    for g in keep:
+        manifest = load_manifest(g)
+        if manifest is not None:
+            keep_blobs.add(manifest['chunk_file'])
+            keep_segments.update(manifest.get('lexical_segments', []))
+    for name in os.listdir(INDEX_DIR):
+        path = os.path.join(INDEX_DIR, name)
+        if name.startswith("gen-") and name not in keep_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+        elif (name.startswith("chunks-") and name not in keep_blobs) or \
+                (name.startswith("lex-") and name.split(".")[0] not in keep_segments):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def file_hash(file_path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(generation):
+    if generation is None:
+        return None
+    try:
+        with open(generation_path(generation, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(generation, manifest):
+    write_json_atomic(generation_path(generation, MANIFEST_FILE), manifest)
+    write_json_atomic(generation_path(generation, SCAN_FILE), {
+        'embedder': manifest['embedder'],
+        'chunking': manifest['chunking'],
+        'lexical_segments': manifest.get('lexical_segments'),
+        'files': manifest_signatures(manifest),
+    })
+
+def load_scan_info(generation):
+    if generation is None:
+        return None
+    try:
+        with open(generation_path(generation, SCAN_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def file_signature(file_path):
+    st = os.stat(file_path)
+    return (st.st_mtime_ns, st.st_size)
+
+def is_stale(data, file_path):
+    # A hit is stale when its source file changed (or vanished) after indexing
+    indexed = data['metadata'].files.get(file_path)
+    try:
+        return indexed is None or file_signature(file_path) != tuple(indexed)
+    except OSError:
+        return True
+
+def extract_chunks(file_path, known_hash=None, params=None):
+    # Runs in the extraction pool: hash, parse and chunk one file
+    params = params or chunk_params()
+    try:
+        digest = file_hash(file_path)
+        if digest == known_hash:
+            return file_path, digest, None, None
+        chunks = chunk_text(read_text_file(file_path) or "", params['chunk_tokens'], params['overlap_tokens'])
+        return file_path, digest, chunks, None
+    except Exception as e:
+        return file_path, None, None, str(e)
+
+def iter_extracted(jobs, params=None, workers=None):
+    # jobs yields (file_path, known_hash); results come back in completion order
+    jobs = iter(jobs)
+    first = [job for _, job in zip(range(PARALLEL_MIN_FILES), jobs)]
+    if len(first) < PARALLEL_MIN_FILES:
+        for file_path, known_hash in first:
+            yield extract_chunks(file_path, known_hash, params)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = set()
+        for file_path, known_hash in first:
+            pending.add(pool.submit(extract_chunks, file_path, known_hash, params))
+        for file_path, known_hash in jobs:
+            # Bounded in-flight work keeps memory flat however large the folder is
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(extract_chunks, file_path, known_hash, params))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Also reached when the consumer stops early (cancelled build): drop queued files
+        pool.shutdown(wait=True, cancel_futures=True)
+
+class BuildCancelled(Exception):
+    pass
+
+class BuildProgress:
+    # Counters for one build, passed to callback at most every `interval` seconds
+    def __init__(self, callback=None, cancel_event=None, interval=0.25, throttle=None):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.throttle = throttle  # blocks while the build should yield the CPU
+        self.interval = interval
+        self.stage = "scanning"
+        self.published = False  # True once readers have something new to load
+        self.files_total = 0
+        self.files_scanned = 0
+        self.chunks_queued = 0
+        self.chunks_embedded = 0
+        self.chunks_cached = 0
+        self.started = time.monotonic()
+        self.embed_started = None
+        self.last_report = 0.0
+        self.lock = threading.Lock()
+
+    def check_cancelled(self):
+        if self.throttle is not None:
+            self.throttle()
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise BuildCancelled()
+
+    def add_embedded(self, count, cached=0):
+        with self.lock:
+            if self.embed_started is None:
+                self.embed_started = time.monotonic()
+            self.chunks_embedded += count
+            self.chunks_cached += cached
+        self.report()
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - (self.embed_started or self.started)
+            rate = self.chunks_embedded / elapsed if self.chunks_embedded and elapsed > 0 else 0.0
+            # Remaining chunks: what is queued plus an estimate for files not scanned yet
+            remaining = self.chunks_queued - self.chunks_embedded
+            if self.files_scanned:
+                per_file = self.chunks_queued / self.files_scanned
+                remaining += per_file * max(0, self.files_total - self.files_scanned)
+            return {
+                'stage': self.stage,
+                'published': self.published,
+                'files_total': self.files_total,
+                'files_scanned': self.files_scanned,
+                'chunks_embedded': self.chunks_embedded,
+                'chunks_cached': self.chunks_cached,
+                'chunks_per_sec': rate,
+                'eta_sec': remaining / rate if rate else None,
+            }
+
+    def report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        self.callback(self.snapshot())
+
+class EmbeddingSink:
+    # Embeds fixed-size batches on its own thread and appends them to the index, chunk store
+    # and lexical index
+    def __init__(self, index, index_info, writer, lexical_writer, progress, cache=None, params=None, queue_size=4):
+        self.index = index
+        self.cache = cache
+        self.params = params
+        self.index_info = index_info
+        self.writer = writer
+        self.lexical_writer = lexical_writer
+        self.progress = progress
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.batches.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so the producer never blocks
+            first_id, chunks = item
+            try:
+                self.progress.check_cancelled()
+                hits = self.cache.hits if self.cache is not None else 0
+                embeddings = embed_chunks(chunks, self.cache, self.params)
+                if self.index is None:
+                    self.index = new_faiss_index(embeddings.shape[1])
+                ids = np.arange(first_id, first_id + len(chunks), dtype=np.int64)
+                self.index.add_with_ids(embeddings, ids)
+                # Switch to compressed vectors mid-build instead of holding them all as float32
+                if self.index_info['type'] == "flat" and self.index.ntotal > INDEX_HNSW_MAX_CHUNKS:
+                    self.index = convert_index(self.index, self.index_info, "ivfpq", self.index.ntotal)
+                self.writer.add(chunks)
+                for chunk_id, chunk in enumerate(chunks, first_id):
+                    self.lexical_writer.add(chunk_id, chunk)
+                cached = self.cache.hits - hits if self.cache is not None else 0
+                self.progress.add_embedded(len(chunks), cached)
+            except Exception as e:
+                self.error = e
+
+    def put(self, first_id, chunks):
+        self.batches.put((first_id, chunks))
+
+    def close(self):
+        self.batches.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+def choose_index_type(count):
+    if count <= INDEX_FLAT_MAX_CHUNKS:
+        return "flat"
+    if count <= INDEX_HNSW_MAX_CHUNKS:
+        return "hnsw"
+    return "ivfpq"
+
+def choose_index_params(index_type, count, dim):
+    if index_type == "hnsw":
+        return {'M': 32, 'efConstruction': 80, 'efSearch': 64}
+    if index_type == "ivfpq":
+        nlist = int(min(65536, max(256, 4 * math.sqrt(count))))
+        m = dim // 8  # ~8 dims per sub-quantizer, and m has to divide dim
+        while dim % m:
+            m -= 1
+        return {'nlist': nlist, 'm': m, 'nbits': 8, 'nprobe': max(8, nlist // 64)}
+    return {}
 
-def build_embeddings(folder_path):
-    text_data = load_text_files(folder_path)
-    if not text_data:
+def new_faiss_index(dim, index_type="flat", params=None):
+    # Flat and HNSW are ID-mapped so chunks can be addressed by id; IVF keeps ids itself
+    import faiss  # heavy native import, deferred to the functions that touch an index
+    params = params or {}
+    if index_type == "hnsw":
+        index = faiss.index_factory(dim, f"IDMap2,HNSW{params['M']}")
+        faiss.downcast_index(index.index).hnsw.efConstruction = params['efConstruction']
+    elif index_type == "ivfpq":
+        index = faiss.index_factory(dim, f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}")
+    else:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    apply_search_params(index, index_type, params)
+    return index
+
+def apply_search_params(index, index_type, params):
+    # Search-time knobs are re-applied on every load rather than trusted to the file
+    import faiss
+    if index_type == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = params['efSearch']
+    elif index_type == "ivfpq":
+        faiss.extract_index_ivf(index).nprobe = params['nprobe']
+
+def export_vectors(index):
+    # Only flat and HNSW indexes hold exact vectors to rebuild from
+    import faiss
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    return vectors, ids
+
+def convert_index(index, index_info, index_type, count, live_mask=None):
+    vectors, ids = export_vectors(index)
+    if live_mask is not None:
+        keep = live_mask[ids]
+        vectors, ids = vectors[keep], ids[keep]
+    params = choose_index_params(index_type, count, vectors.shape[1])
+    new_index = new_faiss_index(vectors.shape[1], index_type, params)
+    if not new_index.is_trained:
+        sample_size = min(len(vectors), params['nlist'] * 64)
+        sample = np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)
+        new_index.train(vectors[np.sort(sample)])
+    for start in range(0, len(vectors), 65536):
+        new_index.add_with_ids(vectors[start:start + 65536], ids[start:start + 65536])
+    index_info.update({'type': index_type, 'params': params, 'tombstones': 0})
+    return new_index
+
+def remove_chunk_vectors(index, index_info, chunk_ids):
+    if index_info['type'] == "hnsw":
+        # HNSW has no delete: leave tombstones that retrieval skips via the metadata
+        index_info['tombstones'] += len(chunk_ids)
+    else:
+        index.remove_ids(np.asarray(chunk_ids, dtype=np.int64))
+
+def finalize_index(index, index_info, metadata):
+    # Pick the index type for the final size; flat/HNSW are converted from their exact vectors
+    live_count = index.ntotal - index_info['tombstones']
+    target = choose_index_type(live_count)
+    current = index_info['type']
+    if current == "ivfpq":
+        return index  # vectors are already compressed; a full rebuild re-selects
+    if target != current and target != "flat":
+        return convert_index(index, index_info, target, live_count, metadata.live_mask())
+    if current == "hnsw" and index_info['tombstones'] > HNSW_REBUILD_TOMBSTONES * index.ntotal:
+        return convert_index(index, index_info, "hnsw", live_count, metadata.live_mask())
+    return index
+
+def load_existing_index(generation, manifest, params):
+    # Only reuse the on-disk index if it matches the manifest it was written with
+    import faiss
+    if manifest is None:
+        return None, None
+    if manifest.get('embedder') != embedder_id():
+        print("Embedder changed; rebuilding the RAG index from scratch")
+        return None, None
+    if manifest.get('chunking') != params:
+        print("Chunking settings changed; rebuilding the RAG index from scratch")
+        return None, None
+    manifest.setdefault('index', {'type': "flat", 'params': {}, 'tombstones': 0})
+    try:
+        index = faiss.read_index(generation_path(generation, INDEX_FILE))
+        metadata = ChunkMetadata.load(generation, writable=True)
+        offsets = np.load(generation_path(generation, CHUNK_OFFSETS_FILE), mmap_mode='r')
+    except Exception:
+        return None, None
+
+    live = int(metadata.live_mask().sum())
+    indexed = index.ntotal - manifest['index']['tombstones']
+    if len(metadata) != manifest['next_id'] or len(offsets) - 1 != len(metadata) or indexed != live:
+        print("RAG index is out of sync with its manifest; rebuilding from scratch")
+        return None, None
+    segments = manifest.get('lexical_segments', [])
+    if any(not os.path.exists(os.path.join(INDEX_DIR, f)) for name in segments for f in lexical.segment_files(name)):
+        manifest.pop('lexical_segments')  # rebuilt from the chunk store below
+    return index, metadata
+
+def backfill_lexical(manifest, metadata, generation, prefix):
+    # Index chunks embedded before the lexical index existed straight from the chunk store
+    store = ChunkStore(os.path.join(INDEX_DIR, manifest['chunk_file']), generation_path(generation, CHUNK_OFFSETS_FILE))
+    writer = lexical.SegmentWriter(INDEX_DIR, prefix)
+    for chunk_id in metadata.live_ids():
+        writer.add(int(chunk_id), store.get(chunk_id))
+    manifest['lexical_segments'] = writer.close()
+
+def manifest_signatures(manifest):
+    return {path: (entry['mtime_ns'], entry['size']) for path, entry in manifest['files'].items()}
+
+build_lock = threading.Lock()
+
+def build_embeddings(folder_path, full_rebuild=False, progress=None, cancel_event=None,
+                     chunk_tokens=None, overlap_tokens=None, paths=None, throttle=None):
+    # progress(dict) is called from worker threads; setting cancel_event abandons the new generation.
+    # True once the folder is indexed; the last progress report's 'published' says whether anything
+    # changed that readers have to reload (False when the index was already up to date).
+    # paths limits the update to those files and folders (the watcher's changes); throttle() is
+    # called between files and batches and may block to pause the build
+    with build_lock:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        old_generation = current_generation()
+        new_generation = max([old_generation or 0] + list_generations()) + 1
+        tracker = BuildProgress(progress, cancel_event, throttle=throttle)
+        try:
+            params = chunk_params(chunk_tokens, overlap_tokens)
+            return update_generation(folder_path, old_generation, new_generation, full_rebuild, tracker, params,
+                                     paths)
+        except BuildCancelled:
+            print("RAG update cancelled")
+            shutil.rmtree(generation_dir(new_generation), ignore_errors=True)
+            return False
+        except Exception:
+            shutil.rmtree(generation_dir(new_generation), ignore_errors=True)
+            raise
+
+def list_generations():
+    if not os.path.isdir(INDEX_DIR):
+        return []
+    return [int(name[4:]) for name in os.listdir(INDEX_DIR) if name.startswith("gen-") and name[4:].isdigit()]
+
+def iter_changed_files(paths, files):
+    # Source files at or under the given paths, plus indexed ones there that may be gone now
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found.update(iter_source_files(path))
+        elif Path(path).suffix.lower() in SOURCE_SUFFIXES and os.path.isfile(path):
+            found.add(path)
+        prefix = path.rstrip("\\/") + os.sep
+        found.update(f for f in files if f == path or f.startswith(prefix))
+    return sorted(found)
+
+def has_changes(folder_path, generation, params, tracker, paths=None):
+    # Stats the files against the last generation's signatures, so an update that finds nothing
+    # to do reads neither the index nor the per-file chunk ids
+    scan = load_scan_info(generation)
+    if scan is None or scan['embedder'] != embedder_id() or scan['chunking'] != params:
+        return True
+    segments = scan['lexical_segments']
+    if segments is None or any(not os.path.exists(os.path.join(INDEX_DIR, f))
+                               for name in segments for f in lexical.segment_files(name)):
+        return True
+    signatures = scan['files']
+    candidates = iter_changed_files(paths, signatures) if paths is not None else iter_source_files(folder_path)
+    for file_path in candidates:
+        tracker.check_cancelled()
+        signature = signatures.get(file_path)
+        try:
+            if signature is None or tuple(signature) != file_signature(file_path):
+                return True
+        except OSError:
+            return True  # indexed, but gone now
+        tracker.files_scanned += 1
+        tracker.report()
+    # A full scan also has to account for every indexed file
+    return paths is None and tracker.files_scanned != len(signatures)
+
+def update_generation(folder_path, old_generation, new_generation, full_rebuild, tracker, params, paths=None):
+    if not full_rebuild and not has_changes(folder_path, old_generation, params, tracker, paths):
+        tracker.files_total = tracker.files_scanned
+        tracker.stage = "done"
+        tracker.report(force=True)
+        return True
+    tracker.files_scanned = 0
+
+    manifest = None if full_rebuild else load_manifest(old_generation)
+    index, metadata = load_existing_index(old_generation, manifest, params)
+    fresh = index is None
+    if fresh:
+        manifest = {
+            'embedder': embedder_id(),
+            'chunking': params,
+            'next_id': 0,
+            'chunk_file': f"chunks-{new_generation:06d}.bin",
+            'index': {'type': "flat", 'params': {}, 'tombstones': 0},
+            'lexical_segments': [],
+            'files': {},
+        }
+        metadata = ChunkMetadata()
+    backfilled = 'lexical_segments' not in manifest
+    if backfilled:
+        backfill_lexical(manifest, metadata, old_generation, f"lex-{new_generation:06d}-b")
+    files = manifest['files']
+    blob_path = os.path.join(INDEX_DIR, manifest['chunk_file'])
+
+    if paths is not None and not fresh:
+        # Files outside the changed paths are left as they are
+        candidates = iter_changed_files(paths, files)
+        changed = set(candidates)
+        seen = {f for f in files if f not in changed}
+        candidates = [f for f in candidates if os.path.isfile(f)]
+    else:
+        candidates = None
+        seen = set()
+    tracker.files_total = len(candidates) if candidates is not None else sum(1 for _ in iter_source_files(folder_path))
+    tracker.report(force=True)
+
+    touched = []
+    failed = set()
+
+    def scan():
+        # Only files whose mtime/size moved are sent on to be hashed and parsed
+        for file_path in candidates if candidates is not None else iter_source_files(folder_path):
+            tracker.check_cancelled()
+            seen.add(file_path)
+            mtime_ns, size = file_signature(file_path)
+            entry = files.get(file_path)
+            if entry and entry['mtime_ns'] == mtime_ns and entry['size'] == size:
+                tracker.files_scanned += 1
+                continue
+            touched.append((file_path, mtime_ns, size))
+            yield file_path, entry['hash'] if entry else None
+
+    writer = None
+    lexical_writer = lexical.SegmentWriter(INDEX_DIR, f"lex-{new_generation:06d}")
+    cache = embedding_cache.EmbeddingCache(os.path.join(INDEX_DIR, EMBED_CACHE_DIR), EMBED_CACHE_MAX_BYTES)
+    sink = None
+    stale_ids = []
+    batch = []
+    batch_first_id = manifest['next_id']
+    tracker.stage = "embedding"
+    try:
+        for file_path, digest, chunks, error in iter_extracted(scan(), params):
+            tracker.check_cancelled()
+            tracker.files_scanned += 1
+            tracker.report()
+            if error is not None:
+                print(f"Error reading {file_path}: {error}")
+                failed.add(file_path)
+                continue
+            old = files.get(file_path)
+            if chunks is None:
+                # Touched but byte-identical: keep its vectors
+                continue
+            if old:
+                stale_ids.extend(old['chunk_ids'])
+
+            if sink is None:
+                os.makedirs(generation_dir(new_generation), exist_ok=True)
+                base_offsets = None if fresh else generation_path(old_generation, CHUNK_OFFSETS_FILE)
+                writer = ChunkWriter(blob_path, generation_path(new_generation, CHUNK_OFFSETS_FILE), base_offsets)
+                sink = EmbeddingSink(index, manifest['index'], writer, lexical_writer, tracker, cache, params)
+
+            first_id = manifest['next_id']
+            manifest['next_id'] += len(chunks)
+            tracker.chunks_queued += len(chunks)
+            files[file_path] = {'hash': digest, 'chunk_ids': list(range(first_id, manifest['next_id']))}
+            for idx, chunk in enumerate(chunks):
+                metadata.append(file_path, idx)
+                batch.append(chunk)
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    sink.put(batch_first_id, batch)
+                    batch_first_id += len(batch)
+                    batch = []
+        if batch:
+            sink.put(batch_first_id, batch)
+    finally:
+        if sink is not None:
+            sink.close()
+            writer.close()
+            index = sink.index
+            manifest['lexical_segments'] += lexical_writer.close()
+            cache.save()  # also after a cancelled build, so its embeddings are not lost
+    tracker.check_cancelled()
+    tracker.stage = "writing"
+    tracker.report(force=True)
+
+    if not seen and not files:
         print("No text files found!")
         return False
-    
-    all_chunks = []
-    all_metadata = []
-    
-    for file_path, content in text_data:
-        chunks = chunk_text(content)
-        
-        for idx, chunk in enumerate(chunks):
-            all_chunks.append(chunk)
-            all_metadata.append((file_path, idx))
-    
-    if not all_chunks:
+
+    # Entries of touched files get their new signature (hash is already current)
+    for file_path, mtime_ns, size in touched:
+        if file_path in files and file_path not in failed:
+            files[file_path]['mtime_ns'] = mtime_ns
+            files[file_path]['size'] = size
+
+    deleted = [path for path in files if path not in seen]
+    for path in deleted:
+        stale_ids.extend(files.pop(path)['chunk_ids'])
+
+    if index is None:
         print("No chunks created from files!")
         return False
 
-    embeddings = embed_chunks(all_chunks)
-    build_faiss_index(embeddings, all_chunks, all_metadata)
+    if sink is None and not stale_ids:
+        # Nothing to re-embed; signatures are refreshed in place since no mapped file changes
+        if touched or backfilled:
+            metadata.save(old_generation, manifest_signatures(manifest), arrays=False)
+            save_manifest(old_generation, manifest)
+            tracker.published = True  # same generation, but loaded metadata has the old signatures
+        tracker.stage = "done"
+        tracker.report(force=True)
+        return True
+
+    os.makedirs(generation_dir(new_generation), exist_ok=True)
+    offsets_path = generation_path(new_generation, CHUNK_OFFSETS_FILE)
+    if sink is None:
+        shutil.copyfile(generation_path(old_generation, CHUNK_OFFSETS_FILE), offsets_path)
+
+    # Remove the vectors of deleted files and of the old versions of changed ones
+    compacted = False
+    if stale_ids:
+        remove_chunk_vectors(index, manifest['index'], stale_ids)
+        for chunk_id in stale_ids:
+            metadata.remove(chunk_id)
+
+        # Rewrite the chunk text into a new blob once more than half of it belongs to removed chunks
+        live_ids = metadata.live_ids()
+        if ChunkStore.live_fraction(live_ids, offsets_path) < 0.5:
+            manifest['chunk_file'] = f"chunks-{new_generation:06d}.bin"
+            new_blob_path = os.path.join(INDEX_DIR, manifest['chunk_file'])
+            ChunkStore.compact(live_ids, offsets_path, blob_path, new_blob_path)
+            compacted = True
+
+    # Postings of removed chunks are only dropped when segments are merged
+    segments = manifest['lexical_segments']
+    if len(segments) > lexical.MAX_SEGMENTS or (compacted and segments):
+        manifest['lexical_segments'] = lexical.merge_segments(INDEX_DIR, segments, metadata.live_mask(),
+                                                              f"lex-{new_generation:06d}-m")
+
+    import faiss
+    index = finalize_index(index, manifest['index'], metadata)
+    faiss.write_index(index, generation_path(new_generation, INDEX_FILE))
+    metadata.save(new_generation, manifest_signatures(manifest))
+    save_manifest(new_generation, manifest)
+
+    publish_generation(new_generation)
+    tracker.published = True
+    clear_query_caches()
+    cleanup_generations([g for g in (new_generation, old_generation) if g is not None])
+    tracker.stage = "done"
+    tracker.report(force=True)
     
     return True
 
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.items)}
+
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+
+def normalize_query(query):
+    # MiniLM is uncased and ignores extra whitespace, so this doesn't change the embedding
+    return " ".join(query.lower().split())
+
+def embed_query(query, embedder):
+    key = (id(embedder), normalize_query(query))
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        with tracing.span('embed_query'):
+            embedding = embedder.encode([query])
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+def clear_query_caches():
+    query_embedding_cache.clear()
+    retrieval_cache.clear()
+
+def cache_stats():
+    return {
+        'query_embeddings': query_embedding_cache.stats(),
+        'retrievals': retrieval_cache.stats(),
+    }
+
+search_pool = ThreadPoolExecutor(max_workers=2)
+
+def vector_search(query, embedder, index, data, k):
+    return vector_search_batch(embed_query(query, embedder), index, data, k)[0]
+
+def vector_search_batch(query_embeddings, index, data, k):
+    # Over-fetch when HNSW tombstones may take some of the top slots
+    search_k = k * 2 if data.get('tombstones') else k
+    with tracing.span('vector_search'):
+        D, I = index.search(query_embeddings, search_k)
+    metadata = data['metadata']
+    # FAISS pads with -1 when the index has fewer than k vectors
+    return [[int(i) for i in row if i >= 0 and metadata[i] is not None][:k] for row in I]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
 def retrieve_relevant_chunks(query, embedder, index, data, top_k=2):
-    query_embedding = embedder.encode([query])
-    D, I = index.search(query_embedding, top_k)
+    if index is None or data is None:
+        return []
+
+    # Results are keyed by index generation, so a rebuilt index never serves old hits
+    cache_key = (normalize_query(query), top_k, data.get('generation'))
+    cached = retrieval_cache.get(cache_key)
+    tracing.record(retrieval_cache_hit=cached is not None)
+    if cached is not None:
+        return list(cached)
+
+    # FAISS searches on the pool while the lexical search runs on this thread
+    candidates = top_k * 4
+    vector_hits = tracing.submit(search_pool, vector_search, query, embedder, index, data, candidates)
+    lexical_index = data.get('lexical')
+    with tracing.span('lexical_search'):
+        lexical_hits = lexical_index.search(query, candidates) if lexical_index is not None else []
+    ranked = reciprocal_rank_fusion([vector_hits.result(), lexical_hits])
+
     chunks = []
     metadata = data['metadata']
+    store = data['chunks']
     
-    for i in I[0]:
+    for i in ranked[:top_k]:
         file_path, chunk_idx = metadata[i]
-        # Re-chunk for exact file
-        try:
-            if file_path.endswith('.txt') or file_path.endswith('.md'):
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    file_chunks = chunk_text(content)
-                    if chunk_idx < len(file_chunks):
-                        chunks.append(file_chunks[chunk_idx])
-            elif file_path.endswith('.pdf'):
-                with fitz.open(file_path) as doc:
-                    content = ""
-                    for page in doc:
-                        content += page.get_text()
-                    file_chunks = chunk_text(content)
-                    if chunk_idx < len(file_chunks):
-                        chunks.append(file_chunks[chunk_idx])
-        # TODO: Add the png support here
-                    
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
+        with tracing.span('stale_check'):
+            stale = is_stale(data, file_path)
+        if stale:
+            print(f"{file_path} changed since it was indexed; retrieve new data to refresh it")
+        chunks.append(store.get(i))
     
+    retrieval_cache.put(cache_key, tuple(chunks))
     return chunks
 
+def retrieve_batch(queries, embedder, index, data, top_k=2):
+    # Many queries at once: one encode call and one FAISS search for the whole batch.
+    # Returns the fused chunk ids per query; see chunk_provenance for where they came from
+    if index is None or data is None or not queries:
+        return [[] for _ in queries]
+    candidates = top_k * 4
+    embeddings = embedder.encode(list(queries), convert_to_numpy=True)
+    vector_hits = vector_search_batch(embeddings, index, data, candidates)
+    lexical_index = data.get('lexical')
+    results = []
+    for query, hits in zip(queries, vector_hits):
+        lexical_hits = lexical_index.search(query, candidates) if lexical_index is not None else []
+        results.append(reciprocal_rank_fusion([hits, lexical_hits])[:top_k])
+    return results
+
+def chunk_provenance(data, chunk_id):
+    file_path, chunk_idx = data['metadata'][chunk_id]
+    return {'chunk_id': int(chunk_id), 'path': file_path, 'chunk_index': chunk_idx, 'text': data['chunks'].get(chunk_id)}
+
 def build_prompt(retrieved_chunks, user_question):
     context = "\n\n".join(retrieved_chunks)
     return f"Here is some context about the user:\n\n{context}. You may not= need to use this information to answer the question; it's just to provide more context.\n\nHere is the question: {user_question}"
 
+def read_index_mapped(path):
+    import faiss
+    for mode, flag_names in INDEX_MAP_MODES:
+        if not all(hasattr(faiss, name) for name in flag_names):
+            continue
+        flags = 0
+        for name in flag_names:
+            flags |= getattr(faiss, name)
+        try:
+            index = faiss.read_index(path, flags)
+            print(f"RAG index loaded ({mode})")
+            return index
+        except RuntimeError:
+            pass
+    print("RAG index loaded into RAM (this faiss build can't map it)")
+    return faiss.read_index(path)
+
 def load_faiss_index_and_metadata():
+    generation = current_generation()
+    if generation is None:
+        print("Add some user context")
+        return None, None
     try: 
-        index = faiss.read_index("rag_index.faiss")
-        with open("rag_metadata.pkl", "rb") as f:
-            metadata = pickle.load(f)
+        # Mapped read-only so startup doesn't copy the index into RAM and processes share pages
+        index = read_index_mapped(generation_path(generation, INDEX_FILE))
+        metadata = {'metadata': ChunkMetadata.load(generation)}
+        manifest = load_manifest(generation)
+        index_info = manifest.get('index', {'type': "flat", 'params': {}, 'tombstones': 0})
+        apply_search_params(index, index_info['type'], index_info['params'])
+        metadata['generation'] = generation
+        metadata['index_type'] = index_info['type']
+        metadata['tombstones'] = index_info['tombstones']
+        metadata['chunks'] = ChunkStore(os.path.join(INDEX_DIR, manifest['chunk_file']),
+                                        generation_path(generation, CHUNK_OFFSETS_FILE))
+        # Indexes built before lexical search existed fall back to vector-only until the next update
+        segments = manifest.get('lexical_segments')
+        metadata['lexical'] = None if segments is None else \
+            lexical.LexicalIndex(INDEX_DIR, segments, metadata['metadata'].live_mask())
         return index, metadata
     except RuntimeError as e:
         print("Add some user context")
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import time
+import tuning
+
+# Offline batch mode: questions from a JSONL file in, answers with their retrieved chunks
+# and per-item timings out. The output is appended one line per finished item, so an
+# interrupted run picks up where it stopped when started again with the same output file
+
+QUESTION_FIELDS = ('question', 'prompt', 'query')
+
+def read_items(input_path):
+    items = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Skipping line {line_no}: not valid JSON")
+                continue
+            if isinstance(record, str):
+                record = {'question': record}
+            question = next((record[field] for field in QUESTION_FIELDS if isinstance(record.get(field), str)), None)
+            if question is None:
+                print(f"Skipping line {line_no}: no {'/'.join(QUESTION_FIELDS)} field")
+                continue
+            item_id = str(record.get('id', record.get('request_id', line_no)))
+            items.append({'id': item_id, 'question': question})
+    return items
+
+def finished_ids(output_path):
+    # A run killed mid-write can leave a partial last line; cut it off before appending
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    done = set()
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            done.add(str(json.loads(line)['id']))
+        except (ValueError, KeyError, TypeError):
+            pass
+    return done
+
+def retrieve_all(items, top_k):
+    import RAG
+    index, data = RAG.load_faiss_index_and_metadata()
+    if index is None:
+        print("No RAG index; answering without context")
+        return 0.0
+    start = time.perf_counter()
+    results = RAG.retrieve_batch([item['question'] for item in items], RAG.get_embedder(), index, data, top_k=top_k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for item, chunk_ids in zip(items, results):
+        item['chunk_ids'] = chunk_ids
+        item['context'] = [RAG.chunk_provenance(data, chunk_id) for chunk_id in chunk_ids]
+    return elapsed_ms
+
+def answer(item, max_tokens, n_threads, engine):
+    from response import assemble_prompt, stream_ai
+    from RAG import build_prompt
+    chunks = [c['text'] for c in item.get('context', [])]
+    start = time.perf_counter()
+    plan = assemble_prompt(item['question'], max_tokens, context_chunks=chunks,
+                           build_prompt=build_prompt if chunks else None, engine=engine, n_threads=n_threads)
+    first_token = None
+    parts = []
+    for text in stream_ai(plan['prompt'], max_tokens, n_threads=n_threads, engine=engine):
+        if first_token is None:
+            first_token = time.perf_counter()
+        parts.append(text)
+    end = time.perf_counter()
+    gen_sec = end - (first_token or end)
+    completion_tokens = engine.last_completion_stats['completion_tokens']
+    return "".join(parts), {
+        'prompt_tokens': plan['prompt_tokens'],
+        'cached_tokens': engine.last_prompt_stats['cached_tokens'],
+        'completion_tokens': completion_tokens,
+        'finish_reason': engine.last_completion_stats['finish_reason'],
+        'chunks_used': len(plan['chunks']),
+        'ttft_ms': ((first_token or end) - start) * 1000,
+        'total_ms': (end - start) * 1000,
+        'tokens_per_sec': (completion_tokens - 1) / gen_sec if completion_tokens > 1 and gen_sec > 0 else 0.0,
+    }
+
+def run_batch(input_path, output_path, max_tokens=256, n_threads=None, top_k=2, use_rag=True):
+    items = read_items(input_path)
+    done = finished_ids(output_path)
+    pending = [item for item in items if item['id'] not in done]
+    print(f"{len(items)} items, {len(items) - len(pending)} already answered, {len(pending)} to go")
+    if not pending:
+        return
+
+    retrieval_ms = retrieve_all(pending, top_k) if use_rag else 0.0
+    # Items retrieving the same chunks run back to back so the shared context prefix
+    # stays in the KV cache; sorted() is stable, so input order is kept within a group
+    pending = sorted(pending, key=lambda item: item.get('chunk_ids', []))
+
+    from response import default_engine
+    engine = default_engine
+    engine.configure(**tuning.load_config(engine.model_path))
+    engine.get(n_threads=n_threads)
+    per_item_retrieval_ms = retrieval_ms / len(pending)
+    with open(output_path, "a", encoding="utf-8") as out:
+        for n, item in enumerate(pending, 1):
+            text, timings = answer(item, max_tokens, n_threads, engine)
+            timings['retrieval_ms'] = per_item_retrieval_ms  # batched, so amortized over the run
+            record = {
+                'id': item['id'],
+                'question': item['question'],
+                'answer': text,
+                'context': [{k: v for k, v in c.items() if k != 'text'} for c in item.get('context', [])],
+                'timings': timings,
+            }
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            print(f"[{n}/{len(pending)}] {item['id']}: {timings['total_ms']:.0f} ms, "
+                  f"{timings['cached_tokens']}/{timings['prompt_tokens']} prompt tokens cached")
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with LocAI")
+    parser.add_argument("input", help="JSONL with one question per line ('question', 'prompt' or 'query' field)")
+    parser.add_argument("output", help="JSONL answers; appended to, and resumed from if it already exists")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=tuning.default_threads())
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--no-rag", action="store_true", help="answer without retrieved context")
+    args = parser.parse_args()
+    try:
+        run_batch(args.input, args.output, max_tokens=args.max_tokens, n_threads=args.threads,
+                  top_k=args.top_k, use_rag=not args.no_rag)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tuning
+
+# Benchmarks for ingestion, index loading, retrieval and generation on a synthetic corpus.
+# Results are written as JSON; --baseline compares them against an earlier run
+
+# metric -> True when lower is better
+METRICS = {
+    'build.files_per_sec': False,
+    'build.chunks_per_sec': False,
+    'build.peak_rss_mb': True,
+    'build.noop_update_sec': True,
+    'build.cached_rebuild_sec': True,
+    'load.median_ms': True,
+    'retrieval.p50_ms': True,
+    'retrieval.p99_ms': True,
+    'generation.ttft_ms': True,
+    'generation.tokens_per_sec': False,
+}
+
+def make_corpus(folder, files, words_per_file, pdf_share=0.0, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    pdf_files = int(files * pdf_share)
+    os.makedirs(folder, exist_ok=True)
+    for n in range(files):
+        sentences = []
+        for _ in range(max(1, words_per_file // 12)):
+            sentences.append(" ".join(rng.choice(vocabulary) for _ in range(12)).capitalize() + ".")
+        text = " ".join(sentences)
+        if n < pdf_files:
+            import fitz
+            doc = fitz.open()
+            page = doc.new_page()
+            page.insert_textbox(page.rect, text, fontsize=6)
+            doc.save(os.path.join(folder, f"doc{n:05d}.pdf"))
+            doc.close()
+        else:
+            with open(os.path.join(folder, f"doc{n:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+    return vocabulary
+
+class PeakRSS:
+    # Samples this process and its children (the extraction pool) on a background thread
+    def __init__(self, interval=0.05):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except Exception:
+                pass  # child exited between listing and reading
+        self.peak = max(self.peak, total)
+
+    def run(self):
+        while not self.done.is_set():
+            self.sample()
+            self.done.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.sample()
+
+class StubLlama:
+    # Stands in for llama_cpp.Llama: whitespace tokens and a fixed per-token delay,
+    # so prompt caching and streaming paths run without a model file
+    def __init__(self, n_ctx=4096, token_delay=0.005):
+        import numpy as np
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.n_tokens = 0
+        self.context_size = n_ctx
+        self.token_delay = token_delay
+
+    def tokenize(self, text, add_bos=True):
+        return ([1] if add_bos else []) + [hash(word) % 32000 for word in text.split()]
+
+    def detokenize(self, tokens):
+        return b" ".join(b"x" for _ in tokens)
+
+    def n_ctx(self):
+        return self.context_size
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def save_state(self):
+        return self.input_ids.copy(), self.n_tokens
+
+    def load_state(self, state):
+        self.input_ids[:], self.n_tokens = state[0], state[1]
+
+    def __call__(self, tokens, max_tokens=16, stream=True, **kwargs):
+        # Like Llama.generate, only the tokens after the cached prefix are evaluated
+        from response import common_prefix_length
+        reused = common_prefix_length(self.input_ids[:self.n_tokens].tolist(), tokens[:-1])
+        time.sleep(self.token_delay * 0.1 * (len(tokens) - reused))
+        self.input_ids[:len(tokens)] = tokens
+        self.n_tokens = len(tokens)
+
+        def generate():
+            for i in range(max_tokens):
+                time.sleep(self.token_delay)
+                yield {'choices': [{'text': f" tok{i}", 'finish_reason': "length" if i == max_tokens - 1 else None}]}
+        return generate()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def bench_build(corpus):
+    import RAG
+    progress = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        RAG.build_embeddings(corpus, full_rebuild=True, progress=progress.append)
+        elapsed = time.perf_counter() - start
+    final = progress[-1] if progress else {}
+    start = time.perf_counter()
+    RAG.build_embeddings(corpus)  # nothing changed: measures the scan-only path
+    noop = time.perf_counter() - start
+    start = time.perf_counter()
+    RAG.build_embeddings(corpus, full_rebuild=True)  # every chunk comes from the embedding cache
+    cached_rebuild = time.perf_counter() - start
+    return {
+        'files': final.get('files_total', 0),
+        'chunks': final.get('chunks_embedded', 0),
+        'seconds': elapsed,
+        'files_per_sec': final.get('files_total', 0) / elapsed,
+        'chunks_per_sec': final.get('chunks_embedded', 0) / elapsed,
+        'peak_rss_mb': rss.peak / 2**20,
+        'noop_update_sec': noop,
+        'cached_rebuild_sec': cached_rebuild,
+    }
+
+def bench_load(runs):
+    import RAG
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        RAG.load_faiss_index_and_metadata()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'runs': runs, 'median_ms': statistics.median(times), 'max_ms': max(times)}
+
+def bench_retrieval(vocabulary, queries, top_k, seed=0):
+    import RAG
+    rng = random.Random(seed)
+    index, data = RAG.load_faiss_index_and_metadata()
+    embedder = RAG.get_embedder()
+    RAG.retrieve_relevant_chunks("warm up", embedder, index, data, top_k=top_k)
+    times = []
+    for _ in range(queries):
+        query = " ".join(rng.choice(vocabulary) for _ in range(6))
+        RAG.clear_query_caches()  # cold path: every query is embedded and searched
+        start = time.perf_counter()
+        RAG.retrieve_relevant_chunks(query, embedder, index, data, top_k=top_k)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'queries': queries, 'p50_ms': percentile(times, 50), 'p99_ms': percentile(times, 99),
+            'mean_ms': statistics.mean(times)}
+
+def generation_prompt(n, prompt_text=None):
+    return f"{prompt_text}\n\nBenchmark question number {n}" if prompt_text else f"Benchmark question number {n}"
+
+def bench_generation(engine, runs, max_tokens, n_threads, prompt_text=None):
+    from response import stream_ai
+    ttfts = []
+    rates = []
+    drafted = accepted = 0
+    for n in range(runs):
+        start = time.perf_counter()
+        first = None
+        for _ in stream_ai(generation_prompt(n, prompt_text), max_tokens, n_threads=n_threads, engine=engine):
+            if first is None:
+                first = time.perf_counter()
+        end = time.perf_counter()
+        count = engine.last_completion_stats['completion_tokens']
+        ttfts.append(((first or end) - start) * 1000)
+        if first is not None and end > first:
+            rates.append((count - 1) / (end - first))
+        if engine.last_draft_stats:
+            drafted += engine.last_draft_stats['drafted_tokens']
+            accepted += engine.last_draft_stats['accepted_tokens']
+    results = {'runs': runs, 'max_tokens': max_tokens, 'ttft_ms': statistics.median(ttfts),
+               'tokens_per_sec': statistics.median(rates) if rates else 0.0}
+    if drafted:
+        results['acceptance_rate'] = accepted / drafted
+    return results
+
+def check_greedy(engine, runs, max_tokens, n_threads, prompt_text=None):
+    # Speculative decoding must not change what greedy decoding produces: every prompt is answered
+    # with it and then without it (the model is reloaded in between), and the answers compared
+    from response import ask_ai
+    prompts = [generation_prompt(n, prompt_text) for n in range(runs)]
+    speculative = [ask_ai(p, max_tokens, n_threads=n_threads, engine=engine, temperature=0.0) for p in prompts]
+    mode = engine.speculative
+    engine.configure(speculative="off")
+    try:
+        plain = [ask_ai(p, max_tokens, n_threads=n_threads, engine=engine, temperature=0.0) for p in prompts]
+    finally:
+        engine.configure(speculative=mode)
+    return sum(a == b for a, b in zip(speculative, plain)) / len(prompts)
+
+def metric_value(results, name):
+    section, key = name.split(".")
+    return results.get(section, {}).get(key)
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, lower_is_better in METRICS.items():
+        new, old = metric_value(results, name), metric_value(baseline, name)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        print(f"{name:28} {old:12.3f} -> {new:12.3f} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LocAI ingestion, retrieval and generation")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--words", type=int, default=2000, help="words per synthetic file")
+    parser.add_argument("--pdf-share", type=float, default=0.0, help="share of files written as PDF")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--load-runs", type=int, default=5)
+    parser.add_argument("--gen-runs", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=tuning.default_threads())
+    parser.add_argument("--model", help="GGUF to benchmark generation with; the stub LLM is used otherwise")
+    parser.add_argument("--speculative", default="off", help="speculative decoding mode for --model")
+    parser.add_argument("--draft-model", help="draft GGUF for --speculative draft-model")
+    parser.add_argument("--rag-prompt", action="store_true", help="generate from prompts carrying RAG-style context")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    import RAG
+    from response import LlamaEngine
+
+    work_dir = tempfile.mkdtemp(prefix="locai-bench-")
+    # Point the index at the scratch folder so the user's own index is never touched
+    RAG.INDEX_DIR = os.path.join(work_dir, "rag_index")
+    RAG.CURRENT_PATH = os.path.join(RAG.INDEX_DIR, "CURRENT")
+    try:
+        corpus = os.path.join(work_dir, "corpus")
+        vocabulary = make_corpus(corpus, args.files, args.words, args.pdf_share, args.seed)
+        results = {
+            'config': vars(args),
+            'env': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpu_count': os.cpu_count()},
+        }
+        print("Building index...")
+        results['build'] = bench_build(corpus)
+        print("Loading index...")
+        results['load'] = bench_load(args.load_runs)
+        print("Retrieving...")
+        results['retrieval'] = bench_retrieval(vocabulary, args.queries, args.top_k, args.seed)
+
+        print("Generating...")
+        if args.model:
+            engine = LlamaEngine(model_path=args.model, speculative=args.speculative,
+                                 draft_model_path=args.draft_model)
+        else:
+            engine = LlamaEngine(model_path="stub")
+            engine.llm = StubLlama(n_ctx=engine.n_ctx)
+            engine.n_threads = args.threads  # so get() keeps the stub instead of loading a model
+        context = None
+        if args.rag_prompt:
+            # Context the answer can copy from, where speculative decoding pays off most
+            rng = random.Random(args.seed)
+            context = RAG.build_prompt([" ".join(rng.choice(vocabulary) for _ in range(60)) for _ in range(3)],
+                                       "Repeat the context above.")
+        results['generation'] = bench_generation(engine, args.gen_runs, args.max_tokens, args.threads, context)
+        results['generation']['llm'] = args.model or "stub"
+        results['generation']['speculative'] = args.speculative if args.model else "off"
+        if args.model and args.speculative != "off":
+            print("Checking greedy output against decoding without speculation...")
+            results['generation']['greedy_match'] = check_greedy(engine, args.gen_runs, args.max_tokens,
+                                                                 args.threads, context)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    greedy_match = results['generation'].get('greedy_match', 1.0)
+    if greedy_match < 1.0:
+        print(f"Speculative decoding changed the greedy output of {1 - greedy_match:.0%} of the prompts")
+        raise SystemExit(1)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import time
+import numpy as np
+
+# Embedder backends for RAG. All of them expose encode(texts, convert_to_numpy=True, batch_size=None)
+# like SentenceTransformer, and return L2-normalized float32 vectors of the same model:
+#   sentence-transformers  the reference PyTorch model
+#   onnx                   ONNX Runtime export of the same weights
+#   onnx-int8              the export with dynamically int8-quantized weights
+# ONNX variants are exported on first use and checked against the reference before being trusted;
+# an int8 export that is off tolerance falls back to the fp32 one, then to the reference model
+
+BACKENDS = ("sentence-transformers", "onnx", "onnx-int8")
+MAX_SEQ_LENGTH = 256
+MIN_COSINE = 0.98  # lowest cosine similarity to the reference vectors an ONNX backend may have
+BATCH_SIZE_CANDIDATES = (16, 32, 64, 128)
+VERIFY_TEXTS = [
+    "The quarterly report is due on Friday.",
+    "Invoice AB-1234 was paid in full on March 3rd.",
+    "Meet me at the coffee shop near the station at noon.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "My passport expires next year, so I need to renew it before the trip.",
+    "def add(a, b): return a + b",
+    "Die Besprechung wurde auf nächste Woche verschoben.",
+    "ok",
+]
+VERIFY_PASSAGE_WORDS = (16, 32, 48, 64, 96, 128, 160, 192, 224, 256, 320, 400)  # the longest are truncated
+TUNING_SUFFIX = ".tuning.json"
+
+def verify_texts():
+    # Short texts plus passages up to and past MAX_SEQ_LENGTH tokens: int8 error grows with length
+    words = " ".join(VERIFY_TEXTS * 20).split()
+    return list(VERIFY_TEXTS) + [" ".join(words[i * 7:i * 7 + n]) for i, n in enumerate(VERIFY_PASSAGE_WORDS)]
+
+def length_buckets(lengths, batch_size):
+    # Batches of similar length need far less padding than batches in input order
+    order = np.argsort(lengths, kind="stable")
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+class SentenceTransformerEmbedder:
+    name = "sentence-transformers"
+
+    def __init__(self, model_dir, batch_size=None):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_dir)
+        self.batch_size = batch_size
+        self.tuning_path = os.path.join(model_dir, self.name + TUNING_SUFFIX)
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=None):
+        # SentenceTransformer sorts by length inside encode already
+        return self.model.encode(list(texts), convert_to_numpy=True, batch_size=batch_size or self.batch_size or 64)
+
+class OnnxEmbedder:
+    def __init__(self, onnx_path, model_dir, name="onnx", batch_size=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self.name = name
+        self.session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.no_padding()
+        self.batch_size = batch_size
+        self.tuning_path = onnx_path + TUNING_SUFFIX
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=None):
+        texts = list(texts)
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = np.array([len(e.ids) for e in encodings], dtype=np.int64)
+        out = None
+        for bucket in length_buckets(lengths, batch_size or self.batch_size or 32):
+            width = int(lengths[bucket].max())
+            ids = np.zeros((len(bucket), width), dtype=np.int64)
+            mask = np.zeros((len(bucket), width), dtype=np.int64)
+            for row, i in enumerate(bucket):
+                ids[row, :lengths[i]] = encodings[i].ids
+                mask[row, :lengths[i]] = 1
+            feeds = {'input_ids': ids, 'attention_mask': mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            # Same head as the sentence-transformers model: mean pooling, then L2 normalize
+            pooled = (hidden * mask[..., None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            out[bucket] = pooled
+        return out if out is not None else np.zeros((0, 0), dtype=np.float32)
+
+def onnx_paths(model_dir):
+    folder = os.path.join(model_dir, "onnx")
+    return os.path.join(folder, "model.onnx"), os.path.join(folder, "model_int8.onnx")
+
+def export_onnx(model_dir, onnx_path):
+    import torch
+    from transformers import AutoModel
+    print(f"Exporting {model_dir} to ONNX")
+    model = AutoModel.from_pretrained(model_dir).eval()
+    sample = torch.ones((1, 8), dtype=torch.int64)
+    axes = {0: "batch", 1: "sequence"}
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    torch.onnx.export(
+        model, (sample, sample, torch.zeros_like(sample)), onnx_path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes, "last_hidden_state": axes},
+        opset_version=14,
+    )
+
+def quantize_onnx(onnx_path, int8_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    print("Quantizing the ONNX embedder to int8")
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+
+def min_cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
+
+def verify(embedder, onnx_path, model_dir):
+    # Compared once against the reference model; the result is kept next to the .onnx file
+    marker = onnx_path + ".verified.json"
+    texts = verify_texts()
+    sample = hashlib.blake2b(json.dumps(texts).encode("utf-8"), digest_size=8).hexdigest()
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        if result.get('size') == os.path.getsize(onnx_path) and result.get('sample') == sample:
+            return result['min_cosine']
+    except (OSError, ValueError, KeyError):
+        pass
+    reference = SentenceTransformerEmbedder(model_dir)
+    cosine = min_cosine(embedder.encode(texts), reference.encode(texts))
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({'min_cosine': cosine, 'size': os.path.getsize(onnx_path), 'sample': sample}, f)
+    return cosine
+
+def load_onnx(backend, model_dir, batch_size=None):
+    onnx_path, int8_path = onnx_paths(model_dir)
+    if not os.path.exists(onnx_path):
+        export_onnx(model_dir, onnx_path)
+    if backend == "onnx-int8":
+        if not os.path.exists(int8_path):
+            quantize_onnx(onnx_path, int8_path)
+        onnx_path = int8_path
+    return OnnxEmbedder(onnx_path, model_dir, name=backend, batch_size=batch_size), onnx_path
+
+def create_embedder(backend, model_dir, batch_size=None):
+    # Falls back from int8 to fp32 ONNX, and to the reference model when the ONNX stack is missing
+    # or no ONNX backend is within tolerance
+    for name in {'onnx-int8': ("onnx-int8", "onnx"), 'onnx': ("onnx",)}.get(backend, ()):
+        try:
+            embedder, onnx_path = load_onnx(name, model_dir, batch_size)
+            cosine = verify(embedder, onnx_path, model_dir)
+            if cosine >= MIN_COSINE:
+                return load_batch_size(embedder)
+            print(f"{name} embedder is off by cosine {cosine:.4f} (< {MIN_COSINE})")
+        except Exception as e:
+            print(f"Could not load the {name} embedder ({e})")
+    if backend != "sentence-transformers":
+        print("Using the sentence-transformers embedder")
+    return load_batch_size(SentenceTransformerEmbedder(model_dir, batch_size=batch_size))
+
+def load_batch_size(embedder):
+    # A batch size tuned on this machine before; the tuning file sits next to the model
+    if embedder.batch_size is None:
+        try:
+            with open(embedder.tuning_path, "r", encoding="utf-8") as f:
+                tuned = json.load(f)
+            if tuned.get('cpus') == os.cpu_count():
+                embedder.batch_size = int(tuned['batch_size'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    return embedder
+
+def autotune_batch_size(embedder, texts, candidates=BATCH_SIZE_CANDIDATES):
+    # Times each batch size on a sample of real chunks and keeps the fastest, also for later runs
+    best, best_rate = None, 0.0
+    for batch_size in candidates:
+        if batch_size > len(texts) and best is not None:
+            break
+        start = time.perf_counter()
+        embedder.encode(texts, batch_size=batch_size)
+        rate = len(texts) / max(time.perf_counter() - start, 1e-9)
+        if rate > best_rate:
+            best, best_rate = batch_size, rate
+    embedder.batch_size = best
+    try:
+        with open(embedder.tuning_path, "w", encoding="utf-8") as f:
+            json.dump({'batch_size': best, 'cpus': os.cpu_count()}, f)
+    except OSError:
+        pass  # read-only model folder: tuned again next run
+    return best
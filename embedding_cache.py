@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Content-addressed cache of chunk embeddings, shared by every file and every rebuild.
+# Keys are 64-bit hashes of (namespace, chunk text), where the namespace names the embedder
+# and chunking settings. Vectors live in one memory-mapped float16 file; the key index is a
+# sorted array searched in bulk. Once the cache reaches its size limit the least recently
+# used tenth is evicted
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.npz"
+VECTORS_FILE = "vectors.f16"
+GROW_ROWS = 65536
+EVICT_SHARE = 0.1
+
+def chunk_keys(texts, namespace):
+    prefix = namespace.encode("utf-8") + b"\0"
+    keys = np.empty(len(texts), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        digest = hashlib.blake2b(prefix + text.encode("utf-8"), digest_size=8).digest()
+        keys[i] = int.from_bytes(digest, "little")
+    return keys
+
+class EmbeddingCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.dim = None
+        self.capacity = 0
+        self.clock = 0  # bumped once per build; slots remember when they were last used
+        self.keys = np.zeros(0, dtype=np.uint64)  # sorted
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.last_used = np.zeros(0, dtype=np.int64)  # per slot
+        self.free = []
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def load(self):
+        try:
+            with open(self.path(META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            index = np.load(self.path(INDEX_FILE))
+            self.dim, self.capacity, self.clock = meta['dim'], meta['capacity'], meta['clock']
+            self.keys, self.slots, self.last_used = index['keys'], index['slots'], index['last_used']
+            if os.path.getsize(self.path(VECTORS_FILE)) != self.capacity * self.dim * 2:
+                raise ValueError("vector file size does not match")
+        except (OSError, ValueError, KeyError):
+            self.dim, self.capacity, self.clock = None, 0, 0
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.slots = np.zeros(0, dtype=np.int64)
+            self.last_used = np.zeros(0, dtype=np.int64)
+            return
+        used = np.zeros(self.capacity, dtype=bool)
+        used[self.slots] = True
+        self.free = np.flatnonzero(~used).tolist()
+        self.vectors = np.memmap(self.path(VECTORS_FILE), dtype=np.float16, mode="r+", shape=(self.capacity, self.dim))
+        self.clock += 1
+
+    def max_rows(self):
+        return max(1, self.max_bytes // (self.dim * 2))
+
+    def lookup(self, keys):
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, max(len(self.keys) - 1, 0))
+        found = (self.keys[pos] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return pos, found
+
+    def get(self, keys):
+        # Returns (float32 vectors or None, hit mask); rows of misses are left as zeros
+        if self.dim is None or not len(self.keys):
+            self.misses += len(keys)
+            return None, np.zeros(len(keys), dtype=bool)
+        pos, found = self.lookup(keys)
+        vectors = np.zeros((len(keys), self.dim), dtype=np.float32)
+        if found.any():
+            slots = self.slots[pos[found]]
+            vectors[found] = self.vectors[slots]
+            self.last_used[slots] = self.clock
+        self.hits += int(found.sum())
+        self.misses += int((~found).sum())
+        return vectors, found
+
+    def put(self, keys, vectors):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        keys, first = np.unique(keys, return_index=True)
+        vectors = vectors[first]
+        keys_new = ~self.lookup(keys)[1]
+        keys, vectors = keys[keys_new], vectors[keys_new]
+        if not len(keys):
+            return
+        slots = self.take_slots(len(keys))
+        if len(slots) < len(keys):
+            keys, vectors = keys[:len(slots)], vectors[:len(slots)]
+        self.vectors[slots] = vectors.astype(np.float16)
+        self.last_used[slots] = self.clock
+        order = np.argsort(np.concatenate([self.keys, keys]), kind="stable")
+        self.keys = np.concatenate([self.keys, keys])[order]
+        self.slots = np.concatenate([self.slots, slots])[order]
+
+    def take_slots(self, count):
+        if len(self.free) < count and self.capacity < self.max_rows():
+            self.grow(min(self.max_rows(), max(self.capacity + GROW_ROWS, self.capacity + count)))
+        if len(self.free) < count:
+            self.evict(max(count - len(self.free), int(self.capacity * EVICT_SHARE)))
+        slots = np.asarray(self.free[:count], dtype=np.int64)
+        del self.free[:count]
+        return slots
+
+    def grow(self, capacity):
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None  # the mapping has to go before the file can be resized (Windows)
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path(VECTORS_FILE), "ab") as f:
+            f.truncate(capacity * self.dim * 2)
+        self.free.extend(range(self.capacity, capacity))
+        self.last_used = np.concatenate([self.last_used, np.zeros(capacity - self.capacity, dtype=np.int64)])
+        self.capacity = capacity
+        self.vectors = np.memmap(self.path(VECTORS_FILE), dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+
+    def evict(self, count):
+        # Least recently used entries go; the index is saved before their slots are reused,
+        # so a crash can never leave a key pointing at another chunk's vector
+        count = min(count, len(self.keys))
+        victims = np.argsort(self.last_used[self.slots], kind="stable")[:count]
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[victims] = False
+        self.free.extend(self.slots[victims].tolist())
+        self.keys, self.slots = self.keys[keep], self.slots[keep]
+        self.save()
+
+    def save(self):
+        if self.dim is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        if self.vectors is not None:
+            self.vectors.flush()
+        tmp_path = self.path("index.tmp.npz")
+        np.savez(tmp_path, keys=self.keys, slots=self.slots, last_used=self.last_used)
+        os.replace(tmp_path, self.path(INDEX_FILE))
+        tmp_path = self.path(META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'dim': self.dim, 'capacity': self.capacity, 'clock': self.clock}, f)
+        os.replace(tmp_path, self.path(META_FILE))
+
+    def stats(self):
+        return {'entries': len(self.keys), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses}
@@ -2,14 +2,27 @@ import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
 import threading
+import multiprocessing
+import argparse
 import os
 import datetime
-from response import ask_ai
-from RAG import build_embeddings, retrieve_relevant_chunks, build_prompt, load_faiss_index_and_metadata
-from sentence_transformers import SentenceTransformer
+import time
+from response import stream_ai, assemble_prompt, SPECULATIVE_MODES
+from RAG import build_embeddings, retrieve_relevant_chunks, build_prompt, load_faiss_index_and_metadata, cache_stats
+from registry import registry
+from server import ServerClient
+from watcher import FolderWatcher
+from transcript import TranscriptStore
+from memory import ConversationMemory
+import tracing
+import tuning
+
+CHAT_WINDOW_MESSAGES = 200  # messages kept in the chat widget; the rest stay in the transcript store
+CHAT_PAGE_MESSAGES = 50  # paged in when scrolling past either end of the window
+MEMORY_IDLE_MS = 5000  # quiet time after a response before the conversation summary is refreshed
                 
 class AIModelGUI:
-    def __init__(self):
+    def __init__(self, server_url=None):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
         
@@ -28,26 +41,75 @@ class AIModelGUI:
         self.stop_generation = threading.Event()
         self.current_generation_thread = None
 
-        # Store context data for each message
-        self.message_contexts = {} 
-        self.current_message_id = 0
+        # Messages, their RAG context and timings live in SQLite; the widget shows a window of them
+        self.store = TranscriptStore()
+        self.conversation_id = None
+        self.shown_ids = []  # store ids of the messages in the chat widget, oldest first
+        self.has_older = False
+        self.has_newer = False
+        self.ai_message_started = None  # start time of the AI message being streamed
+        self.trace_log = tracing.TraceLog()
+
+        # bumped on clear so late streamed tokens don't land in a fresh chat
+        self.chat_epoch = 0
         
         # settings
         self.max_tokens_var = ctk.StringVar(value="256")
-        self.threads_var = ctk.StringVar(value=str(os.cpu_count() // 2))
+        # physical cores, or what auto-tune measured best on this machine
+        self.default_threads = tuning.default_threads(registry.engine.model_path)
+        self.threads_var = ctk.StringVar(value=str(self.default_threads))
         self.theme_var = ctk.StringVar(value="dark")
         self.history_length_var = ctk.StringVar(value="10")
+        self.summary_memory = False  # summary of older turns + recent turns instead of raw history
+        self.speculative_var = ctk.StringVar(value=registry.engine.speculative)
+        self.draft_model_var = ctk.StringVar(value=registry.engine.draft_model_path or "")
+        self.draft_tokens_var = ctk.StringVar(value=str(registry.engine.draft_tokens))
         self.rag_enabled = True  # RAG switch state
 
-        model_path = "./models/all-MiniLM-L6-v2"  # . for source and .. for build
-        self.embedder = SentenceTransformer(model_path)
-        self.index, self.metadata = load_faiss_index_and_metadata()
+        # Embedder, RAG index and LLM are shared through the registry and warmed up
+        # in the background once the window is on screen
+        self.registry = registry
+        self.engine = registry.engine
+        self.rag_folder = r""  # Change to your downloads directory
+        self.rag_thread = None
+        self.rag_cancel = threading.Event()
+        self.memory = ConversationMemory(self.store, registry.engine)
+        self.memory_thread = None
+        self.memory_cancel = threading.Event()  # set when a message is sent, so the summary yields the model
+        self.memory_refresh_job = None
+        self.watcher = None
+        # Client mode: chat goes to a running LocAI server instead of local models
+        self.server_client = ServerClient(server_url) if server_url else None
 
         self.create_main_layout()
         self.create_chat_page()
         self.create_settings_page()
         self.show_page("chat")
 
+        self.root.after(100, self.start_warm_up)
+
+    def start_warm_up(self):
+        if self.server_client is not None:
+            self.model_status_label.configure(text=f"● Using server {self.server_client.base_url}")
+            return
+        threads = int(self.threads_var.get()) if self.threads_var.get().isdigit() else self.default_threads
+
+        def report(status):
+            self.root.after(0, lambda: self.show_model_status(status))
+
+        self.registry.warm_up(n_threads=threads, on_status=report)
+
+    def show_model_status(self, status):
+        failed = [name for name, state in status.items() if state.startswith("failed")]
+        if failed:
+            text = "Failed to load: " + ", ".join(failed)
+        elif all(state != "pending" for state in status.values()):
+            text = "● Ready"
+        else:
+            loaded = sum(1 for state in status.values() if state != "pending")
+            text = f"Loading models... ({loaded}/{len(status)})"
+        self.model_status_label.configure(text=text)
+
     def show_page(self, page_name):
         if self.current_page:
             self.pages[self.current_page].pack_forget()
@@ -55,6 +117,8 @@ class AIModelGUI:
         if page_name in self.pages:
             self.pages[page_name].pack(fill="both", expand=True)
             self.current_page = page_name
+            if page_name == "settings":
+                self.show_cache_stats()
             
             for name, button in self.nav_buttons.items():
                 if name == page_name:
@@ -75,7 +139,14 @@ class AIModelGUI:
             text="LocAI", 
             font=ctk.CTkFont(size=24, weight="bold")
         )
-        title_label.pack(pady=10)
+        title_label.pack(pady=(10, 0))
+        self.model_status_label = ctk.CTkLabel(
+            title_frame,
+            text="Loading models...",
+            font=ctk.CTkFont(size=10),
+            text_color="gray"
+        )
+        self.model_status_label.pack(pady=(0, 5))
         
         # nav bar
         nav_frame = ctk.CTkFrame(main_container)
@@ -131,6 +202,11 @@ class AIModelGUI:
         self.chat_display._textbox.tag_bind("user_clickable", "<Button-1>", self.on_user_message_click)
         self.chat_display._textbox.tag_bind("user_clickable", "<Enter>", lambda e: self.chat_display._textbox.configure(cursor="hand2"))
         self.chat_display._textbox.tag_bind("user_clickable", "<Leave>", lambda e: self.chat_display._textbox.configure(cursor=""))
+
+        # Older and newer messages are paged in when the view reaches either end
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>", "<Prior>", "<Next>", "<Control-Home>", "<Control-End>"):
+            self.chat_display._textbox.bind(sequence, lambda e: self.root.after_idle(self.check_chat_scroll), add="+")
+        self.chat_display._y_scrollbar.bind("<ButtonRelease-1>", lambda e: self.root.after_idle(self.check_chat_scroll))
         
         # Right side - Context panel (takes 30% of width)
         context_container = ctk.CTkFrame(main_horizontal)
@@ -162,6 +238,22 @@ class AIModelGUI:
             wrap="word"
         )
         self.context_display.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+        # Performance panel: timings of the latest (or clicked) message
+        perf_title = ctk.CTkLabel(
+            context_container,
+            text="Performance",
+            font=ctk.CTkFont(size=16, weight="bold")
+        )
+        perf_title.pack(pady=(0, 5), padx=10)
+
+        self.perf_display = ctk.CTkTextbox(
+            context_container,
+            height=170,
+            font=ctk.CTkFont(size=10, family="Courier"),
+            wrap="none"
+        )
+        self.perf_display.pack(fill="x", padx=10, pady=(0, 10))
         
         # Input section at bottom
         input_frame = ctk.CTkFrame(chat_page)
@@ -259,7 +351,7 @@ class AIModelGUI:
         self.input_text.bind("<Return>", on_enter)
         self.input_text.bind("<Control-BackSpace>", on_ctrl_backspace)
         
-        self.add_message("System", "Welcome! Ask me anything.")
+        self.restore_conversation()
         
         self.pages["chat"] = chat_page
     
@@ -289,7 +381,7 @@ class AIModelGUI:
         self.threads_entry = ctk.CTkEntry(
             threads_frame,
             textvariable=self.threads_var,
-            placeholder_text=str(os.cpu_count() // 2)
+            placeholder_text=str(self.default_threads)
         )
         self.threads_entry.pack(fill="x", padx=10, pady=(0, 10))
         
@@ -311,13 +403,51 @@ class AIModelGUI:
         rag_update.pack(fill="x", padx=20, pady=10)
         rag_label = ctk.CTkLabel(rag_update, text="RAG Updates:")
         rag_label.pack(anchor="w", padx=10, pady=(10, 0))
-        rag_button = ctk.CTkButton(
-            rag_update,
+        rag_buttons = ctk.CTkFrame(rag_update, fg_color="transparent")
+        rag_buttons.pack(anchor="w", padx=10, pady=(0, 0))
+        self.rag_button = ctk.CTkButton(
+            rag_buttons,
             text="Retrieve new data",
             command=self.update_RAG,
             font=ctk.CTkFont(size=12)
         )
-        rag_button.pack(anchor="w", padx=10, pady=(0, 0))
+        self.rag_button.pack(side="left", padx=(0, 10))
+        self.rag_cancel_button = ctk.CTkButton(
+            rag_buttons,
+            text="Cancel",
+            command=self.cancel_RAG_update,
+            state="disabled",
+            fg_color="transparent",
+            border_width=2,
+            text_color=("gray10", "#DCE4EE"),
+            font=ctk.CTkFont(size=12)
+        )
+        self.rag_cancel_button.pack(side="left")
+        self.watch_switch = ctk.CTkSwitch(
+            rag_buttons,
+            text="Watch folder",
+            command=self.toggle_watch,
+            font=ctk.CTkFont(size=12)
+        )
+        self.watch_switch.pack(side="left", padx=(10, 0))
+
+        self.rag_progress = ctk.CTkProgressBar(rag_update)
+        self.rag_progress.set(0)
+        self.rag_progress.pack(fill="x", padx=10, pady=(10, 0))
+        self.rag_status = ctk.CTkLabel(
+            rag_update,
+            text="",
+            font=ctk.CTkFont(size=10),
+            text_color="gray"
+        )
+        self.rag_status.pack(anchor="w", padx=10, pady=(0, 0))
+        self.cache_stats_label = ctk.CTkLabel(
+            rag_update,
+            text="",
+            font=ctk.CTkFont(size=10),
+            text_color="gray"
+        )
+        self.cache_stats_label.pack(anchor="w", padx=10, pady=(0, 0))
 
         rag_info = ctk.CTkLabel(
             rag_update, 
@@ -327,6 +457,76 @@ class AIModelGUI:
         )
         rag_info.pack(anchor="w", padx=10, pady=(0, 10))
 
+        # model memory
+        model_frame = ctk.CTkFrame(settings_frame)
+        model_frame.pack(fill="x", padx=20, pady=10)
+        model_label = ctk.CTkLabel(model_frame, text="Model Memory:")
+        model_label.pack(anchor="w", padx=10, pady=(10, 5))
+        model_buttons = ctk.CTkFrame(model_frame, fg_color="transparent")
+        model_buttons.pack(anchor="w", padx=10, pady=(0, 5))
+        unload_button = ctk.CTkButton(
+            model_buttons,
+            text="Unload model",
+            command=self.unload_model,
+            font=ctk.CTkFont(size=12)
+        )
+        unload_button.pack(side="left", padx=(0, 10))
+        reload_button = ctk.CTkButton(
+            model_buttons,
+            text="Reload model",
+            command=self.reload_model,
+            font=ctk.CTkFont(size=12)
+        )
+        reload_button.pack(side="left")
+        tune_button = ctk.CTkButton(
+            model_buttons,
+            text="Auto-tune",
+            command=self.auto_tune_model,
+            font=ctk.CTkFont(size=12)
+        )
+        tune_button.pack(side="left", padx=(10, 0))
+        self.model_status = ctk.CTkLabel(
+            model_frame,
+            text="Model is loaded on first message and kept in memory.",
+            font=ctk.CTkFont(size=10),
+            text_color="gray"
+        )
+        self.model_status.pack(anchor="w", padx=10, pady=(0, 10))
+
+        # speculative decoding
+        speculative_frame = ctk.CTkFrame(settings_frame)
+        speculative_frame.pack(fill="x", padx=20, pady=10)
+        speculative_label = ctk.CTkLabel(speculative_frame, text="Speculative Decoding:")
+        speculative_label.pack(anchor="w", padx=10, pady=(10, 5))
+        speculative_menu = ctk.CTkOptionMenu(
+            speculative_frame,
+            values=list(SPECULATIVE_MODES),
+            variable=self.speculative_var
+        )
+        speculative_menu.pack(fill="x", padx=10, pady=(0, 5))
+        self.draft_model_entry = ctk.CTkEntry(
+            speculative_frame,
+            textvariable=self.draft_model_var,
+            placeholder_text="Draft model GGUF (draft-model mode)"
+        )
+        self.draft_model_entry.pack(fill="x", padx=10, pady=(0, 5))
+        self.draft_tokens_entry = ctk.CTkEntry(
+            speculative_frame,
+            textvariable=self.draft_tokens_var,
+            placeholder_text="Draft tokens per step"
+        )
+        self.draft_tokens_entry.pack(fill="x", padx=10, pady=(0, 5))
+        speculative_help = ctk.CTkLabel(
+            speculative_frame,
+            text="Same answers, faster decoding when they quote the context.\n"
+                 "prompt-lookup drafts from the prompt; draft-model needs a small GGUF with the same vocabulary.\n"
+                 "Acceptance rate is shown in the Performance panel. Applied when the model next loads.",
+            font=ctk.CTkFont(size=10),
+            text_color="gray",
+            justify="left"
+        )
+        speculative_help.pack(anchor="w", padx=10, pady=(0, 10))
+
         # TODO: Add downloading models functionality
         
         # conversation history length
@@ -340,11 +540,18 @@ class AIModelGUI:
             placeholder_text="10"
         )
         self.history_entry.pack(fill="x", padx=10, pady=(0, 10))
+        self.summary_switch = ctk.CTkSwitch(
+            history_frame,
+            text="Summarize older turns",
+            command=self.toggle_summary_memory
+        )
+        self.summary_switch.pack(anchor="w", padx=10, pady=(0, 5))
         
         # help text
         help_label = ctk.CTkLabel(
             history_frame, 
-            text="Lower values = faster responses, less memory\nHigher values = more context, slower responses",
+            text="Lower values = faster responses, less memory\nHigher values = more context, slower responses\n"
+                 "Summarize: older turns are condensed while idle; only the last few are sent in full",
             font=ctk.CTkFont(size=10),
             text_color="gray"
         )
@@ -375,12 +582,152 @@ class AIModelGUI:
             else:
                 self.context_info.configure(text="RAG is disabled - AI responds without document context")
 
+    # rebuild runs in the background; chat keeps using the old index until the swap
     def update_RAG(self):
-        build_embeddings(r"") # Change to your downloads directory
-        messagebox.showinfo("RAG Update", "RAG data updated successfully!")
-        self.index, self.metadata = load_faiss_index_and_metadata()
+        if self.rag_thread is not None and self.rag_thread.is_alive():
+            return False
+
+        self.rag_cancel.clear()
+        self.rag_button.configure(state="disabled")
+        self.rag_cancel_button.configure(state="normal")
+        self.rag_progress.set(0)
+        self.rag_status.configure(text="Scanning files...")
+
+        last_progress = {}
+
+        def report(progress):
+            last_progress.update(progress)
+            self.root.after(0, lambda: self.show_RAG_progress(progress))
+
+        def rebuild():
+            try:
+                updated = build_embeddings(self.rag_folder, progress=report, cancel_event=self.rag_cancel)
+                if updated and last_progress.get('published'):
+                    index, metadata = load_faiss_index_and_metadata()
+                    self.root.after(0, lambda: self.finish_RAG_update(index, metadata))
+                elif updated:
+                    self.root.after(0, lambda: self.finish_RAG_update(None, None, "RAG data is already up to date."))
+                elif self.rag_cancel.is_set():
+                    self.root.after(0, lambda: self.finish_RAG_update(None, None, "RAG update cancelled."))
+                else:
+                    self.root.after(0, lambda: self.finish_RAG_update(None, None, "No documents were indexed."))
+            except Exception as e:
+                error_msg = f"RAG update failed: {str(e)}"
+                self.root.after(0, lambda: self.finish_RAG_update(None, None, error_msg))
+
+        self.rag_thread = threading.Thread(target=rebuild, daemon=True)
+        self.rag_thread.start()
         return True
 
+    # watch mode: changes in the folder are indexed in small batches, between responses
+    def toggle_watch(self):
+        if self.watch_switch.get():
+            def on_update(index, metadata):
+                self.root.after(0, lambda: self.registry.set_index(index, metadata))
+
+            def on_status(text):
+                self.root.after(0, lambda: self.rag_status.configure(text=text))
+
+            self.watcher = FolderWatcher(self.rag_folder, on_update=on_update,
+                                         is_busy=lambda: self.is_generating, on_status=on_status)
+            self.watcher.start()
+        elif self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.rag_status.configure(text="Stopped watching the folder.")
+
+    def cancel_RAG_update(self):
+        self.rag_cancel.set()
+        self.rag_cancel_button.configure(state="disabled")
+        self.rag_status.configure(text="Cancelling...")
+
+    def show_RAG_progress(self, progress):
+        files_total = progress['files_total']
+        if files_total:
+            self.rag_progress.set(progress['files_scanned'] / files_total)
+        status = f"{progress['files_scanned']}/{files_total} files scanned, {progress['chunks_embedded']} chunks embedded"
+        if progress['chunks_cached']:
+            status += f", {progress['chunks_cached']} from cache"
+        if progress['chunks_per_sec']:
+            status += f" ({progress['chunks_per_sec']:.0f} chunks/s"
+            if progress['eta_sec'] is not None:
+                status += f", ETA {int(progress['eta_sec'])}s"
+            status += ")"
+        self.rag_status.configure(text=status)
+
+    def show_cache_stats(self):
+        stats = cache_stats()
+        embeddings = stats['query_embeddings']
+        retrievals = stats['retrievals']
+        self.cache_stats_label.configure(
+            text=f"Query cache: {embeddings['hits']} hits / {embeddings['misses']} misses, "
+                 f"retrieval cache: {retrievals['hits']} hits / {retrievals['misses']} misses"
+        )
+
+    def finish_RAG_update(self, index, metadata, message=None):
+        if index is not None:
+            self.registry.set_index(index, metadata)
+            self.rag_progress.set(1)
+            message = "RAG data updated successfully!"
+        self.rag_status.configure(text=message)
+        self.rag_button.configure(state="normal")
+        self.rag_cancel_button.configure(state="disabled")
+
+    def unload_model(self):
+        if self.is_generating:
+            messagebox.showerror("Model Memory", "Wait for the current response to finish first.")
+            return
+        self.memory_cancel.set()  # a running summary holds the model
+        self.model_status.configure(text="Unloading model...")
+
+        def unload():
+            self.engine.unload()
+            self.root.after(0, lambda: self.model_status.configure(
+                text="Model unloaded. It will load again on the next message."))
+
+        threading.Thread(target=unload, daemon=True).start()
+
+    def reload_model(self):
+        if self.is_generating:
+            messagebox.showerror("Model Memory", "Wait for the current response to finish first.")
+            return
+        self.memory_cancel.set()  # a running summary holds the model
+        self.model_status.configure(text="Loading model...")
+
+        def load():
+            try:
+                threads = int(self.threads_var.get()) if self.threads_var.get().isdigit() else self.default_threads
+                self.engine.n_threads = threads
+                self.engine.reload()
+                self.root.after(0, lambda: self.model_status.configure(text="Model loaded."))
+            except Exception as e:
+                error_msg = f"Failed to load model: {str(e)}"
+                self.root.after(0, lambda: self.model_status.configure(text=error_msg))
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def auto_tune_model(self):
+        if self.is_generating:
+            messagebox.showerror("Model Memory", "Wait for the current response to finish first.")
+            return
+        self.memory_cancel.set()  # a running summary holds the model
+
+        def report(text):
+            self.root.after(0, lambda: self.model_status.configure(text=text))
+
+        def tune():
+            try:
+                config, _ = tuning.calibrate(self.engine, progress=report)
+                self.default_threads = config['n_threads']
+                self.root.after(0, lambda: self.threads_var.set(str(config['n_threads'])))
+                report(f"Tuned: {config['n_threads']} threads ({config['n_threads_batch']} for prompts), "
+                       f"batch {config['n_batch']}{', pinned to physical cores' if config['cpu_affinity'] else ''}. "
+                       f"Saved for this machine.")
+            except Exception as e:
+                report(f"Auto-tune failed: {e}")
+
+        threading.Thread(target=tune, daemon=True).start()
+
     # making sure settings are good
     def save_settings(self):
         try:
@@ -394,10 +741,26 @@ class AIModelGUI:
                 raise ValueError(f"Threads must be between 1 and {os.cpu_count()}")
             if history_length < 1 or history_length > 50:
                 raise ValueError("Conversation memory must be between 1 and 50 pairs")
+            draft_tokens = int(self.draft_tokens_var.get())
+            if draft_tokens < 1 or draft_tokens > 64:
+                raise ValueError("Draft tokens must be between 1 and 64")
+            speculative = self.speculative_var.get()
+            draft_model_path = self.draft_model_var.get().strip() or None
+            if speculative == "draft-model" and not (draft_model_path and os.path.exists(draft_model_path)):
+                raise ValueError("Draft-model mode needs the path of an existing draft GGUF")
+            decoding = {'speculative': speculative, 'draft_model_path': draft_model_path, 'draft_tokens': draft_tokens}
+            decoding_changed = any(self.engine.load_params()[name] != value for name, value in decoding.items())
+            if decoding_changed and self.is_generating:
+                raise ValueError("Wait for the current response to finish before changing speculative decoding")
             
             # Update the history length setting
             self.max_history_pairs = history_length
             self.manage_conversation_history()  # Apply new limit immediately
+
+            # Load-time options: the model is dropped only if they changed, and reloads on the next message
+            if decoding_changed:
+                self.memory_cancel.set()  # a running summary holds the model
+                self.engine.configure(**decoding)
             
             messagebox.showinfo("Settings", "Settings saved successfully!")
             
@@ -419,12 +782,12 @@ class AIModelGUI:
                 break
     
     def show_context_for_message(self, message_id):
-        if message_id not in self.message_contexts:
+        context_data = self.store.get_context(message_id)
+        if context_data is None:
             self.context_display.delete("1.0", "end")
             self.context_display.insert("1.0", "No context available for this message.")
             return
         
-        context_data = self.message_contexts[message_id]
         chunks = context_data.get('chunks', [])
         query = context_data.get('query', '')
         
@@ -445,31 +808,172 @@ class AIModelGUI:
         
         self.context_display.delete("1.0", "end")
         self.context_display.insert("1.0", context_text)
+        if context_data.get('trace'):
+            self.show_trace(context_data['trace'])
         
         # Update info label
         self.context_info.configure(text=f"Context for: \"{query[:50]}{'...' if len(query) > 50 else ''}\"")
 
-    # send message to ai
-    def add_message(self, sender, message):
-        self.chat_display.configure(state="normal")
-        
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        
+    def show_trace(self, trace):
+        self.perf_display.delete("1.0", "end")
+        self.perf_display.insert("1.0", tracing.format_trace(trace))
+
+    def finish_trace(self, trace, message_id):
+        result = trace.finish()
+        self.store.save_trace(message_id, result)
+        self.trace_log.write(result)
+        self.root.after(0, lambda: self.show_trace(result))
+
+    # last conversation from the store, or a new one on first start
+    def restore_conversation(self):
+        self.conversation_id = self.store.latest_conversation()
+        if self.conversation_id is None:
+            self.conversation_id = self.store.new_conversation()
+            self.add_message("System", "Welcome! Ask me anything.")
+            return
+        self.show_latest_messages()
+        self.conversation_history = self.store.history(self.conversation_id, self.max_history_pairs * 2)
+
+    # one tagged block per message, so it can be dropped from the widget as a whole
+    def render_message(self, message, index="end"):
+        timestamp = datetime.datetime.fromtimestamp(message['created']).strftime("%H:%M:%S")
+        block = f"m_{message['id']}"
+        sender = message['sender']
         if sender == "You":
             # Make user messages clickable
-            message_tag = f"msg_{self.current_message_id}"
-            self.chat_display.insert("end", f"[{timestamp}] You:\n", "user")
-            self.chat_display.insert("end", f"{message}\n\n", ("user_message", "user_clickable", message_tag))
+            header = (f"[{timestamp}] You:\n", ("user", block))
+            body = (f"{message['content']}\n\n", ("user_message", "user_clickable", f"msg_{message['id']}", block))
         elif sender == "AI":
-            self.chat_display.insert("end", f"[{timestamp}] AI Assistant:\n", "ai")
-            self.chat_display.insert("end", f"{message}\n\n", "ai_message")
+            header = (f"[{timestamp}] AI Assistant:\n", ("ai", block))
+            body = (f"{message['content']}\n\n", ("ai_message", block))
         else:
-            self.chat_display.insert("end", f"[{timestamp}] {sender}:\n", "system")
-            self.chat_display.insert("end", f"{message}\n\n", "system_message")
+            header = (f"[{timestamp}] {sender}:\n", ("system", block))
+            body = (f"{message['content']}\n\n", ("system_message", block))
+        self.chat_display._textbox.insert(index, *header, *body)
+
+    def drop_message(self, message_id):
+        textbox = self.chat_display._textbox
+        ranges = textbox.tag_ranges(f"m_{message_id}")
+        if ranges:
+            textbox.delete(ranges[0], ranges[-1])
+        textbox.tag_delete(f"m_{message_id}", f"msg_{message_id}")
+
+    # keep the widget bounded: drop whole messages from the end away from `keep`
+    def trim_chat(self, keep="end"):
+        while len(self.shown_ids) > CHAT_WINDOW_MESSAGES:
+            if keep == "end":
+                self.drop_message(self.shown_ids.pop(0))
+                self.has_older = True
+            else:
+                self.drop_message(self.shown_ids.pop())
+                self.has_newer = True
+
+    def show_latest_messages(self):
+        self.chat_display.configure(state="normal")
+        for message_id in self.shown_ids:
+            self.drop_message(message_id)
+        self.chat_display.delete("1.0", "end")
+        messages = self.store.messages(self.conversation_id, limit=CHAT_WINDOW_MESSAGES)
+        for message in messages:
+            self.render_message(message)
+        self.shown_ids = [message['id'] for message in messages]
+        self.has_older = bool(messages) and self.store.has_messages(self.conversation_id, before=self.shown_ids[0])
+        self.has_newer = False
+        self.chat_display.see("end")
+        self.chat_display.configure(state="disabled")
+
+    def check_chat_scroll(self):
+        first, last = self.chat_display._textbox.yview()
+        if first <= 0.0 and self.has_older:
+            self.load_older_messages()
+        elif last >= 1.0 and self.has_newer:
+            self.load_newer_messages()
+
+    def load_older_messages(self):
+        if not self.shown_ids or self.ai_message_started is not None:
+            return  # the streamed message sits at the end, which this would trim
+        anchor = self.shown_ids[0]
+        messages = self.store.messages(self.conversation_id, before=anchor, limit=CHAT_PAGE_MESSAGES)
+        self.chat_display.configure(state="normal")
+        for message in reversed(messages):
+            self.render_message(message, "1.0")
+        self.shown_ids[:0] = [message['id'] for message in messages]
+        self.has_older = self.store.has_messages(self.conversation_id, before=self.shown_ids[0])
+        self.trim_chat(keep="start")
+        # the message that was on top stays on top
+        self.chat_display._textbox.yview(f"m_{anchor}.first")
+        self.chat_display.configure(state="disabled")
+
+    def load_newer_messages(self):
+        if not self.shown_ids:
+            return
+        anchor = self.shown_ids[-1]
+        messages = self.store.messages(self.conversation_id, after=anchor, limit=CHAT_PAGE_MESSAGES)
+        self.chat_display.configure(state="normal")
+        for message in messages:
+            self.render_message(message)
+        self.shown_ids += [message['id'] for message in messages]
+        self.has_newer = self.store.has_messages(self.conversation_id, after=self.shown_ids[-1])
+        self.trim_chat(keep="end")
+        self.chat_display.see(f"m_{anchor}.last")
+        self.chat_display.configure(state="disabled")
+
+    # send message to ai; returns its store id
+    def add_message(self, sender, message):
+        self.finish_ai_message(self.chat_epoch)
+        if self.has_newer:
+            self.show_latest_messages()
+        record = self.store.add_message(self.conversation_id, sender, message)
+
+        self.chat_display.configure(state="normal")
+        self.render_message(record)
+        self.shown_ids.append(record['id'])
+        self.trim_chat()
         
         # scroll
         self.chat_display.see("end")
         self.chat_display.configure(state="disabled")
+        return record['id']
+
+    # streamed AI message, filled in token by token and stored once it is complete
+    def start_ai_message(self, epoch):
+        if epoch != self.chat_epoch:
+            return
+        if self.has_newer:
+            self.show_latest_messages()
+        self.ai_message_started = time.time()
+        self.chat_display.configure(state="normal")
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        self.chat_display.insert("end", f"[{timestamp}] AI Assistant:\n", ("ai", "ai_streaming"))
+        self.chat_display.see("end")
+        self.chat_display.configure(state="disabled")
+
+    def append_ai_text(self, text, epoch):
+        if epoch != self.chat_epoch or self.ai_message_started is None:
+            return
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", text, ("ai_message", "ai_streaming", "ai_streaming_text"))
+        self.chat_display.see("end")
+        self.chat_display.configure(state="disabled")
+
+    def finish_ai_message(self, epoch):
+        # Also called before any other message is added, so an interrupted stream is kept as it was shown
+        if epoch != self.chat_epoch or self.ai_message_started is None:
+            return
+        textbox = self.chat_display._textbox
+        text_range = textbox.tag_ranges("ai_streaming_text")
+        content = textbox.get(text_range[0], text_range[-1]) if text_range else ""
+        record = self.store.add_message(self.conversation_id, "AI", content, created=self.ai_message_started)
+        self.ai_message_started = None
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", "\n\n", ("ai_message", "ai_streaming"))
+        block = textbox.tag_ranges("ai_streaming")
+        textbox.tag_add(f"m_{record['id']}", block[0], block[-1])
+        textbox.tag_remove("ai_streaming", "1.0", "end")
+        textbox.tag_remove("ai_streaming_text", "1.0", "end")
+        self.shown_ids.append(record['id'])
+        self.trim_chat()
+        self.chat_display.configure(state="disabled")
     
     # send message or stop generation
     def handle_submit_button(self):
@@ -481,21 +985,57 @@ class AIModelGUI:
     def stop_ai_generation(self):
         self.stop_generation.set()
         self.submit_button.configure(text="Stopping...", state="disabled")
-        
-        self.root.after(100, lambda: self.add_message("System", "Generation stopped by user."))
-        
-        self.root.after(1000, self.reset_submit_button)
+        # the worker notices the flag before its next token and resets the button itself
     
     def reset_submit_button(self):
         self.is_generating = False
         self.stop_generation.clear()
         self.submit_button.configure(state="normal", text="Send")
+        self.schedule_memory_refresh()
+
+    def toggle_summary_memory(self):
+        self.summary_memory = bool(self.summary_switch.get())
+        if self.summary_memory:
+            self.schedule_memory_refresh()
+        else:
+            self.memory_cancel.set()
+
+    # the summary is brought up to date once the chat has been quiet for a while
+    def schedule_memory_refresh(self):
+        if self.memory_refresh_job is not None:
+            self.root.after_cancel(self.memory_refresh_job)
+        self.memory_refresh_job = self.root.after(MEMORY_IDLE_MS, self.refresh_memory)
+
+    def refresh_memory(self):
+        self.memory_refresh_job = None
+        if not self.summary_memory or self.server_client is not None or self.is_generating:
+            return
+        if self.memory_thread is not None and self.memory_thread.is_alive():
+            return
+        conversation_id = self.conversation_id
+        threads = int(self.threads_var.get()) if self.threads_var.get().isdigit() else self.default_threads
+        self.memory_cancel.clear()
+
+        def refresh():
+            try:
+                # A long backlog (e.g. memory mode switched on late) is folded in over several passes
+                while self.memory.refresh(conversation_id, n_threads=threads, cancel_event=self.memory_cancel):
+                    pass
+            except Exception as e:
+                print(f"Conversation summary failed: {e}")
+
+        self.memory_thread = threading.Thread(target=refresh, daemon=True)
+        self.memory_thread.start()
     
     def manage_conversation_history(self):
         max_messages = self.max_history_pairs * 2
         
         if len(self.conversation_history) > max_messages:
-            self.conversation_history = self.conversation_history[-max_messages:]
+            # Drop old pairs in blocks rather than one per turn, so the start of the
+            # prompt stays the same for several turns and its KV cache can be reused
+            drop_pairs = max(1, self.max_history_pairs // 4)
+            keep_messages = max(2, max_messages - drop_pairs * 2)
+            self.conversation_history = self.conversation_history[-keep_messages:]
     
     # send message & add to history
     def send_message(self):
@@ -509,87 +1049,167 @@ class AIModelGUI:
             'content': user_input
         })
 
-        # Store the current message ID for context association
-        current_msg_id = self.current_message_id
-        self.add_message("You", user_input)
-        self.current_message_id += 1
+        # The store id of the message links it to its context and timings
+        current_msg_id = self.add_message("You", user_input)
+        conversation_id = self.conversation_id
         
         self.input_text.delete("1.0", "end")
         
         self.is_generating = True
         self.stop_generation.clear()
+        self.memory_cancel.set()
         self.submit_button.configure(state="normal", text="Stop")
 
         def get_ai_response():
+            trace = tracing.start("chat", message_id=current_msg_id, rag=self.rag_enabled)
             try:
                 max_tokens = int(self.max_tokens_var.get()) if self.max_tokens_var.get().isdigit() else 256
-                threads = int(self.threads_var.get()) if self.threads_var.get().isdigit() else os.cpu_count() // 2
+                threads = int(self.threads_var.get()) if self.threads_var.get().isdigit() else self.default_threads
                 
                 if self.stop_generation.is_set():
                     return
+
+                if self.server_client is not None:
+                    self.stream_from_server(user_input, max_tokens, current_msg_id)
+                    return
+
+                # Messages sent during warm-up wait here until the models are loaded
+                if not self.registry.is_ready:
+                    self.root.after(0, lambda: self.add_message("System", "Models are still loading; your message will be answered as soon as they are ready."))
+                    with tracing.span('wait_for_models'):
+                        self.registry.wait_until_ready(need_rag=self.rag_enabled, cancel_event=self.stop_generation)
+                    if self.stop_generation.is_set():
+                        if self.conversation_history and self.conversation_history[-1]['role'] == 'user':
+                            self.conversation_history.pop()
+                        return
                 
                 # Get RAG context only if enabled
                 chunks = []
                 if self.rag_enabled:
-                    chunks = retrieve_relevant_chunks(user_input, self.embedder, self.index, self.metadata)
+                    with tracing.span('retrieval'):
+                        index, metadata = self.registry.get_index()
+                        chunks = retrieve_relevant_chunks(user_input, self.registry.get_embedder(), index, metadata)
                 
+                # Summary mode: the conversation summary plus the turns it doesn't cover yet
+                summary = None
+                history = self.conversation_history[:-1]
+                summary_memory = self.summary_memory
+                if summary_memory:
+                    summary, history = self.memory.context(conversation_id, before=current_msg_id)
+
+                # Build prompt with or without RAG context, cut to fit the context window
+                with tracing.span('assemble_prompt'):
+                    plan = assemble_prompt(user_input, max_tokens, conversation_history=history,
+                                           context_chunks=chunks, build_prompt=build_prompt if self.rag_enabled else None,
+                                           engine=self.engine, n_threads=threads, summary=summary)
+                # History that no longer fits is gone for good, so later turns share this prompt prefix
+                dropped = len(self.conversation_history) - 1 - len(plan['history'])
+                if dropped > 0 and not summary_memory:
+                    self.conversation_history = self.conversation_history[dropped:]
+
                 # Store context for this message
-                self.message_contexts[current_msg_id] = {
-                    'chunks': chunks,
-                    'query': user_input
-                }
+                self.store.save_context(current_msg_id, user_input, plan['chunks'])
                 
-                # Build prompt with or without RAG context
-                if self.rag_enabled and chunks:
-                    prompt = build_prompt(chunks, user_input)
-                else:
-                    prompt = user_input
-                
-                response = ask_ai(prompt, max_tokens, n_threads=threads, conversation_history=self.conversation_history[:-1])
+                epoch = self.chat_epoch
+                started = False
+                response_parts = []
+                for token in stream_ai(plan['prompt'], max_tokens, n_threads=threads,
+                                       conversation_history=plan['history'],
+                                       engine=self.engine, cancel_event=self.stop_generation):
+                    if not started:
+                        self.root.after(0, lambda: self.start_ai_message(epoch))
+                        snapshot = trace.to_dict()  # retrieval and prompt eval are in by the first token
+                        self.root.after(0, lambda: self.show_trace(snapshot))
+                        started = True
+                    response_parts.append(token)
+                    self.root.after(0, lambda t=token: self.append_ai_text(t, epoch))
+
+                if started:
+                    self.root.after(0, lambda: self.finish_ai_message(epoch))
 
                 if self.stop_generation.is_set():
                     if self.conversation_history and self.conversation_history[-1]['role'] == 'user':
                         self.conversation_history.pop()
+                    self.root.after(0, lambda: self.add_message("System", "Generation stopped by user."))
                     return
                 
                 self.conversation_history.append({
                     'role': 'assistant',
-                    'content': response
+                    'content': "".join(response_parts)
                 })
                 
                 self.manage_conversation_history()
                 
-                self.root.after(0, lambda: self.add_message("AI", response))
-                
             except Exception as e:
                 if not self.stop_generation.is_set():
                     error_msg = f"Error generating response: {str(e)}"
                     self.root.after(0, lambda: self.add_message("Error", error_msg))
 
             finally:
-                if not self.stop_generation.is_set():
-                    self.root.after(0, self.reset_submit_button)
+                self.finish_trace(trace, current_msg_id)
+                self.root.after(0, self.reset_submit_button)
 
         self.current_generation_thread = threading.Thread(target=get_ai_response, daemon=True)
         self.current_generation_thread.start()
     
+    def stream_from_server(self, user_input, max_tokens, current_msg_id):
+        # Same flow as local generation; retrieval and prompt assembly happen on the server
+        epoch = self.chat_epoch
+        start = time.perf_counter()
+        started = False
+        response_parts = []
+        client = self.server_client
+        for token in client.stream_chat(user_input, max_tokens, conversation_history=self.conversation_history[:-1],
+                                        use_rag=self.rag_enabled, cancel_event=self.stop_generation):
+            if not started:
+                self.root.after(0, lambda: self.start_ai_message(epoch))
+                tracing.record(ttft_ms=(time.perf_counter() - start) * 1000)
+                started = True
+            response_parts.append(token)
+            self.root.after(0, lambda t=token: self.append_ai_text(t, epoch))
+
+        if started:
+            self.root.after(0, lambda: self.finish_ai_message(epoch))
+
+        self.store.save_context(current_msg_id, user_input, client.last_context)
+
+        if self.stop_generation.is_set():
+            if self.conversation_history and self.conversation_history[-1]['role'] == 'user':
+                self.conversation_history.pop()
+            self.root.after(0, lambda: self.add_message("System", "Generation stopped by user."))
+            return
+
+        self.conversation_history.append({
+            'role': 'assistant',
+            'content': "".join(response_parts)
+        })
+        self.manage_conversation_history()
+
     # clear full chat
     def clear_chat(self):
         if self.is_generating:
             self.stop_ai_generation()
         
+        # The old conversation stays in the store, including a partly streamed answer
+        self.finish_ai_message(self.chat_epoch)
+        self.memory_cancel.set()
+        self.chat_epoch += 1
         self.chat_display.configure(state="normal")
+        for message_id in self.shown_ids:
+            self.drop_message(message_id)
         self.chat_display.delete("1.0", "end")
         self.chat_display.configure(state="disabled")
+        self.shown_ids = []
+        self.has_older = False
+        self.has_newer = False
+        self.conversation_id = self.store.new_conversation()
         
         # Clear context panel
         self.context_display.delete("1.0", "end")
         self.context_info.configure(text="Click on any of your messages to see the context used")
+        self.perf_display.delete("1.0", "end")
         
-        # Clear stored data
         self.conversation_history = []
-        self.message_contexts = {}
-        self.current_message_id = 0
         
         self.add_message("System", "Chat cleared. How can I help you?")
     
@@ -597,8 +1217,14 @@ class AIModelGUI:
         self.root.mainloop()
 
 def main():
+    # Needed for the RAG extraction pool in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="LocAI")
+    parser.add_argument("--server", default=os.environ.get("LOCAI_SERVER_URL"),
+                        help="URL of a running LocAI server to use instead of loading models locally")
+    args = parser.parse_args()
     try:
-        app = AIModelGUI()
+        app = AIModelGUI(server_url=args.server)
         app.run()
     except Exception as e:
         messagebox.showerror("Application Error", f"Failed to start application: {str(e)}")
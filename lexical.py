@@ -0,0 +1,165 @@
+import re
+import os
+import json
+from collections import Counter
+import numpy as np
+
+# BM25 over the same chunks as the FAISS index, stored as immutable on-disk segments.
+# Each build writes its new chunks as new segments; removed chunks are filtered out with
+# the metadata's live mask, and segments are merged once there are too many of them
+
+TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEGMENT_MAX_CHUNKS = 200_000  # flush a segment so a full build doesn't hold every posting
+MAX_SEGMENTS = 8
+
+def tokenize(text):
+    # Identifiers like "AB-1234" or "v2.1" are kept whole and also split into their parts
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    return tokens
+
+def segment_path(index_dir, name, part):
+    return os.path.join(index_dir, f"{name}.{part}")
+
+class SegmentWriter:
+    # Collects postings for new chunks and writes them out as segments named <prefix>-<n>
+    def __init__(self, index_dir, prefix):
+        self.index_dir = index_dir
+        self.prefix = prefix
+        self.written = []
+        self.reset()
+
+    def reset(self):
+        self.postings = {}
+        self.doc_ids = []
+        self.doc_lengths = []
+
+    def add(self, chunk_id, text):
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, []).append((chunk_id, tf))
+        self.doc_ids.append(chunk_id)
+        self.doc_lengths.append(sum(counts.values()))
+        if len(self.doc_ids) >= SEGMENT_MAX_CHUNKS:
+            self.flush()
+
+    def flush(self):
+        if not self.doc_ids:
+            return
+        name = f"{self.prefix}-{len(self.written)}"
+        write_segment(self.index_dir, name, self.postings, self.doc_ids, self.doc_lengths)
+        self.written.append(name)
+        self.reset()
+
+    def close(self):
+        self.flush()
+        return self.written
+
+def write_segment(index_dir, name, postings, doc_ids, doc_lengths):
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    docs = np.empty(int(offsets[-1]), dtype=np.int32)
+    tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+    for i, term in enumerate(terms):
+        entries = postings[term]
+        docs[offsets[i]:offsets[i + 1]] = [doc for doc, _ in entries]
+        tfs[offsets[i]:offsets[i + 1]] = [min(tf, 65535) for _, tf in entries]
+
+    with open(segment_path(index_dir, name, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+    np.save(segment_path(index_dir, name, "offsets.npy"), offsets)
+    np.save(segment_path(index_dir, name, "docs.npy"), docs)
+    np.save(segment_path(index_dir, name, "tfs.npy"), tfs)
+    np.save(segment_path(index_dir, name, "doc_ids.npy"), np.asarray(doc_ids, dtype=np.int32))
+    np.save(segment_path(index_dir, name, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.int32))
+
+def segment_files(name):
+    return [f"{name}.{part}" for part in ("terms.json", "offsets.npy", "docs.npy", "tfs.npy", "doc_ids.npy", "doc_lengths.npy")]
+
+class Segment:
+    def __init__(self, index_dir, name):
+        self.name = name
+        with open(segment_path(index_dir, name, "terms.json"), "r", encoding="utf-8") as f:
+            self.term_rows = {term: i for i, term in enumerate(json.load(f))}
+        self.offsets = np.load(segment_path(index_dir, name, "offsets.npy"), mmap_mode='r')
+        self.docs = np.load(segment_path(index_dir, name, "docs.npy"), mmap_mode='r')
+        self.tfs = np.load(segment_path(index_dir, name, "tfs.npy"), mmap_mode='r')
+        self.doc_ids = np.load(segment_path(index_dir, name, "doc_ids.npy"), mmap_mode='r')
+        self.doc_lengths = np.load(segment_path(index_dir, name, "doc_lengths.npy"), mmap_mode='r')
+
+    def postings(self, term):
+        row = self.term_rows.get(term)
+        if row is None:
+            return None, None
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.docs[start:end], self.tfs[start:end]
+
+class LexicalIndex:
+    def __init__(self, index_dir, segment_names, live_mask):
+        self.segments = [Segment(index_dir, name) for name in segment_names]
+        self.live_mask = live_mask
+        self.doc_lengths = np.zeros(len(live_mask), dtype=np.float32)
+        for segment in self.segments:
+            self.doc_lengths[np.asarray(segment.doc_ids)] = segment.doc_lengths
+        live_lengths = self.doc_lengths[live_mask]
+        self.doc_count = len(live_lengths)
+        self.avg_length = float(live_lengths.mean()) if self.doc_count else 1.0
+
+    def search(self, query, k):
+        if not self.doc_count:
+            return []
+        hit_docs = []
+        hit_scores = []
+        for term in set(tokenize(query)):
+            hits = []
+            for segment in self.segments:
+                docs, tfs = segment.postings(term)
+                if docs is None:
+                    continue
+                live = self.live_mask[docs]
+                hits.append((np.asarray(docs)[live], np.asarray(tfs)[live]))
+            df = sum(len(docs) for docs, _ in hits)
+            if df == 0:
+                continue
+            idf = np.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            for docs, tfs in hits:
+                tfs = tfs.astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.avg_length)
+                hit_docs.append(docs)
+                hit_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not hit_docs:
+            return []
+        # Sum the per-term scores per chunk in numpy: a common term can have millions of postings
+        docs, inverse = np.unique(np.concatenate(hit_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        if len(docs) > k:
+            top = np.argpartition(-scores, k)[:k]
+            docs, scores = docs[top], scores[top]
+        return docs[np.argsort(-scores, kind="stable")].tolist()
+
+def merge_segments(index_dir, segment_names, live_mask, name):
+    # Rewrite several segments as one, dropping removed chunks
+    postings = {}
+    doc_ids = []
+    doc_lengths = []
+    for segment in (Segment(index_dir, n) for n in segment_names):
+        seg_ids = np.asarray(segment.doc_ids)
+        keep = live_mask[seg_ids]
+        doc_ids.extend(seg_ids[keep].tolist())
+        doc_lengths.extend(np.asarray(segment.doc_lengths)[keep].tolist())
+        for term, row in segment.term_rows.items():
+            start, end = int(segment.offsets[row]), int(segment.offsets[row + 1])
+            docs = np.asarray(segment.docs[start:end])
+            tfs = np.asarray(segment.tfs[start:end])
+            live = live_mask[docs]
+            if live.any():
+                postings.setdefault(term, []).extend(zip(docs[live].tolist(), tfs[live].tolist()))
+    write_segment(index_dir, name, postings, doc_ids, doc_lengths)
+    return [name]
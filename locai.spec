@@ -10,6 +10,9 @@ block_cipher = None
 # Collect llama-cpp-python binaries automatically
 llama_binaries = collect_dynamic_libs('llama_cpp')
 
+# ONNX Runtime ships its own native libraries (ONNX and int8 embedder backends)
+onnx_binaries = collect_dynamic_libs('onnxruntime')
+
 # Additional binaries if needed (usually auto-detected)
 additional_binaries = []
 
@@ -48,18 +51,24 @@ except:
 a = Analysis(
     ['gui_app.py'],
     pathex=[],
-    binaries=llama_binaries + additional_binaries,
+    binaries=llama_binaries + onnx_binaries + additional_binaries,
     datas=model_data + [
         ('*.py', '.'),  # Include all Python files
     ],
     hiddenimports=[
         'llama_cpp',
         'llama_cpp.llama_cpp', 
+        'llama_cpp.llama_speculative',
         'sentence_transformers',
         'transformers',
         'torch',
         'numpy',
         'faiss',
+        'onnxruntime',
+        'onnxruntime.quantization',
+        'onnx',
+        'tokenizers',
+        'watchdog.observers',
         'customtkinter',
         'tkinter',
         'threading',
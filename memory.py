@@ -0,0 +1,130 @@
+import tuning
+from response import default_engine, count_tokens, truncate_tokens
+
+# Summary memory for long chats: turns older than the last few are folded into a running summary
+# by the LLM while the app is idle, so prompts carry the summary and the recent turns verbatim
+# instead of the whole history. Summaries are kept per conversation in the transcript store and
+# each refresh only folds in the turns added since the one before
+
+VERBATIM_PAIRS = 3  # most recent question/answer pairs always sent as they are
+REFRESH_MIN_MESSAGES = 4  # turns waiting beyond the verbatim ones before a refresh is worth it
+REFRESH_INPUT_TOKENS = 1024  # turns folded per refresh; a longer backlog takes several
+SUMMARY_MAX_TOKENS = 256
+SUMMARY_WORDS = 150
+KEEP_STATE_MIN_TOKENS = 256  # a shorter chat prompt is cheaper to re-evaluate than to copy aside
+KEEP_STATE_RAM_HEADROOM = 1 * 2**30  # RAM that must stay free after the copy
+KV_BYTES_PER_TOKEN = 128 * 2**10  # when the model metadata doesn't say (Mistral 7B: f16 K and V)
+
+SUMMARY_PROMPT = """<|user|>
+Update the summary of a conversation between a user and an assistant with the new messages below. \
+Keep names, facts, numbers, decisions, preferences and open questions; leave out small talk. \
+Write at most {words} words and reply with the summary only.
+
+Summary so far:
+{summary}
+
+New messages:
+{turns}<|end|>
+<|assistant|>"""
+
+def state_bytes(llm):
+    # Estimated size of llm.save_state(): K and V of every cached token, plus its logits
+    # when they are kept for every position (speculative decoding)
+    meta = getattr(llm, 'metadata', None) or {}
+    arch = meta.get('general.architecture')
+    try:
+        heads = int(meta[f"{arch}.attention.head_count"])
+        kv_heads = int(meta.get(f"{arch}.attention.head_count_kv", heads))
+        head_dim = int(meta[f"{arch}.embedding_length"]) // heads
+        per_token = 2 * int(meta[f"{arch}.block_count"]) * kv_heads * head_dim * 2
+    except (KeyError, ValueError, ZeroDivisionError):
+        per_token = KV_BYTES_PER_TOKEN
+    if getattr(getattr(llm, 'context_params', None), 'logits_all', False):
+        per_token += llm.n_vocab() * 4
+    return llm.n_tokens * per_token
+
+def keep_chat_state(llm):
+    # Whether to copy the chat's KV cache aside during a refresh rather than re-evaluate it later
+    if llm.n_tokens < KEEP_STATE_MIN_TOKENS:
+        return False
+    ram = tuning.available_ram()
+    return ram is None or ram > state_bytes(llm) + KEEP_STATE_RAM_HEADROOM
+
+def format_turn(turn):
+    return f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}\n"
+
+class ConversationMemory:
+    def __init__(self, store, engine=None, verbatim_pairs=VERBATIM_PAIRS):
+        self.store = store
+        self.engine = engine or default_engine
+        self.verbatim_pairs = verbatim_pairs
+
+    def context(self, conversation_id, before=None):
+        # (summary or None, turns it does not cover yet); the summary may lag behind by a few turns,
+        # which are then sent verbatim until the next refresh
+        summary, through_id = self.store.get_summary(conversation_id)
+        turns = self.store.turns(conversation_id, after=through_id, before=before)
+        return summary, [{'role': turn['role'], 'content': turn['content']} for turn in turns]
+
+    def refresh(self, conversation_id, n_threads=None, cancel_event=None):
+        # Folds the oldest unsummarized turns into the summary; False if there was nothing worth
+        # folding or cancel_event was set before the summary was complete
+        summary, through_id = self.store.get_summary(conversation_id)
+        turns = self.store.turns(conversation_id, after=through_id)
+        fold = turns[:max(0, len(turns) - self.verbatim_pairs * 2)]
+        if not fold or len(fold) < REFRESH_MIN_MESSAGES:
+            return False
+
+        engine = self.engine
+        with engine.lock:
+            llm = engine.get(n_threads=n_threads)
+            if cancel_event is not None and cancel_event.is_set():
+                return False  # cancelled while waiting for the model
+            # The summary prompt replaces the chat's KV cache. A long chat prompt is copied aside and
+            # restored afterwards, if there is RAM for the copy, so the next message still reuses it;
+            # a short one, or one too large to copy, is evaluated again with the next message
+            chat_state = llm.save_state() if keep_chat_state(llm) else None
+            try:
+                return self.summarize(conversation_id, llm, summary, fold, cancel_event)
+            finally:
+                if chat_state is not None:
+                    llm.load_state(chat_state)
+                else:
+                    llm.reset()
+
+    def summarize(self, conversation_id, llm, summary, fold, cancel_event):
+        # Called with the engine held and the chat's KV cache set aside
+        budget = min(REFRESH_INPUT_TOKENS, llm.n_ctx() - SUMMARY_MAX_TOKENS - count_tokens(llm, summary or "") - 128)
+        text = ""
+        used = 0
+        through_id = None
+        for turn in fold:
+            turn_text = format_turn(turn)
+            cost = count_tokens(llm, turn_text)
+            if used and used + cost > budget:
+                break
+            if cost > budget:
+                turn_text = truncate_tokens(llm, turn_text, budget) + "\n"  # one very long message
+            text += turn_text
+            used += cost
+            through_id = turn['id']
+
+        prompt = SUMMARY_PROMPT.format(words=SUMMARY_WORDS, summary=summary or "(none yet)", turns=text)
+        llm.reset()
+        completion = llm(llm.tokenize(prompt.encode("utf-8")), max_tokens=SUMMARY_MAX_TOKENS, temperature=0.0,
+                         stop=["<|end|>"], echo=False, stream=True)
+        parts = []
+        try:
+            for chunk in completion:
+                # Checked between tokens so a new message gets the model right away
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                parts.append(chunk['choices'][0]['text'])
+        finally:
+            completion.close()
+
+        new_summary = "".join(parts).strip()
+        if not new_summary:
+            return False
+        self.store.save_summary(conversation_id, new_summary, through_id)
+        return True
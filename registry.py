@@ -0,0 +1,93 @@
+import threading
+import time
+import RAG
+import tuning
+from response import default_engine
+
+READY_POLL_SEC = 0.1  # how often a wait for the models checks its cancel event
+
+class ModelRegistry:
+    # Shared, lazily created models: the embedder, the current RAG index and the LLM engine.
+    # warm_up() loads them on background threads; callers that need one before it is ready wait
+    def __init__(self, engine=None):
+        self.engine = engine or default_engine
+        self.index = None
+        self.metadata = None
+        self.index_lock = threading.Lock()
+        self.embedder_ready = threading.Event()
+        self.index_ready = threading.Event()
+        self.llm_ready = threading.Event()
+        self.status = {'embedder': "pending", 'index': "pending", 'llm': "pending"}
+        self.on_status = None
+
+    def set_status(self, name, status):
+        self.status[name] = status
+        if self.on_status is not None:
+            self.on_status(dict(self.status))
+
+    def warm_up(self, n_threads=None, on_status=None):
+        self.on_status = on_status
+
+        def load_rag():
+            try:
+                RAG.get_embedder()
+                self.set_status('embedder', "ready")
+            except Exception as e:
+                self.set_status('embedder', f"failed: {e}")
+            finally:
+                self.embedder_ready.set()
+            try:
+                index, metadata = RAG.load_faiss_index_and_metadata()
+                self.set_index(index, metadata)
+                self.set_status('index', "ready" if index is not None else "empty")
+            except Exception as e:
+                self.set_status('index', f"failed: {e}")
+            finally:
+                self.index_ready.set()
+
+        def load_llm():
+            try:
+                self.engine.configure(**tuning.load_config(self.engine.model_path))
+                self.engine.get(n_threads=n_threads)
+                self.set_status('llm', "ready")
+            except Exception as e:
+                self.set_status('llm', f"failed: {e}")
+            finally:
+                self.llm_ready.set()
+
+        threading.Thread(target=load_rag, daemon=True).start()
+        threading.Thread(target=load_llm, daemon=True).start()
+
+    @property
+    def is_ready(self):
+        return self.embedder_ready.is_set() and self.index_ready.is_set() and self.llm_ready.is_set()
+
+    def wait_until_ready(self, need_rag=True, timeout=None, cancel_event=None):
+        # True once the needed models are loaded; False after timeout seconds or once cancel_event
+        # is set, so a stopped message doesn't wait for the load to finish
+        events = [self.embedder_ready, self.index_ready, self.llm_ready] if need_rag else [self.llm_ready]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for event in events:
+            while not event.is_set():
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                wait = READY_POLL_SEC if deadline is None else min(READY_POLL_SEC, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+                event.wait(wait)
+        return True
+
+    def get_embedder(self):
+        return RAG.get_embedder()
+
+    def get_index(self):
+        # index and metadata are only ever read and replaced together
+        with self.index_lock:
+            return self.index, self.metadata
+
+    def set_index(self, index, metadata):
+        with self.index_lock:
+            self.index, self.metadata = index, metadata
+        self.index_ready.set()
+
+registry = ModelRegistry()
@@ -1,32 +1,388 @@
-from llama_cpp import Llama
 import os
+import gc
+import threading
+import time
+import numpy as np
+import tracing
+import tuning
 
-def ask_ai(prompt, tokens, n_threads=4, conversation_history=None):
-    model_path = "./models/mistral-7b-instruct-v0.1/mistral-7b-instruct-v0.1.Q4_K_M.gguf"  # . for source and .. for build
-    llm = Llama(
-        model_path=model_path,
-        n_ctx=4096,
-        n_threads=n_threads,
-        n_gpu_layers=0,
-        verbose=False
-    )
+model_path = "./models/mistral-7b-instruct-v0.1/mistral-7b-instruct-v0.1.Q4_K_M.gguf"  # . for source and .. for build
 
+# Prompt budget: n_ctx minus the reserved max_tokens is shared by the question, RAG context and history
+RAG_CONTEXT_SHARE = 0.5  # of what is left after the question
+MIN_CHUNK_TOKENS = 32  # a chunk cut shorter than this is dropped instead
+HISTORY_REFILL = 0.75  # after trimming, history refills from here so the prompt prefix stays put for a few turns
+
+# Speculative decoding: cheap drafts of the next few tokens are checked by the main model in one
+# batch, and a drafted token is kept only where the main model samples that same token itself.
+# Greedy output is identical to decoding without it (bench.py checks this); with sampling, the
+# answers follow the same distribution but differ from run to run as they always do
+#   prompt-lookup  drafts by matching the last tokens against earlier text (RAG context, history)
+#   draft-model    drafts with a small GGUF that shares the main model's vocabulary
+SPECULATIVE_MODES = ("off", "prompt-lookup", "draft-model")
+DRAFT_TOKENS = 10
+
+class DraftModel:
+    # Greedy drafts from a small model; keeps its own KV cache for the shared prefix between calls.
+    # n_ctx has to match the main model's, since every draft sees the whole prompt
+    def __init__(self, model_path, n_ctx, num_pred_tokens=DRAFT_TOKENS, n_threads=None):
+        from llama_cpp import Llama
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=0, verbose=False)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = input_ids.tolist()[-(self.llm.n_ctx() - self.num_pred_tokens):]
+        draft = []
+        # generate() reuses the KV cache for the prefix it shares with the previous call
+        for token in self.llm.generate(tokens, top_k=1, temp=0.0, repeat_penalty=1.0, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+class DraftStats:
+    # Wraps a draft model to measure acceptance. llama.cpp calls it with the tokens kept so far, so the
+    # next call shows how much of the previous draft survived: the accepted tokens sit right where the
+    # draft was placed, followed by the main model's own token. The last draft of an answer is never
+    # verified and isn't counted
+    def __init__(self, draft_model):
+        self.draft_model = draft_model
+        self.reset()
+
+    def __call__(self, input_ids, **kwargs):
+        if self.pending is not None:
+            start, draft = self.pending
+            self.drafted += len(draft)
+            self.accepted += common_prefix_length(draft, input_ids[start:start + len(draft)].tolist())
+        draft = self.draft_model(input_ids, **kwargs)
+        self.steps += 1
+        self.pending = (len(input_ids), draft.tolist())
+        return draft
+
+    def reset(self):
+        self.steps = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.pending = None
+
+class LlamaEngine:
+    # Keeps one Llama resident between messages; only rebuilt when a load-time param changes
+    def __init__(self, model_path=model_path, n_ctx=4096, n_threads=4, n_threads_batch=None, n_batch=512,
+                 use_mlock=False, use_mmap=True, speculative="off", draft_model_path=None, draft_tokens=DRAFT_TOKENS,
+                 cpu_affinity=None):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.n_threads_batch = n_threads_batch  # prompt eval threads; None = n_threads
+        self.n_batch = n_batch
+        self.use_mlock = use_mlock
+        self.use_mmap = use_mmap
+        self.cpu_affinity = cpu_affinity  # None or "physical", see tuning.set_cpu_affinity
+        self.speculative = speculative
+        self.draft_model_path = draft_model_path
+        self.draft_tokens = draft_tokens
+        self.draft_stats = None
+        self.llm = None
+        self.lock = threading.RLock()
+        self.last_prompt_stats = {'prompt_tokens': 0, 'cached_tokens': 0}
+        self.last_completion_stats = {'completion_tokens': 0, 'finish_reason': None}
+        self.last_draft_stats = None
+
+    @property
+    def is_loaded(self):
+        return self.llm is not None
+
+    def load_params(self):
+        return {
+            'model_path': self.model_path,
+            'n_ctx': self.n_ctx,
+            'n_threads': self.n_threads,
+            'n_threads_batch': self.n_threads_batch,
+            'n_batch': self.n_batch,
+            'use_mlock': self.use_mlock,
+            'use_mmap': self.use_mmap,
+            'cpu_affinity': self.cpu_affinity,
+            'speculative': self.speculative,
+            'draft_model_path': self.draft_model_path,
+            'draft_tokens': self.draft_tokens,
+        }
+
+    def configure(self, **params):
+        # Changes load-time params; a resident model is dropped only if something actually changed
+        with self.lock:
+            current = self.load_params()
+            unknown = set(params) - set(current)
+            if unknown:
+                raise ValueError(f"Unknown engine params: {', '.join(sorted(unknown))}")
+            if self.llm is not None and any(current[name] != value for name, value in params.items()):
+                self.unload()
+            for name, value in params.items():
+                setattr(self, name, value)
+
+    def get(self, n_threads=None, n_ctx=None):
+        with self.lock:
+            params = self.load_params()
+            if n_threads is not None:
+                params['n_threads'] = n_threads
+            if n_ctx is not None:
+                params['n_ctx'] = n_ctx
+
+            if self.llm is not None and params != self.load_params():
+                self.unload()
+
+            self.n_ctx = params['n_ctx']
+            self.n_threads = params['n_threads']
+
+            if self.llm is None:
+                from llama_cpp import Llama  # heavy native import, deferred until the model is needed
+                tuning.set_cpu_affinity(self.cpu_affinity)
+                draft_model = self.create_draft_model()
+                self.draft_stats = DraftStats(draft_model) if draft_model is not None else None
+                self.llm = Llama(
+                    model_path=self.model_path,
+                    n_ctx=self.n_ctx,
+                    n_threads=self.n_threads,
+                    n_threads_batch=self.n_threads_batch or self.n_threads,
+                    n_batch=self.n_batch,
+                    use_mlock=self.use_mlock,
+                    use_mmap=self.use_mmap,
+                    n_gpu_layers=0,
+                    draft_model=self.draft_stats,  # also makes llama.cpp keep logits for every position
+                    verbose=False
+                )
+            return self.llm
+
+    def create_draft_model(self):
+        if self.speculative == "prompt-lookup":
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+            return LlamaPromptLookupDecoding(num_pred_tokens=self.draft_tokens)
+        if self.speculative == "draft-model":
+            if not self.draft_model_path or not os.path.exists(self.draft_model_path):
+                print(f"Draft model {self.draft_model_path!r} not found; decoding without speculation")
+                return None
+            return DraftModel(self.draft_model_path, self.n_ctx, num_pred_tokens=self.draft_tokens,
+                              n_threads=self.n_threads)
+        if self.speculative not in SPECULATIVE_MODES:
+            print(f"Unknown speculative mode {self.speculative!r}; decoding without speculation")
+        return None
+
+    def unload(self):
+        with self.lock:
+            if self.llm is None:
+                return
+            # close() only exists on newer llama-cpp-python builds
+            if hasattr(self.llm, 'close'):
+                self.llm.close()
+            self.llm = None
+            self.draft_stats = None
+            gc.collect()
+
+    def reload(self):
+        with self.lock:
+            self.unload()
+            return self.get()
+
+    def record_prompt_stats(self, llm, prompt_tokens):
+        # Llama.generate already keeps the KV cache for the longest prefix of the prompt
+        # (minus its last token, which must be evaluated for logits) shared with the cached
+        # tokens; the same count is computed here only to report how much was reused
+        cached = llm.input_ids[:llm.n_tokens].tolist()
+        self.last_prompt_stats = {
+            'prompt_tokens': len(prompt_tokens),
+            'cached_tokens': common_prefix_length(cached, prompt_tokens[:-1]),
+        }
+
+default_engine = LlamaEngine()
+
+def common_prefix_length(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def format_message(message):
+    if message['role'] == 'system':
+        return f"<|system|>\n{message['content']}<|end|>\n"
+    elif message['role'] == 'user':
+        return f"<|user|>\n{message['content']}<|end|>\n"
+    elif message['role'] == 'assistant':
+        return f"<|assistant|>\n{message['content']}<|end|>\n"
+    return ""
+
+def format_conversation(prompt, conversation_history=None):
     conversation_text = ""
-    
+
     if conversation_history:
         for message in conversation_history:
-            if message['role'] == 'user':
-                conversation_text += f"<|user|>\n{message['content']}<|end|>\n"
-            elif message['role'] == 'assistant':
-                conversation_text += f"<|assistant|>\n{message['content']}<|end|>\n"
-    
+            conversation_text += format_message(message)
+
     conversation_text += f"<|user|>\n{prompt}<|end|>\n<|assistant|>"
+    return conversation_text
+
+def summary_message(summary):
+    # A conversation summary leads the history as a system message
+    return {'role': 'system', 'content': f"Summary of the conversation so far:\n{summary}"}
+
+def count_tokens(llm, text):
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+def truncate_tokens(llm, text, n):
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=False)[:max(n, 0)]
+    return llm.detokenize(tokens).decode("utf-8", errors="ignore")
+
+def next_user_turn(history, start):
+    # History is dropped a whole exchange at a time: up to the next user message after start.
+    # It need not start with one (a fold can leave an assistant turn first)
+    start += 1
+    while start < len(history) and history[start]['role'] != 'user':
+        start += 1
+    return start
+
+def assemble_prompt(question, max_tokens, conversation_history=None, context_chunks=None, build_prompt=None,
+                    engine=None, n_threads=None, summary=None):
+    # Fits the question, RAG chunks, conversation summary and history into n_ctx - max_tokens, measured
+    # with the model's tokenizer. Lowest value goes first: oldest history, then the lowest-ranked chunks
+    # (the last one kept may be cut short), then the summary, and only then the question itself
+    engine = engine or default_engine
+    history = list(conversation_history or [])
+    head = [summary_message(summary)] if summary else []
+    chunks = list(context_chunks or []) if build_prompt is not None else []
+    with engine.lock:
+        llm = engine.get(n_threads=n_threads)
+        budget = llm.n_ctx() - max_tokens - 1  # 1 for BOS
+        if budget <= 0:
+            raise ValueError(f"Max tokens must be less than the context size ({llm.n_ctx()})")
+
+        def render(chunks):
+            return build_prompt(chunks, question) if chunks else question
+
+        fixed = count_tokens(llm, format_conversation(render([]), head))
+        if fixed > budget:
+            head = []
+            fixed = count_tokens(llm, format_conversation(render([])))
+        if fixed > budget:
+            question = truncate_tokens(llm, question, count_tokens(llm, question) - (fixed - budget))
+            chunks, history = [], []
+            fixed = count_tokens(llm, format_conversation(render([])))
+
+        used_chunks = []
+        rag_left = int((budget - fixed) * RAG_CONTEXT_SHARE)
+        for chunk in chunks:
+            cost = count_tokens(llm, chunk) + 2  # separator between chunks
+            if cost <= rag_left:
+                used_chunks.append(chunk)
+                rag_left -= cost
+                continue
+            if rag_left - 2 >= MIN_CHUNK_TOKENS:
+                used_chunks.append(truncate_tokens(llm, chunk, rag_left - 2))
+            break
+        prompt = render(used_chunks)
+
+        history_left = budget - count_tokens(llm, format_conversation(prompt, head))
+        costs = [count_tokens(llm, format_message(message)) for message in history]
+        if sum(costs) > history_left:
+            # Drop whole exchanges from the front, down to HISTORY_REFILL of the budget
+            target = history_left * HISTORY_REFILL
+            start = 0
+            while start < len(history) and sum(costs[start:]) > target:
+                start = next_user_turn(history, start)
+            history = history[start:]
+
+        # Piecewise counts can be off by a few tokens at the seams; check the real prompt
+        while count_tokens(llm, format_conversation(prompt, head + history)) > budget:
+            if history:
+                history = history[next_user_turn(history, 0):]
+            elif used_chunks:
+                used_chunks.pop()
+                prompt = render(used_chunks)
+            elif head:
+                head = []
+            elif question:
+                question = truncate_tokens(llm, question, count_tokens(llm, question) - 8)
+                prompt = render([])
+            else:
+                break
+
+        return {
+            'prompt': prompt,
+            'history': head + history,
+            'chunks': used_chunks,
+            'prompt_tokens': count_tokens(llm, format_conversation(prompt, head + history)) + 1,
+        }
+
+def stream_ai(prompt, tokens, n_threads=4, conversation_history=None, engine=None, cancel_event=None,
+              temperature=None):
+    # temperature=None keeps llama.cpp's default sampling; 0 decodes greedily
+    engine = engine or default_engine
+    conversation_text = format_conversation(prompt, conversation_history)
 
-    output = llm(
-        conversation_text,
-        max_tokens=tokens, 
-        stop=["<|end|>"], 
-        echo=False
-    )
+    # Llama is not thread-safe, so hold the engine until the stream is finished
+    with engine.lock:
+        start = time.perf_counter()
+        with tracing.span('model_load'):
+            llm = engine.get(n_threads=n_threads)
+        with tracing.span('tokenize'):
+            prompt_tokens = llm.tokenize(conversation_text.encode("utf-8"))
+            engine.record_prompt_stats(llm, prompt_tokens)
+        draft_stats = engine.draft_stats
+        if draft_stats is not None:
+            draft_stats.reset()
+        eval_start = time.perf_counter()
+        sampling = {} if temperature is None else {'temperature': temperature}
+        completion = llm(
+            prompt_tokens,
+            max_tokens=tokens,
+            stop=["<|end|>"],
+            echo=False,
+            stream=True,
+            **sampling
+        )
+        first_token = None
+        parts = []
+        finish_reason = None
+        try:
+            for chunk in completion:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    tracing.add_span('prompt_eval', eval_start, first_token)
+                # Checked between tokens so Stop frees the CPU right away
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                choice = chunk['choices'][0]
+                finish_reason = choice.get('finish_reason') or finish_reason
+                text = choice['text']
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            completion.close()
+            end = time.perf_counter()
+            # Streamed pieces aren't tokens (multi-byte characters and held-back stop text get merged),
+            # so the answer is counted with the model's tokenizer
+            count = count_tokens(llm, "".join(parts))
+            engine.last_completion_stats = {
+                'completion_tokens': count,
+                'finish_reason': finish_reason or ("length" if count >= tokens else "stop"),
+            }
+            if first_token is not None:
+                tracing.add_span('decode', first_token, end)
+            decode_sec = end - (first_token or end)
+            if draft_stats is not None and draft_stats.drafted:
+                engine.last_draft_stats = {'drafted_tokens': draft_stats.drafted,
+                                           'accepted_tokens': draft_stats.accepted,
+                                           'acceptance_rate': draft_stats.accepted / draft_stats.drafted}
+                tracing.record(**engine.last_draft_stats)
+            else:
+                engine.last_draft_stats = None
+            tracing.record(prompt_tokens=engine.last_prompt_stats['prompt_tokens'],
+                           cached_tokens=engine.last_prompt_stats['cached_tokens'],
+                           completion_tokens=count,
+                           ttft_ms=((first_token or end) - start) * 1000,
+                           tokens_per_sec=(count - 1) / decode_sec if count > 1 and decode_sec > 0 else 0.0)
 
-    return output['choices'][0]['text']
+def ask_ai(prompt, tokens, n_threads=4, conversation_history=None, engine=None, cancel_event=None,
+           temperature=None):
+    return "".join(stream_ai(prompt, tokens, n_threads=n_threads, conversation_history=conversation_history,
+                             engine=engine, cancel_event=cancel_event, temperature=temperature))
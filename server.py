@@ -0,0 +1,399 @@
+import argparse
+import json
+import queue
+import select
+import socket
+import threading
+import time
+import tuning
+import uuid
+import urllib.request
+import urllib.error
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Headless mode: retrieval and generation over a localhost, OpenAI-style HTTP API.
+# One resident model is shared by every session through a single scheduler thread
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MODEL_NAME = "locai"
+MAX_QUEUE = 8  # requests waiting for the model; more are turned away with 429
+MAX_SESSION_STATES = 2  # saved KV caches of idle sessions (each can be hundreds of MB)
+MESSAGE_ROLES = ('system', 'user', 'assistant')
+CLIENT_CHECK_SEC = 0.5  # how often a waiting request checks that its client is still connected
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, session, question, history, chunks, max_tokens, n_threads, use_rag):
+        self.session = session
+        self.question = question
+        self.history = history
+        self.chunks = chunks
+        self.max_tokens = max_tokens
+        self.n_threads = n_threads
+        self.use_rag = use_rag
+        self.output = queue.Queue()  # text pieces, then None; an Exception on failure
+        self.cancel = threading.Event()
+        self.submitted = time.perf_counter()
+        self.plan = None
+        self.completion_tokens = 0
+        self.finish_reason = None
+
+class Scheduler:
+    # Runs jobs one at a time against the shared engine. Switching sessions saves the
+    # outgoing session's KV cache and restores the incoming one's, so each session keeps
+    # its prompt-prefix reuse even when requests from several sessions interleave
+    def __init__(self, engine, max_queue=MAX_QUEUE, max_sessions=MAX_SESSION_STATES):
+        self.engine = engine
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.max_sessions = max_sessions
+        self.session_states = OrderedDict()
+        self.active_session = None
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'rejected': 0, 'cancelled': 0, 'failed': 0,
+                      'running': 0, 'completion_tokens': 0, 'queue_wait_ms_total': 0.0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.stats['rejected'] += 1
+            raise QueueFull()
+        with self.lock:
+            self.stats['submitted'] += 1
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+        finished = stats['completed'] + stats['cancelled'] + stats['failed']
+        stats['queue_depth'] = self.jobs.qsize()
+        stats['queue_capacity'] = self.jobs.maxsize
+        stats['queue_wait_ms_avg'] = stats.pop('queue_wait_ms_total') / finished if finished else 0.0
+        stats['sessions_cached'] = len(self.session_states)
+        stats['active_session'] = self.active_session
+        return stats
+
+    def switch_session(self, llm, session):
+        if session == self.active_session:
+            return
+        if self.active_session is not None and llm.n_tokens > 0:
+            self.session_states[self.active_session] = llm.save_state()
+            self.session_states.move_to_end(self.active_session)
+            while len(self.session_states) > self.max_sessions:
+                self.session_states.popitem(last=False)
+        state = self.session_states.pop(session, None)
+        if state is not None:
+            llm.load_state(state)
+        else:
+            llm.reset()
+        self.active_session = session
+
+    def run(self):
+        from response import assemble_prompt, stream_ai
+        from RAG import build_prompt
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.stats['running'] = 1
+                self.stats['queue_wait_ms_total'] += (time.perf_counter() - job.submitted) * 1000
+            outcome = 'completed'
+            try:
+                if job.cancel.is_set():
+                    outcome = 'cancelled'
+                    continue
+                with self.engine.lock:
+                    llm = self.engine.get(n_threads=job.n_threads)
+                    self.switch_session(llm, job.session)
+                    job.plan = assemble_prompt(job.question, job.max_tokens, conversation_history=job.history,
+                                               context_chunks=job.chunks,
+                                               build_prompt=build_prompt if job.use_rag else None,
+                                               engine=self.engine, n_threads=job.n_threads)
+                    for text in stream_ai(job.plan['prompt'], job.max_tokens, n_threads=job.n_threads,
+                                          conversation_history=job.plan['history'], engine=self.engine,
+                                          cancel_event=job.cancel):
+                        job.output.put(text)
+                    job.plan['cached_tokens'] = self.engine.last_prompt_stats['cached_tokens']
+                    job.completion_tokens = self.engine.last_completion_stats['completion_tokens']
+                    job.finish_reason = self.engine.last_completion_stats['finish_reason']
+                if job.cancel.is_set():
+                    outcome = 'cancelled'
+            except Exception as e:
+                outcome = 'failed'
+                job.output.put(e)
+            finally:
+                job.output.put(None)
+                with self.lock:
+                    self.stats['running'] = 0
+                    self.stats[outcome] += 1
+                    self.stats['completion_tokens'] += job.completion_tokens
+
+def valid_message(message):
+    return (isinstance(message, dict) and message.get('role') in MESSAGE_ROLES
+            and isinstance(message.get('content') or "", str))
+
+class LocAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, registry, scheduler, n_threads, use_rag=True):
+        super().__init__(address, RequestHandler)
+        self.registry = registry
+        self.scheduler = scheduler
+        self.n_threads = n_threads
+        self.use_rag = use_rag
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "LocAI"
+
+    def send_json(self, status, value, headers=None):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, header in (headers or {}).items():
+            self.send_header(name, header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {'error': {'message': message, 'code': status}}, headers)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            self.send_json(200, {'object': "list", 'data': [{'id': MODEL_NAME, 'object': "model", 'owned_by': "local"}]})
+        elif self.path == "/metrics":
+            self.send_json(200, self.server.scheduler.metrics())
+        elif self.path == "/health":
+            self.send_json(200, {'status': self.server.registry.status, 'ready': self.server.registry.is_ready})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        body = self.read_json()
+        if not isinstance(body, dict):
+            self.send_error_json(400, "Request body must be a JSON object")
+        elif self.path == "/v1/chat/completions":
+            self.chat_completions(body)
+        elif self.path == "/v1/retrieve":
+            query = body.get('query')
+            if not isinstance(query, str):
+                self.send_error_json(400, "'query' must be a string")
+                return
+            try:
+                top_k = int(body.get('top_k', 2))
+            except (TypeError, ValueError):
+                self.send_error_json(400, "'top_k' must be an integer")
+                return
+            self.send_json(200, {'query': query, 'chunks': self.retrieve(query, top_k)})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def retrieve(self, query, top_k=2):
+        from RAG import retrieve_relevant_chunks
+        registry = self.server.registry
+        registry.wait_until_ready(need_rag=True)
+        index, metadata = registry.get_index()
+        return retrieve_relevant_chunks(query, registry.get_embedder(), index, metadata, top_k=top_k)
+
+    def chat_completions(self, body):
+        messages = body.get('messages')
+        if not isinstance(messages, list) or not all(valid_message(m) for m in messages):
+            self.send_error_json(400, "'messages' must be a list of {'role': system/user/assistant, 'content': string}")
+            return
+        if not messages or messages[-1]['role'] != 'user':
+            self.send_error_json(400, "'messages' must end with a user message")
+            return
+        try:
+            max_tokens = int(body.get('max_tokens') or 256)
+        except (TypeError, ValueError):
+            self.send_error_json(400, "'max_tokens' must be an integer")
+            return
+        question = messages[-1].get('content') or ""
+        history = [{'role': m['role'], 'content': m.get('content') or ""}
+                   for m in messages[:-1] if m['role'] in ('user', 'assistant')]
+        session = str(body.get('session') or body.get('user') or "default")
+        use_rag = self.server.use_rag and bool(body.get('rag', True))
+
+        chunks = []
+        if use_rag:
+            # Retrieval runs on this request's thread, so it overlaps with other sessions' generation
+            chunks = self.retrieve(question)
+        self.server.registry.wait_until_ready(need_rag=use_rag)
+
+        job = Job(session, question, history, chunks, max_tokens, self.server.n_threads, use_rag)
+        try:
+            self.server.scheduler.submit(job)
+        except QueueFull:
+            self.send_error_json(429, "Server is busy; retry shortly", {'Retry-After': "1"})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if body.get('stream'):
+            self.stream_completion(job, completion_id)
+        else:
+            self.full_completion(job, completion_id)
+
+    def completion_extras(self, job):
+        plan = job.plan or {}
+        return {'context': plan.get('chunks', []), 'cached_tokens': plan.get('cached_tokens', 0),
+                'queue_depth': self.server.scheduler.jobs.qsize()}
+
+    def client_gone(self):
+        # A closed connection polls readable and reads as EOF; a waiting client just isn't readable
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def next_output(self, job):
+        # The job's next piece; a client that disconnects meanwhile cancels the job, queued or running
+        while True:
+            try:
+                return job.output.get(timeout=CLIENT_CHECK_SEC)
+            except queue.Empty:
+                if self.client_gone():
+                    job.cancel.set()
+                    raise ConnectionResetError("client disconnected")
+
+    def finish_reason(self, job):
+        return job.finish_reason or "stop"
+
+    def full_completion(self, job, completion_id):
+        parts = []
+        while True:
+            try:
+                item = self.next_output(job)
+            except ConnectionResetError:
+                return
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                self.send_error_json(500, str(item))
+                return
+            parts.append(item)
+        prompt_tokens = (job.plan or {}).get('prompt_tokens', 0)
+        self.send_json(200, {
+            'id': completion_id,
+            'object': "chat.completion",
+            'created': int(time.time()),
+            'model': MODEL_NAME,
+            'choices': [{'index': 0, 'message': {'role': "assistant", 'content': "".join(parts)},
+                         'finish_reason': self.finish_reason(job)}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': job.completion_tokens,
+                      'total_tokens': prompt_tokens + job.completion_tokens},
+            'locai': self.completion_extras(job),
+        })
+
+    def stream_completion(self, job, completion_id):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def event(delta, finish_reason=None, **extra):
+            chunk = {'id': completion_id, 'object': "chat.completion.chunk", 'created': int(time.time()),
+                     'model': MODEL_NAME, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            event({'role': "assistant"})
+            while True:
+                item = self.next_output(job)
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    event({}, "error", error={'message': str(item)})
+                    break
+                event({'content': item})
+            event({}, self.finish_reason(job), locai=self.completion_extras(job))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away: stop generating for it and free the model
+            job.cancel.set()
+
+class ServerClient:
+    # Minimal client for the chat completions endpoint, used by the GUI in client mode
+    def __init__(self, base_url, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or uuid.uuid4().hex
+        self.last_context = []
+
+    def stream_chat(self, prompt, max_tokens, conversation_history=None, use_rag=True, cancel_event=None):
+        messages = list(conversation_history or []) + [{'role': "user", 'content': prompt}]
+        body = json.dumps({'model': MODEL_NAME, 'messages': messages, 'max_tokens': max_tokens, 'stream': True,
+                           'rag': use_rag, 'session': self.session}).encode("utf-8")
+        request = urllib.request.Request(f"{self.base_url}/v1/chat/completions", data=body,
+                                         headers={'Content-Type': "application/json"})
+        self.last_context = []
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read())['error']['message']
+            except (ValueError, KeyError, TypeError):
+                message = str(e)
+            raise RuntimeError(f"Server error {e.code}: {message}")
+        # Closing the connection early is how a stop reaches the server
+        with response:
+            for line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                choice = chunk['choices'][0]
+                if choice.get('finish_reason') == "error":
+                    raise RuntimeError(chunk.get('error', {}).get('message', "Generation failed"))
+                if 'locai' in chunk:
+                    self.last_context = chunk['locai'].get('context', [])
+                text = choice['delta'].get('content')
+                if text:
+                    yield text
+
+def main():
+    from response import SPECULATIVE_MODES
+    parser = argparse.ArgumentParser(description="Run LocAI as a local HTTP server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--threads", type=int, default=tuning.default_threads())
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--no-rag", action="store_true", help="answer without retrieved context")
+    parser.add_argument("--speculative", choices=SPECULATIVE_MODES, default="off", help="speculative decoding mode")
+    parser.add_argument("--draft-model", help="small GGUF sharing the model's vocabulary, for --speculative draft-model")
+    args = parser.parse_args()
+
+    from registry import registry
+    registry.engine.configure(speculative=args.speculative, draft_model_path=args.draft_model)
+    registry.warm_up(n_threads=args.threads, on_status=lambda status: print(f"Model status: {status}"))
+    scheduler = Scheduler(registry.engine, max_queue=args.max_queue)
+    server = LocAIServer((args.host, args.port), registry, scheduler, args.threads, use_rag=not args.no_rag)
+    print(f"LocAI server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import zlib
+import numpy as np
+import pytest
+
+# The app is a flat set of modules in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RAG
+from bench import StubLlama
+from response import LlamaEngine
+
+EMBED_DIM = 32
+
+class StubEmbedder:
+    # Hashed bag of words: texts sharing words end up close, and no model files are needed
+    name = "stub"
+
+    def __init__(self):
+        self.batch_size = 32
+        self.encoded = 0
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=None):
+        vectors = np.zeros((len(texts), EMBED_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.strip(".,!?").encode("utf-8")) % EMBED_DIM] += 1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self.encoded += len(texts)
+        return vectors
+
+def stub_tokenizer():
+    # Whitespace word pieces stand in for the MiniLM tokenizer when chunking
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
+
+@pytest.fixture
+def rag_env(tmp_path, monkeypatch):
+    # RAG with the stub embedder, run in a temporary working directory (INDEX_DIR is relative)
+    monkeypatch.chdir(tmp_path)
+    embedder = StubEmbedder()
+    monkeypatch.setattr(RAG, "tokenizer", stub_tokenizer())
+    monkeypatch.setattr(RAG, "get_embedder", lambda: embedder)
+    RAG.clear_query_caches()
+    (tmp_path / "docs").mkdir()
+    yield embedder
+    RAG.clear_query_caches()
+
+def write_doc(name, text, folder="docs"):
+    path = os.path.join(folder, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+@pytest.fixture
+def stub_engine():
+    # A LlamaEngine whose resident model is bench's StubLlama, so get() never loads a GGUF
+    engine = LlamaEngine()
+    engine.llm = StubLlama(n_ctx=engine.n_ctx, token_delay=0)
+    return engine
@@ -0,0 +1,73 @@
+import json
+import pytest
+import batch
+import RAG
+import response
+from conftest import write_doc
+
+TIMING_KEYS = {'prompt_tokens', 'cached_tokens', 'completion_tokens', 'finish_reason', 'chunks_used', 'ttft_ms',
+               'total_ms', 'tokens_per_sec', 'retrieval_ms'}
+
+@pytest.fixture
+def batch_env(rag_env, stub_engine, monkeypatch):
+    # The stub model as the default engine, no tuned settings, and a small indexed folder
+    monkeypatch.setattr(response, "default_engine", stub_engine)
+    monkeypatch.setattr(batch.tuning, "load_config", lambda model_path: {})
+    write_doc("invoice.txt", "The invoice was paid on Friday.")
+    write_doc("plants.txt", "Photosynthesis turns light into sugar.")
+    assert RAG.build_embeddings("docs")
+    return stub_engine
+
+def write_questions(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_records_are_grouped_by_shared_context(batch_env, tmp_path, capsys):
+    questions = tmp_path / "questions.jsonl"
+    write_questions(questions, [
+        json.dumps({'id': "q1", 'question': "when was the invoice paid"}),
+        json.dumps({'id': "q2", 'prompt': "how does photosynthesis make sugar"}),
+        json.dumps("was the invoice paid friday"),
+        "not json",
+        json.dumps({'id': "q5", 'text': "no question field"}),
+        json.dumps({'request_id': "q6", 'query': "light into sugar"}),
+    ])
+    output = tmp_path / "answers.jsonl"
+    batch.run_batch(str(questions), str(output), max_tokens=4, top_k=1)
+    assert "Skipping line 4" in capsys.readouterr().out
+
+    records = read_records(output)
+    assert sorted(r['id'] for r in records) == ["3", "q1", "q2", "q6"]
+    # Questions retrieving the same chunks run back to back, in input order within a group
+    paths = [r['context'][0]['path'] for r in records]
+    assert sum(a != b for a, b in zip(paths, paths[1:])) == len(set(paths)) - 1
+    assert [r['id'] for r in records if r['context'][0]['path'].endswith("invoice.txt")] == ["q1", "3"]
+    for record in records:
+        assert set(record) == {'id', 'question', 'answer', 'context', 'timings'}
+        assert set(record['context'][0]) == {'chunk_id', 'path', 'chunk_index'}  # no chunk text
+        assert set(record['timings']) == TIMING_KEYS
+        assert record['timings']['completion_tokens'] == 4
+        assert record['timings']['finish_reason'] == "length"
+        assert record['timings']['chunks_used'] == 1
+
+def test_interrupted_run_resumes(batch_env, tmp_path):
+    questions = tmp_path / "questions.jsonl"
+    write_questions(questions, [json.dumps({'id': f"q{i}", 'question': f"invoice question {i}"}) for i in range(3)])
+    output = tmp_path / "answers.jsonl"
+    # q0 was written completely; the run died halfway through writing q1
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({'id': "q0", 'answer': "earlier"}) + "\n" + '{"id": "q1", "ans')
+    assert batch.finished_ids(str(output)) == {"q0"}
+
+    batch.run_batch(str(questions), str(output), max_tokens=2, top_k=1)
+    records = read_records(output)
+    assert [r['id'] for r in records] == ["q0", "q1", "q2"]
+    assert records[0]['answer'] == "earlier"
+
+    # Nothing left to do
+    batch.run_batch(str(questions), str(output), max_tokens=2, top_k=1)
+    assert len(read_records(output)) == 3
@@ -0,0 +1,41 @@
+import os
+import threading
+import RAG
+from conftest import write_doc
+
+def test_cancelled_build_keeps_the_published_generation(rag_env):
+    write_doc("a.txt", "Alpha beta gamma.")
+    assert RAG.build_embeddings("docs")
+    generation = RAG.current_generation()
+
+    for i in range(5):
+        write_doc(f"new{i}.txt", f"Document {i} about delta epsilon.")
+    cancel = threading.Event()
+    reports = []
+
+    def throttle():
+        # Called between files and batches: cancel once the new generation is being written
+        if os.path.exists(RAG.generation_dir(generation + 1)):
+            cancel.set()
+    assert not RAG.build_embeddings("docs", progress=reports.append, cancel_event=cancel, throttle=throttle)
+    assert cancel.is_set()
+    assert reports and not any(report['published'] for report in reports)
+    assert RAG.current_generation() == generation
+    assert not os.path.exists(RAG.generation_dir(generation + 1))
+
+    index, data = RAG.load_faiss_index_and_metadata()
+    assert index.ntotal == 1
+    assert RAG.retrieve_relevant_chunks("alpha beta", rag_env, index, data, top_k=1) == ["Alpha beta gamma."]
+
+    # The next build picks the new files up
+    assert RAG.build_embeddings("docs")
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 6
+
+def test_build_runs_in_the_background(rag_env):
+    write_doc("a.txt", "Alpha beta gamma.")
+    result = []
+    worker = threading.Thread(target=lambda: result.append(RAG.build_embeddings("docs")))
+    worker.start()
+    worker.join(timeout=30)
+    assert result == [True]
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 1
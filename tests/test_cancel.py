@@ -0,0 +1,80 @@
+import threading
+import pytest
+import tracing
+from bench import StubLlama
+from response import stream_ai
+
+class TrackingLlama(StubLlama):
+    # Keeps each completion stream and counts the pieces the model actually produced
+    def __init__(self, n_ctx):
+        super().__init__(n_ctx=n_ctx, token_delay=0)
+        self.completions = []
+        self.produced = 0
+
+    def __call__(self, tokens, max_tokens=16, stream=True, **kwargs):
+        pieces = super().__call__(tokens, max_tokens=max_tokens, stream=stream, **kwargs)
+
+        def generate():
+            for piece in pieces:
+                self.produced += 1
+                yield piece
+        completion = generate()
+        self.completions.append(completion)
+        return completion
+
+@pytest.fixture
+def llm(stub_engine):
+    stub_engine.llm = TrackingLlama(stub_engine.n_ctx)
+    return stub_engine.llm
+
+def is_closed(completion):
+    return completion.gi_frame is None
+
+def test_stop_ends_the_stream_between_tokens(stub_engine, llm):
+    cancel = threading.Event()
+    pieces = []
+    for piece in stream_ai("tell me a long story", 64, engine=stub_engine, cancel_event=cancel):
+        pieces.append(piece)
+        if len(pieces) == 3:
+            cancel.set()
+    assert pieces == [" tok0", " tok1", " tok2"]
+    # One more token was decoded before the check; the rest never are
+    assert llm.produced == 4
+    assert is_closed(llm.completions[0])
+    assert stub_engine.last_completion_stats['completion_tokens'] == 3
+
+def test_stop_before_the_first_token(stub_engine, llm):
+    cancel = threading.Event()
+    cancel.set()
+    assert list(stream_ai("tell me a long story", 64, engine=stub_engine, cancel_event=cancel)) == []
+    assert llm.produced == 1 and is_closed(llm.completions[0])
+    assert stub_engine.last_completion_stats['completion_tokens'] == 0
+
+def test_abandoned_stream_is_closed(stub_engine, llm):
+    # A client that goes away closes the generator instead of setting the event
+    stream = stream_ai("tell me a long story", 64, engine=stub_engine)
+    assert [next(stream), next(stream)] == [" tok0", " tok1"]
+    stream.close()
+    assert llm.produced == 2 and is_closed(llm.completions[0])
+    assert stub_engine.last_completion_stats['completion_tokens'] == 2
+
+def test_engine_is_free_after_a_stop(stub_engine, llm):
+    cancel = threading.Event()
+    for _ in stream_ai("first question", 64, engine=stub_engine, cancel_event=cancel):
+        cancel.set()
+    # Another thread can take the engine straight away
+    result = []
+    worker = threading.Thread(target=lambda: result.append(list(stream_ai("second question", 2, engine=stub_engine))))
+    worker.start()
+    worker.join(timeout=5)
+    assert result == [[" tok0", " tok1"]]
+    assert stub_engine.last_completion_stats == {'completion_tokens': 2, 'finish_reason': "length"}
+
+def test_stopped_stream_is_traced(stub_engine, llm):
+    cancel = threading.Event()
+    trace = tracing.Trace("message")
+    with tracing.activate(trace):
+        for _ in stream_ai("tell me a long story", 64, engine=stub_engine, cancel_event=cancel):
+            cancel.set()
+    assert trace.metrics['completion_tokens'] == 1
+    assert [s['name'] for s in trace.spans][-2:] == ['prompt_eval', 'decode']
@@ -0,0 +1,59 @@
+import RAG
+from conftest import stub_tokenizer, write_doc
+
+# With the stub tokenizer every word and every "." is one token: each sentence here is 5 tokens
+SENTENCES = [f"Sentence {i} has words." for i in range(10)]
+TEXT = " ".join(SENTENCES)
+
+def token_count(text):
+    return len(RAG.get_tokenizer().encode(text, add_special_tokens=False).ids)
+
+def test_chunks_stay_within_the_token_limit(rag_env):
+    chunks = RAG.chunk_text(TEXT, chunk_size=12, overlap=0)
+    assert chunks == [" ".join(SENTENCES[i:i + 2]) for i in range(0, 10, 2)]
+    assert all(token_count(chunk) <= 12 for chunk in chunks)
+
+def test_chunks_overlap_by_whole_sentences(rag_env):
+    chunks = RAG.chunk_text(TEXT, chunk_size=12, overlap=5)
+    assert all(token_count(chunk) <= 12 for chunk in chunks)
+    # Each chunk starts with the last sentence of the one before
+    assert chunks[0] == " ".join(SENTENCES[:2])
+    assert chunks[1] == " ".join(SENTENCES[1:3])
+    assert len(chunks) == 9
+
+def test_chunks_split_at_sentence_and_paragraph_boundaries(rag_env):
+    text = "First one here. Second one here!\n\nNew paragraph here? Last one here."
+    assert RAG.chunk_text(text, chunk_size=8, overlap=0) == [
+        "First one here. Second one here!", "New paragraph here? Last one here."]
+    assert RAG.chunk_text(text, chunk_size=100, overlap=0) == [
+        "First one here. Second one here!\n\nNew paragraph here? Last one here."]
+
+def test_long_sentence_is_cut_at_token_boundaries(rag_env):
+    words = [f"w{i}" for i in range(30)]
+    chunks = RAG.chunk_text(" ".join(words) + ". Short one.", chunk_size=8, overlap=0)
+    assert all(token_count(chunk) <= 8 for chunk in chunks)
+    assert " ".join(chunks).split() == words[:-1] + ["w29.", "Short", "one."]
+
+def test_tokenizer_padding_is_not_counted(rag_env, tmp_path, monkeypatch):
+    # A tokenizer.json with fixed padding must not make every sentence look like a full chunk
+    padded = stub_tokenizer()
+    padded.enable_padding(length=128)
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    padded.save(str(model_dir / "tokenizer.json"))
+    monkeypatch.setattr(RAG, "model_path", str(model_dir))
+    monkeypatch.setattr(RAG, "tokenizer", None)
+    assert RAG.chunk_text(TEXT, chunk_size=100, overlap=0) == [TEXT]
+
+def test_chunking_params_are_recorded(rag_env):
+    write_doc("a.txt", TEXT)
+    assert RAG.build_embeddings("docs", chunk_tokens=12, overlap_tokens=0)
+    manifest = RAG.load_manifest(RAG.current_generation())
+    assert manifest['chunking'] == RAG.chunk_params(12, 0)
+    assert len(manifest['files'][RAG.os.path.join("docs", "a.txt")]['chunk_ids']) == 5
+
+    # Other params re-chunk the unchanged file
+    assert RAG.build_embeddings("docs", chunk_tokens=100, overlap_tokens=0)
+    manifest = RAG.load_manifest(RAG.current_generation())
+    assert manifest['chunking'] == RAG.chunk_params(100, 0)
+    assert len(manifest['files'][RAG.os.path.join("docs", "a.txt")]['chunk_ids']) == 1
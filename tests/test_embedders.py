@@ -0,0 +1,130 @@
+import json
+import numpy as np
+import pytest
+import embedders
+from conftest import EMBED_DIM, StubEmbedder
+
+class FakeReference(StubEmbedder):
+    name = "sentence-transformers"
+
+    def __init__(self, model_dir, batch_size=None):
+        super().__init__()
+        self.batch_size = batch_size
+        self.tuning_path = f"{model_dir}/sentence-transformers.tuning.json"
+
+class FakeOnnx(StubEmbedder):
+    def __init__(self, name, tuning_path, batch_size=None):
+        super().__init__()
+        self.name = name
+        self.batch_size = batch_size
+        self.tuning_path = tuning_path
+
+@pytest.fixture
+def backends(tmp_path, monkeypatch):
+    # Each ONNX backend loads (or fails) and verifies to the given cosine
+    cosines = {}
+    failing = set()
+
+    def load_onnx(name, model_dir, batch_size=None):
+        if name in failing:
+            raise ImportError("No module named 'onnxruntime'")
+        return FakeOnnx(name, str(tmp_path / f"{name}.tuning.json"), batch_size), str(tmp_path / f"{name}.onnx")
+    monkeypatch.setattr(embedders, "load_onnx", load_onnx)
+    monkeypatch.setattr(embedders, "verify", lambda embedder, onnx_path, model_dir: cosines[embedder.name])
+    monkeypatch.setattr(embedders, "SentenceTransformerEmbedder", FakeReference)
+    return cosines, failing, str(tmp_path)
+
+@pytest.mark.parametrize("backend, int8, fp32, failing, expected", [
+    ("onnx-int8", 0.995, 0.999, (), "onnx-int8"),
+    ("onnx-int8", 0.95, 0.999, (), "onnx"),  # int8 off tolerance: the fp32 export
+    ("onnx-int8", 0.95, 0.97, (), "sentence-transformers"),
+    ("onnx-int8", 0.995, 0.999, ("onnx-int8", "onnx"), "sentence-transformers"),  # no onnxruntime
+    ("onnx", 0.999, 0.95, (), "sentence-transformers"),  # int8 is never tried for "onnx"
+    ("sentence-transformers", 0.999, 0.999, (), "sentence-transformers"),
+])
+def test_backend_selection(backends, backend, int8, fp32, failing, expected):
+    cosines, failing_backends, model_dir = backends
+    cosines.update({'onnx-int8': int8, 'onnx': fp32})
+    failing_backends.update(failing)
+    assert embedders.create_embedder(backend, model_dir).name == expected
+
+def test_tuned_batch_size_is_reused(backends, monkeypatch):
+    cosines, _, model_dir = backends
+    cosines.update({'onnx-int8': 0.999})
+    embedder = embedders.create_embedder("onnx-int8", model_dir)
+    assert embedder.batch_size is None
+
+    times = iter(np.cumsum([0, 4, 0, 1, 0, 3, 0, 5]))  # (start, end) per candidate: 32 is fastest
+    monkeypatch.setattr(embedders.time, "perf_counter", lambda: float(next(times)))
+    texts = [f"text {i}" for i in range(128)]
+    assert embedders.autotune_batch_size(embedder, texts, candidates=(16, 32, 64, 128)) == 32
+    assert embedder.encoded == 4 * 128
+
+    # The next start reads it back instead of timing again, unless the machine changed
+    assert embedders.create_embedder("onnx-int8", model_dir).batch_size == 32
+    assert embedders.create_embedder("onnx-int8", model_dir, batch_size=64).batch_size == 64
+    with open(embedder.tuning_path) as f:
+        tuned = json.load(f)
+    tuned['cpus'] = -1
+    with open(embedder.tuning_path, "w") as f:
+        json.dump(tuned, f)
+    assert embedders.create_embedder("onnx-int8", model_dir).batch_size is None
+
+def test_verify_covers_long_texts_and_is_cached(tmp_path, monkeypatch):
+    onnx_path = tmp_path / "model.onnx"
+    onnx_path.write_bytes(b"onnx")
+    seen = []
+
+    class Reference(StubEmbedder):
+        def __init__(self, model_dir):
+            super().__init__()
+
+        def encode(self, texts, **kwargs):
+            seen.extend(texts)
+            return super().encode(texts)
+    monkeypatch.setattr(embedders, "SentenceTransformerEmbedder", Reference)
+    candidate = StubEmbedder()
+    assert embedders.verify(candidate, str(onnx_path), str(tmp_path)) == pytest.approx(1.0)
+    assert max(len(text.split()) for text in seen) > embedders.MAX_SEQ_LENGTH
+    assert len(seen) > len(embedders.VERIFY_TEXTS)
+
+    encoded = candidate.encoded
+    embedders.verify(candidate, str(onnx_path), str(tmp_path))
+    assert candidate.encoded == encoded
+    # Another sample (a new version of the check) verifies again
+    monkeypatch.setattr(embedders, "VERIFY_PASSAGE_WORDS", (8,))
+    embedders.verify(candidate, str(onnx_path), str(tmp_path))
+    assert candidate.encoded > encoded
+
+class FakeSession:
+    # last_hidden_state where every token's vector is its id, one-hot; records batch shapes
+    def __init__(self):
+        self.shapes = []
+
+    def run(self, outputs, feeds):
+        ids = feeds['input_ids']
+        self.shapes.append(ids.shape)
+        return [np.eye(EMBED_DIM, dtype=np.float32)[ids]]
+
+def test_onnx_batches_are_length_bucketed(monkeypatch):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    vocab = {f"w{i}": i for i in range(EMBED_DIM)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="w0"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    embedder = embedders.OnnxEmbedder.__new__(embedders.OnnxEmbedder)
+    embedder.session = FakeSession()
+    embedder.input_names = {'input_ids', 'attention_mask'}
+    embedder.tokenizer = tokenizer
+    embedder.batch_size = 2
+
+    lengths = [9, 1, 5, 2, 8, 1]
+    texts = [" ".join(f"w{(i + j) % EMBED_DIM}" for j in range(n)) for i, n in enumerate(lengths)]
+    vectors = embedder.encode(texts)
+    # Short texts are batched together, so padding stays small
+    assert embedder.session.shapes == [(2, 1), (2, 5), (2, 9)]
+    # Output rows are in input order and match encoding each text alone
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, embedder.encode([text])[0], rtol=1e-6)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    order = embedders.length_buckets(np.array(lengths), 4)
+    assert [bucket.tolist() for bucket in order] == [[1, 5, 3, 2], [4, 0]]
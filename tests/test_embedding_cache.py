@@ -0,0 +1,56 @@
+import numpy as np
+import RAG
+from conftest import write_doc
+from embedding_cache import EmbeddingCache, chunk_keys
+
+DIM = 8
+
+def vectors(*values):
+    return np.array([[v] * DIM for v in values], dtype=np.float32)
+
+def test_entries_survive_a_reopen(tmp_path):
+    folder = str(tmp_path / "cache")
+    cache = EmbeddingCache(folder, 2**20)
+    keys = chunk_keys(["alpha", "beta", "alpha"], "model|chunking")
+    assert keys[0] == keys[2] != keys[1]
+    cache.put(keys[:2], vectors(1, 2))
+    cache.save()
+
+    cache = EmbeddingCache(folder, 2**20)
+    found, hits = cache.get(chunk_keys(["beta", "gamma", "alpha"], "model|chunking"))
+    assert hits.tolist() == [True, False, True]
+    assert found[0].tolist() == [2.0] * DIM and found[2].tolist() == [1.0] * DIM
+    # Another namespace (embedder or chunking) never hits
+    assert not EmbeddingCache(folder, 2**20).get(chunk_keys(["alpha"], "other|chunking"))[1].any()
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    folder = str(tmp_path / "cache")
+    max_bytes = 4 * DIM * 2  # room for four vectors
+    keys = np.arange(1, 7, dtype=np.uint64)
+    cache = EmbeddingCache(folder, max_bytes)
+    cache.put(keys[:4], vectors(1, 2, 3, 4))
+    cache.save()
+
+    # The next build uses 3 and 4, then adds two more: 1 and 2 go
+    cache = EmbeddingCache(folder, max_bytes)
+    assert cache.get(keys[2:4])[1].all()
+    cache.put(keys[4:], vectors(5, 6))
+    cache.save()
+
+    cache = EmbeddingCache(folder, max_bytes)
+    found, hits = cache.get(keys)
+    assert hits.tolist() == [False, False, True, True, True, True]
+    assert found[hits, 0].tolist() == [3.0, 4.0, 5.0, 6.0]
+    assert cache.stats()['capacity'] == 4
+
+def test_full_rebuild_embeds_nothing_again(rag_env):
+    write_doc("a.txt", "Alpha beta gamma.")
+    write_doc("b.txt", "Delta epsilon zeta.")
+    assert RAG.build_embeddings("docs")
+    encoded = rag_env.encoded
+
+    progress = []
+    assert RAG.build_embeddings("docs", full_rebuild=True, progress=progress.append)
+    assert progress[-1]['chunks_cached'] == 2
+    assert rag_env.encoded == encoded
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 2
@@ -0,0 +1,87 @@
+import sys
+import types
+import pytest
+import response
+from bench import StubLlama
+
+class FakeLlama(StubLlama):
+    # llama_cpp.Llama as seen by LlamaEngine.get: records its load params and close()
+    loaded = []
+
+    def __init__(self, model_path, n_ctx, **kwargs):
+        super().__init__(n_ctx=n_ctx, token_delay=0)
+        self.params = dict(kwargs, model_path=model_path, n_ctx=n_ctx)
+        self.closed = False
+        FakeLlama.loaded.append(self)
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def affinity(monkeypatch):
+    # Affinity changes are recorded, not applied to the test process
+    modes = []
+    monkeypatch.setattr(response.tuning, "set_cpu_affinity", modes.append)
+    return modes
+
+@pytest.fixture
+def engine(monkeypatch, affinity):
+    # The load path runs against a fake llama_cpp module
+    FakeLlama.loaded = []
+    monkeypatch.setitem(sys.modules, "llama_cpp", types.SimpleNamespace(Llama=FakeLlama))
+    return response.LlamaEngine(model_path="model.gguf", n_threads=4)
+
+def test_model_is_reused_while_params_are_unchanged(engine):
+    llm = engine.get()
+    assert engine.get() is llm
+    assert engine.get(n_threads=4, n_ctx=4096) is llm
+    assert len(FakeLlama.loaded) == 1
+    assert llm.params['n_threads_batch'] == 4  # None follows n_threads
+    assert llm.params['draft_model'] is None
+
+def test_configure_with_the_same_values_keeps_the_model(engine):
+    llm = engine.get()
+    engine.configure(**engine.load_params())
+    engine.configure(n_threads=4, use_mlock=False)
+    assert engine.llm is llm and not llm.closed
+
+@pytest.mark.parametrize("params", [{'n_threads': 2}, {'n_batch': 256}, {'use_mlock': True},
+                                    {'cpu_affinity': "physical"}, {'model_path': "other.gguf"}])
+def test_changed_load_param_reloads(engine, affinity, params):
+    llm = engine.get()
+    engine.configure(**params)
+    assert engine.llm is None and llm.closed
+    reloaded = engine.get()
+    assert reloaded is not llm and len(FakeLlama.loaded) == 2
+    for name, value in params.items():
+        if name in reloaded.params:
+            assert reloaded.params[name] == value
+    assert affinity == [None, engine.cpu_affinity]  # set again before each load
+
+def test_per_call_overrides_reload_and_stick(engine):
+    llm = engine.get()
+    smaller = engine.get(n_ctx=2048)
+    assert smaller is not llm and llm.closed
+    assert smaller.params['n_ctx'] == engine.n_ctx == 2048
+    assert engine.get() is smaller
+
+def test_unknown_params_are_rejected(engine):
+    llm = engine.get()
+    with pytest.raises(ValueError, match="n_gpu_layers"):
+        engine.configure(n_gpu_layers=10, n_threads=2)
+    # Nothing was applied
+    assert engine.llm is llm and engine.n_threads == 4
+
+def test_unload_frees_the_model(engine):
+    engine.unload()  # nothing loaded: no-op
+    llm = engine.get()
+    assert engine.is_loaded
+    engine.unload()
+    assert not engine.is_loaded and llm.closed
+    assert engine.get() is not llm
+
+def test_missing_draft_model_loads_without_speculation(engine, capsys):
+    engine.configure(speculative="draft-model", draft_model_path="missing.gguf")
+    llm = engine.get()
+    assert "not found" in capsys.readouterr().out
+    assert llm.params['draft_model'] is None and engine.draft_stats is None
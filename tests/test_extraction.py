@@ -0,0 +1,71 @@
+import multiprocessing
+import pytest
+import RAG
+from conftest import write_doc
+
+# The pool's workers inherit the stub tokenizer by forking
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="needs fork workers")
+
+def write_docs(count):
+    return [write_doc(f"doc{i:03d}.txt", f"Document {i} talks about topic {i}. It has a second sentence.")
+            for i in range(count)]
+
+@pytest.fixture
+def pools(monkeypatch):
+    # Records the extraction pools that get started
+    started = []
+
+    class Pool(RAG.ProcessPoolExecutor):
+        def __init__(self, max_workers=None):
+            super().__init__(max_workers=max_workers)
+            started.append(max_workers)
+    monkeypatch.setattr(RAG, "ProcessPoolExecutor", Pool)
+    return started
+
+def test_many_files_are_extracted_in_worker_processes(rag_env, pools):
+    paths = write_docs(30)
+    params = RAG.chunk_params()
+    results = list(RAG.iter_extracted(((path, None) for path in paths), params, workers=2))
+    assert pools == [2]
+    assert sorted(path for path, _, _, _ in results) == paths
+    for path, digest, chunks, error in results:
+        assert error is None
+        assert (digest, chunks) == RAG.extract_chunks(path, None, params)[1:3]
+
+def test_few_files_stay_in_process(rag_env, pools):
+    paths = write_docs(RAG.PARALLEL_MIN_FILES - 1)
+    assert len(list(RAG.iter_extracted((path, None) for path in paths))) == len(paths)
+    assert pools == []
+
+def test_unchanged_and_unreadable_files(rag_env, pools):
+    paths = write_docs(RAG.PARALLEL_MIN_FILES)
+    known = RAG.file_hash(paths[0])
+    jobs = [(paths[0], known)] + [(path, None) for path in paths[1:]] + [("docs/missing.txt", None)]
+    results = {path: (digest, chunks, error) for path, digest, chunks, error in RAG.iter_extracted(jobs, workers=2)}
+    assert results[paths[0]] == (known, None, None)  # byte-identical: nothing to embed
+    assert results["docs/missing.txt"][2] is not None
+    assert all(results[path][1] for path in paths[1:])
+
+def test_files_are_handed_out_lazily(rag_env, pools):
+    paths = write_docs(40)
+    pulled = []
+
+    def jobs():
+        for path in paths:
+            pulled.append(path)
+            yield path, None
+    results = RAG.iter_extracted(jobs(), workers=2)
+    next(results)
+    # In-flight work is bounded: the first files, then one more before waiting on results
+    assert len(pulled) <= RAG.PARALLEL_MIN_FILES + 1
+    results.close()  # a cancelled build stops consuming; the pool is shut down
+    assert len(pulled) < len(paths)
+
+def test_build_with_the_pool(rag_env, pools):
+    paths = write_docs(30)
+    assert RAG.build_embeddings("docs")
+    assert pools
+    index, data = RAG.load_faiss_index_and_metadata()
+    assert index.ntotal == 30
+    metadata = data['metadata']
+    assert sorted({metadata[i][0] for i in metadata.live_ids()}) == paths
@@ -0,0 +1,69 @@
+import faiss
+import RAG
+from conftest import write_doc
+
+def test_embedder_backend_change_rebuilds(rag_env, capsys):
+    write_doc("a.txt", "Alpha beta gamma. Delta epsilon.")
+    assert RAG.build_embeddings("docs")
+    assert RAG.load_manifest(RAG.current_generation())['embedder'] == f"{RAG.model_path}|stub"
+
+    # Same files, another backend: every vector is embedded again
+    rag_env.name = "stub-int8"
+    encoded = rag_env.encoded
+    capsys.readouterr()
+    assert RAG.build_embeddings("docs")
+    assert "Embedder changed" in capsys.readouterr().out
+    assert rag_env.encoded > encoded
+    assert RAG.load_manifest(RAG.current_generation())['embedder'] == f"{RAG.model_path}|stub-int8"
+
+def indexed_texts():
+    index, data = RAG.load_faiss_index_and_metadata()
+    metadata = data['metadata']
+    return index, {metadata[i][0]: data['chunks'].get(i) for i in metadata.live_ids()}
+
+def build(**kwargs):
+    progress = []
+    assert RAG.build_embeddings("docs", progress=progress.append, **kwargs)
+    return progress[-1]
+
+def test_add_modify_delete(rag_env):
+    a = write_doc("a.txt", "Alpha beta gamma.")
+    b = write_doc("b.txt", "Delta epsilon zeta.")
+    build()
+    index, texts = indexed_texts()
+    assert texts == {a: "Alpha beta gamma.", b: "Delta epsilon zeta."}
+
+    c = write_doc("c.txt", "Eta theta iota.")
+    assert build()['chunks_embedded'] == 1
+    write_doc("a.txt", "Alpha beta gamma, now with kappa.")
+    assert build()['chunks_embedded'] == 1
+    RAG.os.remove(b)
+    build()
+    index, texts = indexed_texts()
+    assert texts == {a: "Alpha beta gamma, now with kappa.", c: "Eta theta iota."}
+    assert index.ntotal == 2  # old vectors of a and b are gone from the flat index
+
+def test_unchanged_update_only_stats_files(rag_env, monkeypatch):
+    write_doc("a.txt", "Alpha beta gamma.")
+    write_doc("b.txt", "Delta epsilon zeta.")
+    build()
+    generation = RAG.current_generation()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("an update without changes must not load the index or manifest")
+    monkeypatch.setattr(faiss, "read_index", fail)
+    monkeypatch.setattr(RAG, "load_manifest", fail)
+    progress = build()
+    assert progress['files_scanned'] == 2
+    assert RAG.current_generation() == generation
+
+def test_touched_file_keeps_its_vectors(rag_env):
+    a = write_doc("a.txt", "Alpha beta gamma.")
+    build()
+    stat = RAG.os.stat(a)
+    RAG.os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    encoded = rag_env.encoded
+    assert build()['chunks_embedded'] == 0
+    assert rag_env.encoded == encoded
+    _, data = RAG.load_faiss_index_and_metadata()
+    assert not RAG.is_stale(data, a)
@@ -0,0 +1,59 @@
+import faiss
+import numpy as np
+import RAG
+from conftest import EMBED_DIM, write_doc
+
+REAL_READ_INDEX = faiss.read_index
+
+def test_published_index_loads_mapped(rag_env, capsys):
+    write_doc("a.txt", "The invoice was paid on Friday. Alpha beta gamma.")
+    write_doc("b.txt", "Photosynthesis turns light into sugar. Delta epsilon.")
+    assert RAG.build_embeddings("docs")
+
+    index, data = RAG.load_faiss_index_and_metadata()
+    assert "RAG index loaded (mmap" in capsys.readouterr().out
+    assert index.ntotal == 2
+    assert data['generation'] == RAG.current_generation()
+    # Metadata columns come back memory-mapped
+    assert isinstance(data['metadata'].file_ids, np.memmap)
+    chunks = RAG.retrieve_relevant_chunks("invoice paid friday", rag_env, index, data, top_k=1)
+    assert chunks == ["The invoice was paid on Friday. Alpha beta gamma."]
+
+def test_ivfpq_index_is_mapped(tmp_path, capsys):
+    vectors = np.random.default_rng(0).random((2000, EMBED_DIM), dtype=np.float32)
+    params = {'nlist': 16, 'm': 4, 'nbits': 4, 'nprobe': 4}
+    index = RAG.new_faiss_index(EMBED_DIM, "ivfpq", params)
+    index.train(vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    path = str(tmp_path / "ivfpq.faiss")
+    faiss.write_index(index, path)
+
+    loaded = RAG.read_index_mapped(path)
+    assert "loaded into RAM" not in capsys.readouterr().out
+    assert loaded.ntotal == len(vectors)
+
+def failing_read_index(failing_flags, tried):
+    def read_index(path, flags=0):
+        tried.append(flags)
+        if flags in failing_flags:
+            raise RuntimeError("mmap only supported for File objects")
+        return REAL_READ_INDEX(path)
+    return read_index
+
+def test_map_modes_are_tried_in_order(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "flat.faiss")
+    faiss.write_index(RAG.new_faiss_index(EMBED_DIM), path)
+    ifc = faiss.IO_FLAG_MMAP_IFC
+    mmap = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+    tried = []
+    monkeypatch.setattr(faiss, "read_index", failing_read_index({ifc}, tried))
+    RAG.read_index_mapped(path)
+    assert tried == [ifc, mmap]
+    assert "RAG index loaded (mmap)" in capsys.readouterr().out
+
+    tried = []
+    monkeypatch.setattr(faiss, "read_index", failing_read_index({ifc, mmap}, tried))
+    assert RAG.read_index_mapped(path).ntotal == 0
+    assert tried == [ifc, mmap, 0]
+    assert "loaded into RAM" in capsys.readouterr().out
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pytest
+import RAG
+from conftest import EMBED_DIM, write_doc
+
+@pytest.mark.parametrize("count, index_type", [
+    (0, "flat"),
+    (RAG.INDEX_FLAT_MAX_CHUNKS, "flat"),
+    (RAG.INDEX_FLAT_MAX_CHUNKS + 1, "hnsw"),
+    (RAG.INDEX_HNSW_MAX_CHUNKS, "hnsw"),
+    (RAG.INDEX_HNSW_MAX_CHUNKS + 1, "ivfpq"),
+])
+def test_index_type_by_size(count, index_type):
+    assert RAG.choose_index_type(count) == index_type
+
+@pytest.mark.parametrize("dim, m", [(384, 48), (768, 96), (EMBED_DIM, 4), (30, 3)])
+def test_ivfpq_params(dim, m):
+    params = RAG.choose_index_params("ivfpq", 2_000_000, dim)
+    assert params['m'] == m and dim % params['m'] == 0
+    assert 256 <= params['nlist'] <= 65536
+    assert RAG.choose_index_params("ivfpq", 10, dim)['nlist'] == 256
+    assert RAG.choose_index_params("ivfpq", 10**10, dim)['nlist'] == 65536
+
+@pytest.fixture
+def small_thresholds(monkeypatch):
+    # Index types switch at tens of chunks, and IVF-PQ is small enough to train on them
+    monkeypatch.setattr(RAG, "INDEX_FLAT_MAX_CHUNKS", 10)
+    monkeypatch.setattr(RAG, "INDEX_HNSW_MAX_CHUNKS", 40)
+    choose_params = RAG.choose_index_params
+
+    def choose_index_params(index_type, count, dim):
+        if index_type == "ivfpq":
+            return {'nlist': 2, 'm': 4, 'nbits': 4, 'nprobe': 2}
+        return choose_params(index_type, count, dim)
+    monkeypatch.setattr(RAG, "choose_index_params", choose_index_params)
+
+def write_docs(start, count):
+    return [write_doc(f"doc{i:03d}.txt", f"Document {i} is about subject{i} and nothing else.")
+            for i in range(start, start + count)]
+
+def index_info():
+    return RAG.load_manifest(RAG.current_generation())['index']
+
+def top_hit(rag_env, query):
+    index, data = RAG.load_faiss_index_and_metadata()
+    return RAG.retrieve_relevant_chunks(query, rag_env, index, data, top_k=1)
+
+def test_flat_grows_into_hnsw(rag_env, small_thresholds):
+    write_docs(0, 5)
+    assert RAG.build_embeddings("docs")
+    assert index_info()['type'] == "flat"
+    write_docs(5, 20)
+    assert RAG.build_embeddings("docs")
+    assert index_info()['type'] == "hnsw"
+    assert top_hit(rag_env, "subject17") == ["Document 17 is about subject17 and nothing else."]
+
+def test_hnsw_tombstones_until_rebuild(rag_env, small_thresholds):
+    paths = write_docs(0, 30)
+    assert RAG.build_embeddings("docs")
+    for path in paths[:3]:  # 10%: left as tombstones
+        os.remove(path)
+    assert RAG.build_embeddings("docs")
+    info = index_info()
+    assert (info['type'], info['tombstones']) == ("hnsw", 3)
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 30
+    assert top_hit(rag_env, "subject1") != ["Document 1 is about subject1 and nothing else."]
+
+    for path in paths[3:8]:  # 8 of 30 dead: past HNSW_REBUILD_TOMBSTONES
+        os.remove(path)
+    assert RAG.build_embeddings("docs")
+    assert index_info()['tombstones'] == 0
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 22
+    assert top_hit(rag_env, "subject20") == ["Document 20 is about subject20 and nothing else."]
+
+def test_large_build_switches_to_ivfpq(rag_env, small_thresholds):
+    write_docs(0, 60)
+    assert RAG.build_embeddings("docs")
+    info = index_info()
+    assert info['type'] == "ivfpq"
+    assert info['params']['nlist'] == 2
+    assert RAG.load_faiss_index_and_metadata()[0].ntotal == 60
+
+def test_convert_keeps_ids_and_drops_removed(small_thresholds):
+    vectors = np.random.default_rng(0).random((500, EMBED_DIM), dtype=np.float32)
+    index = RAG.new_faiss_index(EMBED_DIM)
+    index.add_with_ids(vectors, np.arange(500, dtype=np.int64))
+    live = np.ones(500, dtype=bool)
+    live[:100] = False
+    info = {'type': "flat", 'params': {}, 'tombstones': 0}
+    converted = RAG.convert_index(index, info, "ivfpq", 400, live)
+    assert info['type'] == "ivfpq" and converted.ntotal == 400
+    _, ids = converted.search(vectors[250:251], 5)
+    assert 250 in ids[0] and (ids[0] >= 100).all()
@@ -0,0 +1,46 @@
+import math
+from collections import Counter
+import numpy as np
+import lexical
+
+TEXTS = [
+    "invoice AB-1234 was paid on friday",
+    "the invoice for march is still open",
+    "photosynthesis turns light into sugar",
+    "friday friday friday meeting notes",
+    "invoice reminder sent on monday",
+    "removed chunk about the invoice on friday",
+]
+
+def reference(texts, live, query, k):
+    # Plain per-document BM25 over the live chunks
+    docs = {i: Counter(lexical.tokenize(t)) for i, t in enumerate(texts) if live[i]}
+    avg = sum(sum(c.values()) for c in docs.values()) / len(docs)
+    scores = {}
+    for term in set(lexical.tokenize(query)):
+        df = sum(1 for c in docs.values() if term in c)
+        if not df:
+            continue
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for i, c in docs.items():
+            if term in c:
+                norm = lexical.BM25_K1 * (1 - lexical.BM25_B + lexical.BM25_B * sum(c.values()) / avg)
+                scores[i] = scores.get(i, 0.0) + idf * c[term] * (lexical.BM25_K1 + 1) / (c[term] + norm)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+def test_search_matches_plain_bm25(tmp_path):
+    index_dir = str(tmp_path)
+    # Two segments, like an initial build followed by an update
+    for prefix, ids in (("lex-a", range(0, 3)), ("lex-b", range(3, 6))):
+        writer = lexical.SegmentWriter(index_dir, prefix)
+        for i in ids:
+            writer.add(i, TEXTS[i])
+        writer.close()
+    live = np.ones(len(TEXTS), dtype=bool)
+    live[5] = False
+    index = lexical.LexicalIndex(index_dir, ["lex-a-0", "lex-b-0"], live)
+
+    for query, k in (("invoice friday", 3), ("invoice friday", 10), ("ab-1234", 2), ("sugar", 1)):
+        assert index.search(query, k) == reference(TEXTS, live, query, k)
+    assert index.search("nothing matches", 5) == []
+    assert 5 not in index.search("removed chunk", 5)
@@ -0,0 +1,115 @@
+import types
+import pytest
+import memory
+from memory import ConversationMemory, REFRESH_MIN_MESSAGES
+from transcript import TranscriptStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = TranscriptStore(str(tmp_path / "chats.db"))
+    yield store
+    store.close()
+
+def add_turns(store, conversation_id, count):
+    ids = []
+    for i in range(count):
+        message = store.add_message(conversation_id, 'You' if i % 2 == 0 else 'AI', f"turn {i}")
+        ids.append(message['id'])
+    return ids
+
+@pytest.mark.parametrize("count", [0, 1, 5, 6, 9])
+def test_short_history_is_not_folded(store, stub_engine, count):
+    # Up to verbatim_pairs * 2 + REFRESH_MIN_MESSAGES - 1 turns stay verbatim
+    conversation_id = store.new_conversation()
+    add_turns(store, conversation_id, count)
+    memory = ConversationMemory(store, stub_engine)
+
+    assert not memory.refresh(conversation_id)
+    assert store.get_summary(conversation_id) == (None, None)
+    summary, turns = memory.context(conversation_id)
+    assert summary is None
+    assert [turn['content'] for turn in turns] == [f"turn {i}" for i in range(count)]
+
+def test_refresh_keeps_recent_pairs_verbatim(store, stub_engine):
+    conversation_id = store.new_conversation()
+    ids = add_turns(store, conversation_id, 12)
+    memory = ConversationMemory(store, stub_engine, verbatim_pairs=3)
+
+    assert memory.refresh(conversation_id)
+    summary, through_id = store.get_summary(conversation_id)
+    assert summary
+    assert through_id == ids[12 - 6 - 1]
+    _, turns = memory.context(conversation_id)
+    assert [turn['content'] for turn in turns] == [f"turn {i}" for i in range(6, 12)]
+
+    # Nothing new beyond the verbatim turns: no second fold
+    assert not memory.refresh(conversation_id)
+
+def test_system_notes_are_not_turns(store, stub_engine):
+    conversation_id = store.new_conversation()
+    add_turns(store, conversation_id, 6)
+    for _ in range(REFRESH_MIN_MESSAGES):
+        store.add_message(conversation_id, 'System', "note")
+    assert not ConversationMemory(store, stub_engine).refresh(conversation_id)
+
+def test_cancelled_refresh_saves_nothing(store, stub_engine):
+    import threading
+    conversation_id = store.new_conversation()
+    add_turns(store, conversation_id, 12)
+    cancel = threading.Event()
+    cancel.set()
+    assert not ConversationMemory(store, stub_engine).refresh(conversation_id, cancel_event=cancel)
+    assert store.get_summary(conversation_id) == (None, None)
+
+def set_chat_prompt(llm, n):
+    tokens = llm.tokenize(" ".join(f"word{i}" for i in range(n)).encode("utf-8"))
+    llm.input_ids[:len(tokens)] = tokens
+    llm.n_tokens = len(tokens)
+    return tokens
+
+def count_saves(monkeypatch, llm):
+    saves = []
+    save_state = llm.save_state
+    monkeypatch.setattr(llm, "save_state", lambda: saves.append(1) or save_state())
+    return saves
+
+def test_refresh_restores_a_long_chat_kv_cache(store, stub_engine, monkeypatch):
+    conversation_id = store.new_conversation()
+    add_turns(store, conversation_id, 12)
+    llm = stub_engine.llm
+    chat_tokens = set_chat_prompt(llm, memory.KEEP_STATE_MIN_TOKENS)
+    monkeypatch.setattr(memory.tuning, "available_ram", lambda: 8 * 2**30)
+    saves = count_saves(monkeypatch, llm)
+
+    assert ConversationMemory(store, stub_engine).refresh(conversation_id)
+    assert saves == [1]
+    assert llm.n_tokens == len(chat_tokens)
+    assert llm.input_ids[:llm.n_tokens].tolist() == chat_tokens
+
+@pytest.mark.parametrize("prompt_tokens, ram", [
+    (10, 8 * 2**30),  # short: evaluated again instead
+    (memory.KEEP_STATE_MIN_TOKENS, 2**30),  # no RAM for the copy
+])
+def test_refresh_skips_the_kv_copy(store, stub_engine, monkeypatch, prompt_tokens, ram):
+    conversation_id = store.new_conversation()
+    add_turns(store, conversation_id, 12)
+    llm = stub_engine.llm
+    set_chat_prompt(llm, prompt_tokens)
+    monkeypatch.setattr(memory.tuning, "available_ram", lambda: ram)
+    saves = count_saves(monkeypatch, llm)
+
+    assert ConversationMemory(store, stub_engine).refresh(conversation_id)
+    assert saves == []
+    assert llm.n_tokens == 0
+
+def test_state_size_estimate(stub_engine):
+    llm = stub_engine.llm
+    llm.n_tokens = 1000
+    assert memory.state_bytes(llm) == 1000 * memory.KV_BYTES_PER_TOKEN
+    # Mistral 7B: 32 layers, 8 KV heads of 128 dims, f16 K and V
+    llm.metadata = {'general.architecture': "llama", 'llama.block_count': "32", 'llama.embedding_length': "4096",
+                    'llama.attention.head_count': "32", 'llama.attention.head_count_kv': "8"}
+    assert memory.state_bytes(llm) == 1000 * 2 * 32 * 8 * 128 * 2
+    llm.context_params = types.SimpleNamespace(logits_all=True)
+    llm.n_vocab = lambda: 32000
+    assert memory.state_bytes(llm) == 1000 * (2 * 32 * 8 * 128 * 2 + 32000 * 4)
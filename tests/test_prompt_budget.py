@@ -0,0 +1,62 @@
+import pytest
+from bench import StubLlama
+from response import LlamaEngine, assemble_prompt, format_conversation
+from RAG import build_prompt
+
+N_CTX = 400
+
+@pytest.fixture
+def engine():
+    engine = LlamaEngine()
+    engine.llm = StubLlama(n_ctx=N_CTX, token_delay=0)
+    return engine
+
+def words(tag, n):
+    return " ".join(f"{tag}{i}" for i in range(n))
+
+def chat(turns, first_role='user'):
+    roles = ('user', 'assistant') if first_role == 'user' else ('assistant', 'user')
+    return [{'role': roles[i % 2], 'content': words(f"t{i}w", 30)} for i in range(turns)]
+
+def prompt_length(engine, plan):
+    return len(engine.llm.tokenize(format_conversation(plan['prompt'], plan['history']).encode("utf-8")))
+
+@pytest.mark.parametrize("max_tokens", [16, 100, 250, 380])
+def test_prompt_never_exceeds_the_budget(engine, max_tokens):
+    chunks = [words(f"c{i}w", 60) for i in range(6)]
+    plan = assemble_prompt(words("q", 20), max_tokens, conversation_history=chat(20), context_chunks=chunks,
+                           build_prompt=build_prompt, engine=engine, summary=words("s", 40))
+    assert plan['prompt_tokens'] == prompt_length(engine, plan)
+    assert plan['prompt_tokens'] <= N_CTX - max_tokens
+
+def test_history_is_dropped_before_chunks(engine):
+    chunks = [words("a", 40), words("b", 40)]
+    history = chat(10)
+    plan = assemble_prompt("what about it", 50, conversation_history=history, context_chunks=chunks,
+                           build_prompt=build_prompt, engine=engine)
+    assert plan['chunks'] == chunks
+    assert 0 < len(plan['history']) < len(history)
+    # The oldest exchanges go; what is left is the most recent ones, starting with a question
+    assert plan['history'] == history[-len(plan['history']):]
+    assert plan['history'][0]['role'] == 'user'
+    assert plan['prompt_tokens'] <= N_CTX - 50
+
+@pytest.mark.parametrize("turns", [12, 13, 14])
+def test_history_starting_with_an_answer_is_trimmed_by_exchange(engine, turns):
+    history = chat(turns, first_role='assistant')
+    plan = assemble_prompt("what about it", 50, conversation_history=history, engine=engine, summary="earlier")
+    kept = plan['history'][1:]  # after the summary
+    assert kept and kept == history[-len(kept):]
+    assert kept[0]['role'] == 'user'
+    assert plan['prompt_tokens'] <= N_CTX - 50
+
+def test_oversized_question_is_cut_to_fit(engine):
+    plan = assemble_prompt(words("q", 1000), 100, conversation_history=chat(4), context_chunks=[words("a", 20)],
+                           build_prompt=build_prompt, engine=engine)
+    assert plan['chunks'] == [] and plan['history'] == []
+    assert plan['prompt_tokens'] <= N_CTX - 100
+
+@pytest.mark.parametrize("max_tokens", [N_CTX - 1, N_CTX, N_CTX + 100])
+def test_max_tokens_must_leave_room_for_the_prompt(engine, max_tokens):
+    with pytest.raises(ValueError, match="context size"):
+        assemble_prompt("hello", max_tokens, engine=engine)
@@ -0,0 +1,30 @@
+from response import stream_ai
+
+def test_cached_tokens_are_the_shared_prefix(stub_engine):
+    llm = stub_engine.llm
+    history = [{'role': 'user', 'content': "what is the invoice total"},
+               {'role': 'assistant', 'content': "it is forty euros"}]
+    list(stream_ai("what is the invoice total", 4, engine=stub_engine))
+    assert stub_engine.last_prompt_stats['cached_tokens'] == 0
+    first = llm.input_ids[:llm.n_tokens].tolist()
+
+    list(stream_ai("and the due date", 4, conversation_history=history, engine=stub_engine))
+    stats = stub_engine.last_prompt_stats
+    prompt = llm.input_ids[:llm.n_tokens].tolist()
+    shared = 0
+    while shared < min(len(first), len(prompt)) and first[shared] == prompt[shared]:
+        shared += 1
+    assert 0 < stats['cached_tokens'] == shared < stats['prompt_tokens']
+
+    # The same prompt again: everything but the last token comes from the cache
+    list(stream_ai("and the due date", 4, conversation_history=history, engine=stub_engine))
+    assert stub_engine.last_prompt_stats['cached_tokens'] == stats['prompt_tokens'] - 1
+
+def test_prompt_stats_leave_the_cache_to_llama(stub_engine):
+    llm = stub_engine.llm
+    cached = llm.tokenize(b"a long shared prefix then the old question")
+    llm.input_ids[:len(cached)] = cached
+    llm.n_tokens = len(cached)
+    stub_engine.record_prompt_stats(llm, llm.tokenize(b"a long shared prefix then a new question"))
+    assert stub_engine.last_prompt_stats['cached_tokens'] == 6
+    assert llm.n_tokens == len(cached)
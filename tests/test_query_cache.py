@@ -0,0 +1,70 @@
+import RAG
+from conftest import StubEmbedder, write_doc
+
+def load():
+    return RAG.load_faiss_index_and_metadata()
+
+def retrieve(rag_env, query, index, data):
+    return RAG.retrieve_relevant_chunks(query, rag_env, index, data, top_k=1)
+
+def delta(before, after, name):
+    return {key: after[name][key] - before[name][key] for key in ('hits', 'misses')}
+
+def test_repeated_queries_hit_both_caches(rag_env):
+    write_doc("invoice.txt", "The invoice was paid on Friday.")
+    assert RAG.build_embeddings("docs")
+    index, data = load()
+    before = RAG.cache_stats()
+    first = retrieve(rag_env, "when was the invoice paid", index, data)
+    encoded = rag_env.encoded
+    # Case and spacing don't change the key
+    assert retrieve(rag_env, "  When was the INVOICE paid ", index, data) == first
+    assert rag_env.encoded == encoded
+    after = RAG.cache_stats()
+    assert delta(before, after, 'retrievals') == {'hits': 1, 'misses': 1}
+    assert delta(before, after, 'query_embeddings') == {'hits': 0, 'misses': 1}
+
+    # Another top_k searches again, but reuses the query's embedding
+    RAG.retrieve_relevant_chunks("when was the invoice paid", rag_env, index, data, top_k=2)
+    assert rag_env.encoded == encoded
+    assert delta(after, RAG.cache_stats(), 'query_embeddings') == {'hits': 1, 'misses': 0}
+
+def test_query_embeddings_are_per_embedder(rag_env):
+    other = StubEmbedder()
+    RAG.embed_query("invoice", rag_env)
+    RAG.embed_query("invoice", other)
+    assert rag_env.encoded == other.encoded == 1
+
+def test_index_swap_invalidates_retrievals(rag_env):
+    write_doc("invoice.txt", "The invoice was paid on Friday.")
+    assert RAG.build_embeddings("docs")
+    old_index, old_data = load()
+    assert retrieve(rag_env, "invoice", old_index, old_data) == ["The invoice was paid on Friday."]
+    assert RAG.cache_stats()['retrievals']['size'] == 1
+
+    write_doc("invoice.txt", "The invoice was paid on Monday.")
+    assert RAG.build_embeddings("docs")
+    # Publishing a generation empties both caches
+    assert RAG.cache_stats()['retrievals']['size'] == 0
+    assert RAG.cache_stats()['query_embeddings']['size'] == 0
+
+    index, data = load()
+    assert data['generation'] != old_data['generation']
+    assert retrieve(rag_env, "invoice", index, data) == ["The invoice was paid on Monday."]
+    # A caller still holding the old index keeps getting its own results, never the new ones
+    misses = RAG.cache_stats()['retrievals']['misses']
+    assert retrieve(rag_env, "invoice", old_index, old_data) == ["The invoice was paid on Friday."]
+    assert RAG.cache_stats()['retrievals']['misses'] == misses + 1
+    assert retrieve(rag_env, "invoice", index, data) == ["The invoice was paid on Monday."]
+
+def test_lru_evicts_the_least_recently_used():
+    cache = RAG.LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2}
+    cache.clear()
+    assert cache.stats()['size'] == 0
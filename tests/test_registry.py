@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import registry
+from registry import ModelRegistry
+
+@pytest.fixture
+def models(stub_engine, monkeypatch):
+    monkeypatch.setattr(registry, "READY_POLL_SEC", 0.01)
+    return ModelRegistry(engine=stub_engine)
+
+def test_wait_returns_once_the_needed_models_are_ready(models):
+    models.llm_ready.set()
+    assert models.wait_until_ready(need_rag=False)
+    assert not models.wait_until_ready(need_rag=True, timeout=0.05)
+    threading.Timer(0.05, models.embedder_ready.set).start()
+    threading.Timer(0.05, models.index_ready.set).start()
+    assert models.wait_until_ready(need_rag=True, timeout=5)
+    assert models.is_ready
+
+def test_timeout_covers_the_whole_wait(models):
+    start = time.monotonic()
+    assert not models.wait_until_ready(need_rag=True, timeout=0.1)
+    assert time.monotonic() - start < 0.3  # not 0.1 per model
+
+def test_stop_ends_a_wait_for_loading_models(models):
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    start = time.monotonic()
+    assert not models.wait_until_ready(need_rag=False, cancel_event=stop)
+    assert time.monotonic() - start < 1
+    assert not models.llm_ready.is_set()
+
+def test_rag_import_leaves_faiss_to_the_index_functions():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import sys, RAG; print('faiss' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,134 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import pytest
+import server
+from registry import ModelRegistry
+
+@pytest.fixture
+def api(stub_engine, monkeypatch):
+    # A server on a free port with a ready registry and the stub model; no RAG
+    monkeypatch.setattr(server, "CLIENT_CHECK_SEC", 0.05)
+    registry = ModelRegistry(engine=stub_engine)
+    for event in (registry.embedder_ready, registry.index_ready, registry.llm_ready):
+        event.set()
+    scheduler = server.Scheduler(stub_engine, max_queue=1)
+    httpd = server.LocAIServer(("127.0.0.1", 0), registry, scheduler, stub_engine.n_threads, use_rag=False)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def post(httpd, body):
+    request = urllib.request.Request(f"http://127.0.0.1:{httpd.server_port}/v1/chat/completions",
+                                     data=json.dumps(body).encode("utf-8"), headers={'Content-Type': "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def ask(content, session="default", max_tokens=4, history=()):
+    return {'messages': list(history) + [{'role': "user", 'content': content}], 'max_tokens': max_tokens,
+            'session': session}
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.mark.parametrize("messages", [
+    ["hi"],
+    [{'content': "hi"}],
+    [{'role': "user", 'content': "hi"}, None],
+    [{'role': "robot", 'content': "hi"}],
+    [{'role': "user", 'content': ["hi"]}],
+    [{'role': "assistant", 'content': "hi"}],
+    [],
+    "hi",
+])
+def test_malformed_messages_get_a_400(api, messages):
+    status, body = post(api, {'messages': messages})
+    assert status == 400
+    assert body['error']['code'] == 400
+
+def test_completion_reports_usage(api):
+    status, body = post(api, ask("hello there", max_tokens=5))
+    assert status == 200
+    assert body['usage']['completion_tokens'] == 5
+    assert body['choices'][0]['finish_reason'] == "length"
+
+def background_post(httpd, body, results):
+    thread = threading.Thread(target=lambda: results.append(post(httpd, body)))
+    thread.start()
+    return thread
+
+def test_full_queue_is_turned_away(api, stub_engine):
+    scheduler = api.scheduler
+    results = []
+    with stub_engine.lock:  # the model is busy: the first job runs, the second waits
+        first = background_post(api, ask("first"), results)
+        wait_for(lambda: scheduler.metrics()['running'] == 1)
+        second = background_post(api, ask("second"), results)
+        wait_for(lambda: scheduler.metrics()['queue_depth'] == 1)
+        status, body = post(api, ask("third"))
+        assert status == 429
+    first.join(5)
+    second.join(5)
+    assert [status for status, _ in results] == [200, 200]
+    assert scheduler.metrics()['rejected'] == 1
+
+def raw_request(httpd, body):
+    data = json.dumps(body).encode("utf-8")
+    sock = socket.create_connection(("127.0.0.1", httpd.server_port))
+    sock.sendall(b"POST /v1/chat/completions HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 + f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data)
+    return sock
+
+def test_disconnected_client_cancels_its_queued_job(api, stub_engine):
+    scheduler = api.scheduler
+    with stub_engine.lock:
+        first = raw_request(api, ask("first"))
+        wait_for(lambda: scheduler.metrics()['running'] == 1)
+        second = raw_request(api, ask("second"))
+        wait_for(lambda: scheduler.metrics()['queue_depth'] == 1)
+        second.close()
+        time.sleep(0.3)  # a few client checks
+    assert first.recv(1024).startswith(b"HTTP/1.0 200")
+    first.close()
+    wait_for(lambda: scheduler.metrics()['cancelled'] == 1)
+    assert scheduler.metrics()['completed'] == 1
+
+def test_sessions_keep_their_own_kv_cache(api, stub_engine):
+    history = [{'role': "user", 'content': "what is the invoice total"},
+               {'role': "assistant", 'content': "tok0 tok1 tok2 tok3"}]
+    assert post(api, ask("what is the invoice total", session="a"))[0] == 200
+    assert post(api, ask("something else entirely", session="b"))[0] == 200
+    # Back to a: its prompt prefix comes from a's restored cache, not b's
+    status, body = post(api, ask("and the due date", session="a", history=history))
+    assert status == 200
+    assert body['locai']['cached_tokens'] > 0
+    assert api.scheduler.metrics()['active_session'] == "a"
+
+def test_session_states_are_bounded(stub_engine):
+    llm = stub_engine.llm
+    scheduler = server.Scheduler.__new__(server.Scheduler)
+    scheduler.session_states = server.OrderedDict()
+    scheduler.active_session = None
+    scheduler.max_sessions = 2
+    for session in "abc":
+        scheduler.switch_session(llm, session)
+        assert llm.n_tokens == 0  # a new session starts from an empty cache
+        tokens = llm.tokenize(f"prompt of session {session}".encode("utf-8"))
+        llm.input_ids[:len(tokens)] = tokens
+        llm.n_tokens = len(tokens)
+    scheduler.switch_session(llm, "d")
+    assert list(scheduler.session_states) == ["b", "c"]  # a was the least recently used
+    scheduler.switch_session(llm, "b")
+    assert llm.input_ids[:llm.n_tokens].tolist() == llm.tokenize(b"prompt of session b")
+    scheduler.switch_session(llm, "a")
+    assert llm.n_tokens == 0
@@ -0,0 +1,72 @@
+import random
+import numpy as np
+from response import DraftStats
+
+def target(prefix):
+    # The main model's greedy choice after a prefix
+    return (sum(prefix[-3:]) * 7 + len(prefix)) % 50
+
+class NoisyDraft:
+    # Drafts the target's tokens, each wrong with some probability
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = input_ids.tolist()
+        draft = []
+        for _ in range(self.rng.randint(0, 5)):
+            token = target(tokens + draft)
+            draft.append(token if self.rng.random() < 0.7 else (token + 1) % 50)
+        return np.array(draft, dtype=np.intc)
+
+def generate(prompt, draft_model, max_tokens):
+    # The verify loop of llama-cpp-python's Llama.generate with a draft_model, greedy sampling
+    input_ids = np.zeros(4096, dtype=np.intc)
+    n_tokens = 0
+    tokens = list(prompt)
+    sample_idx = len(tokens) - 1
+    output = []
+    drafts = []
+    while True:
+        input_ids[n_tokens:n_tokens + len(tokens)] = tokens  # eval
+        n_tokens += len(tokens)
+        while sample_idx < n_tokens:
+            token = target(input_ids[:sample_idx + 1].tolist())
+            sample_idx += 1
+            output.append(token)
+            if len(output) >= max_tokens:
+                return output, drafts
+            tokens = [token]
+            if sample_idx < n_tokens and token != input_ids[sample_idx]:
+                n_tokens = sample_idx
+                break
+        input_ids[n_tokens:n_tokens + len(tokens)] = tokens
+        draft = draft_model(input_ids[:n_tokens + len(tokens)])
+        drafts.append((n_tokens + len(tokens), draft.tolist()))
+        tokens = tokens + draft.tolist()
+
+def matched_prefix(draft, text, start):
+    k = 0
+    while k < len(draft) and text[start + k] == draft[k]:
+        k += 1
+    return k
+
+def test_acceptance_is_counted_exactly():
+    prompt = [1, 2, 3]
+    stats = DraftStats(NoisyDraft())
+    output, drafts = generate(prompt, stats, 200)
+
+    # Greedy output is the same as without drafts
+    plain = list(prompt)
+    for _ in range(200):
+        plain.append(target(plain))
+    assert output == plain[len(prompt):]
+
+    # Every draft but the last was verified; accepted = its prefix that matches the final text
+    text = prompt + output
+    drafted = accepted = 0
+    for start, draft in drafts[:-1]:
+        drafted += len(draft)
+        accepted += matched_prefix(draft, text, start)
+    assert (stats.drafted, stats.accepted) == (drafted, accepted)
+    assert 0 < stats.accepted < stats.drafted
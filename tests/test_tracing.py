@@ -0,0 +1,112 @@
+import csv
+import json
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+def test_nested_spans_fall_inside_their_parent():
+    trace = tracing.Trace("message")
+    with tracing.activate(trace):
+        with tracing.span('retrieval'):
+            with tracing.span('embed_query'):
+                time.sleep(0.01)
+            with tracing.span('vector_search'):
+                pass
+    spans = {s['name']: s for s in trace.spans}
+    # Spans are added as they close: children before their parent
+    assert [s['name'] for s in trace.spans] == ['embed_query', 'vector_search', 'retrieval']
+    outer = spans['retrieval']
+    for name in ('embed_query', 'vector_search'):
+        inner = spans[name]
+        assert outer['start_ms'] <= inner['start_ms']
+        assert inner['start_ms'] + inner['ms'] <= outer['start_ms'] + outer['ms']
+    assert spans['embed_query']['ms'] >= 10
+    assert spans['vector_search']['start_ms'] >= spans['embed_query']['start_ms'] + spans['embed_query']['ms']
+
+def test_spans_reach_the_trace_from_pool_threads():
+    trace = tracing.Trace("message")
+
+    def work():
+        with tracing.span('vector_search'):
+            tracing.record(retrieval_cache_hit=False)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with tracing.activate(trace):
+            with tracing.span('retrieval'):
+                tracing.submit(pool, work).result()
+        pool.submit(work).result()  # started outside the trace: not recorded
+    assert [s['name'] for s in trace.spans] == ['vector_search', 'retrieval']
+    assert trace.metrics == {'retrieval_cache_hit': False}
+
+def test_without_a_trace_nothing_is_recorded():
+    trace = tracing.Trace("message")
+    with tracing.activate(trace):
+        pass
+    assert tracing.current_trace.get() is None
+    with tracing.span('decode'):
+        tracing.record(completion_tokens=3)
+    assert trace.spans == [] and trace.metrics == {}
+
+def test_finish_sums_retrieval():
+    trace = tracing.Trace("message", prompt_tokens=12)
+    trace.add_span('retrieval', trace.t0, trace.t0 + 0.002)
+    trace.add_span('retrieval', trace.t0 + 0.005, trace.t0 + 0.008)
+    finished = trace.finish()
+    assert finished['metrics']['prompt_tokens'] == 12
+    assert finished['metrics']['retrieval_ms'] == pytest.approx(5.0, abs=1e-6)
+    assert finished['metrics']['total_ms'] >= 0
+
+def finished_trace(**metrics):
+    trace = tracing.Trace("message", **metrics)
+    trace.add_span('retrieval', trace.t0, trace.t0 + 0.004)
+    trace.add_span('decode', trace.t0 + 0.004, trace.t0 + 0.010)
+    trace.add_span('decode', trace.t0 + 0.010, trace.t0 + 0.011)
+    return trace.finish()
+
+def read_csv(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+def test_log_writes_jsonl_and_csv(tmp_path):
+    log = tracing.TraceLog(log_dir=str(tmp_path / "logs"))
+    log.write(finished_trace(completion_tokens=7))
+    log.write(finished_trace(completion_tokens=9))
+    with open(log.jsonl_path, encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f]
+    assert [t['metrics']['completion_tokens'] for t in traces] == [7, 9]
+    assert len(traces[0]['spans']) == 3
+    rows = read_csv(log.csv_path)
+    assert len(rows) == 2
+    assert set(rows[0]) == {'time', 'name'} | set(tracing.METRICS) | {f"{name}_ms" for name in tracing.STAGES}
+    assert float(rows[0]['decode_ms']) == pytest.approx(7.0, abs=1e-6)
+    assert float(rows[0]['retrieval_ms']) == pytest.approx(4.0, abs=1e-6)
+    assert rows[0]['prompt_tokens'] == "" and rows[0]['model_load_ms'] == "0.0"
+
+def test_logs_rotate_past_max_bytes(tmp_path):
+    log = tracing.TraceLog(log_dir=str(tmp_path), max_bytes=1000)
+    while not ((tmp_path / "perf.jsonl.1").exists() and (tmp_path / "perf.csv.1").exists()):
+        log.write(finished_trace(completion_tokens=1))
+    log.write(finished_trace(completion_tokens=2))
+    # The rotated files hold everything up to the limit; the new ones start over, with a header
+    assert (tmp_path / "perf.jsonl.1").stat().st_size > 1000
+    assert (tmp_path / "perf.csv.1").stat().st_size > 1000
+    rows = read_csv(log.csv_path)
+    assert rows[-1]['completion_tokens'] == "2"
+    assert all(row['completion_tokens'] == "1" for row in read_csv(log.csv_path + ".1"))
+
+def test_csv_rotates_when_columns_change(tmp_path, monkeypatch):
+    log = tracing.TraceLog(log_dir=str(tmp_path))
+    log.write(finished_trace())
+    monkeypatch.setattr(tracing, "METRICS", tracing.METRICS + ('new_metric',))
+    log.write(finished_trace(new_metric=1))
+    assert len(read_csv(log.csv_path + ".1")) == 1
+    rows = read_csv(log.csv_path)
+    assert len(rows) == 1 and rows[0]['new_metric'] == "1"
+    # The JSONL keeps every trace; only its size rotates it
+    with open(log.jsonl_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+def test_unwritable_log_is_reported_not_raised(tmp_path, capsys):
+    (tmp_path / "logs").write_text("a file where the folder should be")
+    tracing.TraceLog(log_dir=str(tmp_path / "logs")).write(finished_trace())
+    assert "Could not write performance log" in capsys.readouterr().out
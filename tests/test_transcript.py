@@ -0,0 +1,60 @@
+import pytest
+from transcript import TranscriptStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = TranscriptStore(str(tmp_path / "chats.db"))
+    yield store
+    store.close()
+
+def fill(store, conversation_id, count):
+    senders = ('You', 'AI', 'System')
+    return [store.add_message(conversation_id, senders[i % 3], f"message {i}")['id'] for i in range(count)]
+
+def contents(messages):
+    return [message['content'] for message in messages]
+
+def test_messages_page_back_and_forth(store):
+    conversation_id = store.new_conversation()
+    ids = fill(store, conversation_id, 10)
+    other = store.new_conversation()
+    fill(store, other, 3)
+
+    latest = store.messages(conversation_id, limit=4)
+    assert contents(latest) == [f"message {i}" for i in range(6, 10)]
+    older = store.messages(conversation_id, before=latest[0]['id'], limit=4)
+    assert contents(older) == [f"message {i}" for i in range(2, 6)]
+    oldest = store.messages(conversation_id, before=older[0]['id'], limit=4)
+    assert contents(oldest) == ["message 0", "message 1"]
+    assert not store.has_messages(conversation_id, before=oldest[0]['id'])
+    assert store.has_messages(conversation_id, before=older[0]['id'])
+
+    newer = store.messages(conversation_id, after=ids[1], limit=3)
+    assert contents(newer) == ["message 2", "message 3", "message 4"]
+    assert store.has_messages(conversation_id, after=ids[8])
+    assert not store.has_messages(conversation_id, after=ids[9])
+
+def test_turns_and_history_skip_system_notes(store):
+    conversation_id = store.new_conversation()
+    ids = fill(store, conversation_id, 7)
+    assert [(turn['role'], turn['content']) for turn in store.turns(conversation_id, after=ids[0], before=ids[6])] == [
+        ('assistant', "message 1"), ('user', "message 3"), ('assistant', "message 4")]
+    assert store.history(conversation_id, 3) == [
+        {'role': 'user', 'content': "message 3"}, {'role': 'assistant', 'content': "message 4"},
+        {'role': 'user', 'content': "message 6"}]
+
+def test_context_and_trace_are_kept_per_message(store):
+    conversation_id = store.new_conversation()
+    question = store.add_message(conversation_id, 'You', "what was paid?")['id']
+    answer = store.add_message(conversation_id, 'AI', "the invoice")['id']
+    assert store.get_context(question) is None
+
+    store.save_trace(answer, {'total_ms': 12.5})
+    assert store.get_context(answer) == {'query': "", 'chunks': [], 'trace': {'total_ms': 12.5}}
+    chunks = [{'file': "docs/a.txt", 'text': "The invoice was paid."}]
+    store.save_context(answer, "what was paid?", chunks)
+    assert store.get_context(answer) == {'query': "what was paid?", 'chunks': chunks, 'trace': {'total_ms': 12.5}}
+
+    store.save_summary(conversation_id, "asked about an invoice", question)
+    assert store.get_summary(conversation_id) == ("asked about an invoice", question)
+    assert store.latest_conversation() == conversation_id
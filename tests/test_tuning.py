@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+import types
+import pytest
+import tuning
+
+def fake_psutil(physical, total=16 * 2**30, available=8 * 2**30):
+    return types.SimpleNamespace(
+        cpu_count=lambda logical=True: physical,
+        virtual_memory=lambda: types.SimpleNamespace(total=total, available=available))
+
+def test_physical_cores(monkeypatch):
+    monkeypatch.setitem(sys.modules, "psutil", fake_psutil(6))
+    assert tuning.physical_cores() == 6
+    # psutil can report None; then half the logical CPUs, at least one
+    monkeypatch.setitem(sys.modules, "psutil", fake_psutil(None))
+    monkeypatch.setattr(tuning.os, "cpu_count", lambda: 8)
+    assert tuning.physical_cores() == 4
+    monkeypatch.setattr(tuning.os, "cpu_count", lambda: None)
+    assert tuning.physical_cores() == 1
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "model.gguf"
+    with open(path, "wb") as f:
+        f.truncate(4 * 2**30)  # sparse
+    return str(path)
+
+@pytest.mark.parametrize("ram, limit, mlock", [
+    (8 * 2**30, float("inf"), True),
+    (8 * 2**30, None, True),  # no RLIMIT_MEMLOCK (Windows)
+    (8 * 2**30, 8 * 2**20, False),  # the usual Linux default
+    (8 * 2**30, 64 * 2**10, False),
+    (5 * 2**30, float("inf"), False),  # no headroom left
+    (None, float("inf"), False),
+])
+def test_default_config_locks_the_model_only_when_allowed(monkeypatch, model_file, ram, limit, mlock):
+    monkeypatch.setattr(tuning, "physical_cores", lambda: 4)
+    monkeypatch.setattr(tuning, "available_ram", lambda: ram)
+    monkeypatch.setattr(tuning, "memlock_limit", lambda: limit)
+    config = tuning.default_config(model_file)
+    assert config['use_mlock'] is mlock
+    assert (config['n_threads'], config['n_threads_batch'], config['cpu_affinity']) == (4, 4, None)
+
+def test_saved_config_is_per_model(tmp_path, monkeypatch, model_file):
+    monkeypatch.chdir(tmp_path)
+    other = tmp_path / "other.gguf"
+    other.write_bytes(b"gguf")
+    defaults = tuning.load_config(model_file)
+    tuned = dict(defaults, n_threads=3, n_batch=256, cpu_affinity="physical")
+    tuning.save_config(model_file, tuned, [{'n_threads': 3}])
+
+    assert tuning.load_config(model_file) == tuned
+    assert tuning.load_config(str(other)) == tuning.default_config(str(other))
+    assert tuning.default_threads(model_file) == 3
+    # A corrupt file falls back to the defaults
+    with open(tuning.TUNING_FILE, "w") as f:
+        f.write("{")
+    assert tuning.load_config(model_file) == defaults
+
+class FakeEngine:
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.lock = threading.RLock()
+        self.params = {}
+
+    def configure(self, **params):
+        self.params.update(params)
+
+    def get(self):
+        return self
+
+def test_calibrate_picks_the_fastest_settings(tmp_path, monkeypatch, model_file):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tuning, "thread_options", lambda: [2, 4, 8])
+    monkeypatch.setattr(tuning, "physical_core_cpus", lambda: [0, 2, 4, 6])
+
+    def measure(engine):
+        # Prompt eval scales with threads, decode peaks at 4 and is faster pinned
+        p = engine.params
+        prompt = p['n_threads'] * (2 if p['n_batch'] == 512 else 1)
+        decode = {2: 5.0, 4: 9.0, 8: 7.0}[p['n_threads']] + (1.0 if p['cpu_affinity'] == "physical" else 0.0)
+        return float(prompt), decode
+    monkeypatch.setattr(tuning, "measure", measure)
+
+    engine = FakeEngine(model_file)
+    config, measurements = tuning.calibrate(engine)
+    assert (config['n_threads'], config['n_threads_batch'], config['n_batch']) == (4, 8, 512)
+    # 8 prompt threads don't fit on 4 physical cores, so affinity was not tried
+    assert config['cpu_affinity'] is None
+    assert len(measurements) == 6
+    assert engine.params == config
+    assert tuning.load_config(model_file) == config
+
+    monkeypatch.setattr(tuning, "thread_options", lambda: [2, 4])
+    config, measurements = tuning.calibrate(engine)
+    assert (config['n_threads'], config['n_threads_batch'], config['cpu_affinity']) == (4, 4, "physical")
+    assert measurements[-1]['cpu_affinity'] == "physical"
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="no sched_setaffinity")
+def test_cpu_affinity_is_applied_and_undone(monkeypatch):
+    monkeypatch.setattr(tuning, "physical_core_cpus", lambda: tuning.ALL_CPUS[:1])
+    try:
+        assert tuning.set_cpu_affinity("physical")
+        assert os.sched_getaffinity(0) == set(tuning.ALL_CPUS[:1])
+    finally:
+        assert tuning.set_cpu_affinity(None)
+    assert os.sched_getaffinity(0) == set(tuning.ALL_CPUS)
@@ -0,0 +1,58 @@
+import os
+import RAG
+import watcher
+from watcher import FolderWatcher
+
+def test_only_source_files_queue_updates(rag_env):
+    folder_watcher = FolderWatcher("")
+    folder_watcher.add_paths(["locai_chats.db", "locai_chats.db-wal", "logs/traces.csv", "locai_tuning.json",
+                              os.path.join(RAG.INDEX_DIR, "gen-000001", "rag_paths.json"),
+                              os.path.join(RAG.INDEX_DIR, "notes.txt")])
+    assert not folder_watcher.pending
+
+    folder_watcher.add_paths(["docs/a.txt", "docs/b.MD", "docs/c.pdf", "rag_index_notes.txt"])
+    folder_watcher.add_paths(["docs/old"], directory=True)  # a removed folder
+    assert folder_watcher.pending == {"docs/a.txt", "docs/b.MD", "docs/c.pdf", "rag_index_notes.txt", "docs/old"}
+
+def test_batches_wait_for_quiet(rag_env, monkeypatch):
+    folder_watcher = FolderWatcher("docs")
+    monkeypatch.setattr(watcher, "DEBOUNCE_SEC", 0.0)
+    folder_watcher.add_paths([os.path.join("docs", f"f{i:03d}.txt") for i in range(watcher.BATCH_MAX_PATHS + 1)])
+    assert len(folder_watcher.next_batch()) == watcher.BATCH_MAX_PATHS
+    assert folder_watcher.next_batch() == [os.path.join("docs", f"f{watcher.BATCH_MAX_PATHS:03d}.txt")]
+    folder_watcher.stop()
+    assert folder_watcher.next_batch() is None
+
+def test_apply_reloads_only_published_updates(rag_env):
+    updates = []
+    folder_watcher = FolderWatcher("docs", on_update=lambda index, data: updates.append(index.ntotal))
+    a = os.path.join("docs", "a.txt")
+    with open(a, "w", encoding="utf-8") as f:
+        f.write("Alpha beta gamma.")
+    folder_watcher.apply(None)
+    assert updates == [1]
+
+    folder_watcher.apply([a])  # event without a change
+    folder_watcher.apply(None)
+    assert updates == [1]
+
+def test_deleting_every_document_empties_the_index(rag_env):
+    updates = []
+    folder_watcher = FolderWatcher("docs", on_update=lambda index, data: updates.append((index, data)))
+    paths = []
+    for name, text in (("a.txt", "Alpha beta gamma."), ("b.txt", "Delta epsilon zeta.")):
+        paths.append(os.path.join("docs", name))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            f.write(text)
+    folder_watcher.apply(paths)
+    for path in paths:
+        os.remove(path)
+    folder_watcher.apply(paths)
+
+    index, data = updates[-1]
+    assert index.ntotal == 0
+    assert not data['metadata'].live_ids().size
+    assert RAG.retrieve_relevant_chunks("alpha beta", rag_env, index, data) == []
+
+    # A full pass over the now empty folder stays at the empty generation
+    assert RAG.build_embeddings("docs")
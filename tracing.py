@@ -0,0 +1,159 @@
+import contextvars
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-message timing: a Trace is activated for the duration of one request and any code
+# running in that context (including pool threads started with submit()) adds spans to it.
+# Without an active trace span() and record() do nothing
+
+LOG_DIR = "logs"
+LOG_MAX_BYTES = 5 * 2**20  # each log is rotated to <name>.1 past this size
+STAGES = ('wait_for_models', 'retrieval', 'embed_query', 'vector_search', 'lexical_search', 'stale_check',
+          'assemble_prompt', 'model_load', 'tokenize', 'prompt_eval', 'decode')
+METRICS = ('total_ms', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'ttft_ms', 'tokens_per_sec',
+           'retrieval_ms', 'drafted_tokens', 'accepted_tokens', 'acceptance_rate')
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class Trace:
+    def __init__(self, name, **metrics):
+        self.name = name
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.metrics = dict(metrics)
+        self.lock = threading.Lock()
+
+    def add_span(self, name, start, end):
+        with self.lock:
+            self.spans.append({'name': name, 'start_ms': (start - self.t0) * 1000, 'ms': (end - start) * 1000})
+
+    def set(self, **metrics):
+        with self.lock:
+            self.metrics.update(metrics)
+
+    def stage_ms(self, name):
+        with self.lock:
+            return sum(s['ms'] for s in self.spans if s['name'] == name)
+
+    def finish(self):
+        self.set(total_ms=(time.perf_counter() - self.t0) * 1000, retrieval_ms=self.stage_ms('retrieval'))
+        return self.to_dict()
+
+    def to_dict(self):
+        with self.lock:
+            return {'name': self.name, 'time': self.started, 'metrics': dict(self.metrics), 'spans': list(self.spans)}
+
+def start(name, **metrics):
+    # Starts a trace for the rest of the current thread (or context)
+    trace = Trace(name, **metrics)
+    current_trace.set(trace)
+    return trace
+
+@contextmanager
+def activate(trace):
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+@contextmanager
+def span(name):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter())
+
+def add_span(name, start, end):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, end)
+
+def record(**metrics):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.set(**metrics)
+
+def submit(executor, fn, *args):
+    # executor.submit that runs fn with the caller's active trace
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def format_trace(trace):
+    metrics = trace['metrics']
+    lines = []
+    if 'prompt_tokens' in metrics:
+        lines.append(f"Prompt tokens  {metrics['prompt_tokens']} ({metrics.get('cached_tokens', 0)} cached)")
+    if 'ttft_ms' in metrics:
+        lines.append(f"TTFT           {metrics['ttft_ms']:.0f} ms")
+    if 'tokens_per_sec' in metrics:
+        lines.append(f"Speed          {metrics['tokens_per_sec']:.1f} tok/s ({metrics.get('completion_tokens', 0)} tokens)")
+    if 'acceptance_rate' in metrics:
+        lines.append(f"Speculative    {metrics['accepted_tokens']}/{metrics['drafted_tokens']} drafts accepted "
+                     f"({metrics['acceptance_rate']:.0%})")
+    if 'retrieval_ms' in metrics:
+        lines.append(f"Retrieval      {metrics['retrieval_ms']:.0f} ms")
+    if 'total_ms' in metrics:
+        lines.append(f"Total          {metrics['total_ms']:.0f} ms")
+    stages = {}
+    for s in trace['spans']:
+        stages[s['name']] = stages.get(s['name'], 0.0) + s['ms']
+    if stages:
+        lines.append("")
+        lines.extend(f"  {name:<16}{ms:8.1f} ms" for name, ms in stages.items())
+    return "\n".join(lines)
+
+class TraceLog:
+    # Appends finished traces to logs/<name>.jsonl (full spans) and logs/<name>.csv (one row per
+    # trace with per-stage totals), rotating each file once it passes LOG_MAX_BYTES
+    def __init__(self, name="perf", log_dir=LOG_DIR, max_bytes=LOG_MAX_BYTES):
+        self.jsonl_path = os.path.join(log_dir, f"{name}.jsonl")
+        self.csv_path = os.path.join(log_dir, f"{name}.csv")
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def rotate(self, path, header=None):
+        if not os.path.exists(path):
+            return
+        if os.path.getsize(path) > self.max_bytes:
+            os.replace(path, path + ".1")
+        elif header is not None:
+            # Columns changed (new metrics): start a fresh file rather than misalign rows
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                current = f.readline().rstrip("\r\n")
+            if current != ",".join(header):
+                os.replace(path, path + ".1")
+
+    def write(self, trace):
+        stages = {f"{name}_ms": 0.0 for name in STAGES}
+        for s in trace['spans']:
+            if s['name'] in STAGES:
+                stages[f"{s['name']}_ms"] += s['ms']
+        row = {'time': trace['time'], 'name': trace['name']}
+        row.update({name: trace['metrics'].get(name, "") for name in METRICS})
+        row.update(stages)
+        try:
+            with self.lock:
+                os.makedirs(self.log_dir, exist_ok=True)
+                self.rotate(self.jsonl_path)
+                self.rotate(self.csv_path, header=list(row))
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace) + "\n")
+                new_csv = not os.path.exists(self.csv_path)
+                with open(self.csv_path, "a", encoding="utf-8", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    if new_csv:
+                        writer.writeheader()
+                    writer.writerow(row)
+        except OSError as e:
+            print(f"Could not write performance log: {e}")
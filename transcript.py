@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Chat transcripts on disk: conversations, their messages, and the RAG context and timings behind
+# each question. The GUI keeps only a window of recent messages in memory and pages the rest in
+
+DB_FILE = "locai_chats.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages(conversation_id, id);
+CREATE TABLE IF NOT EXISTS contexts (
+    message_id INTEGER PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    query TEXT NOT NULL DEFAULT '',
+    chunks TEXT NOT NULL DEFAULT '[]',
+    trace TEXT
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    through_id INTEGER NOT NULL  -- last message folded into the summary
+);
+"""
+
+ROLES = {'You': 'user', 'AI': 'assistant'}
+
+class TranscriptStore:
+    def __init__(self, path=DB_FILE):
+        # One connection for the Tk thread and the response worker, serialized by the lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")  # WAL keeps this crash-safe; only the last commits can be lost
+            self.conn.execute("PRAGMA foreign_keys=ON")
+            self.conn.executescript(SCHEMA)
+
+    def new_conversation(self):
+        now = time.time()
+        with self.lock, self.conn:
+            return self.conn.execute("INSERT INTO conversations (created, updated) VALUES (?, ?)", (now, now)).lastrowid
+
+    def latest_conversation(self):
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM conversations ORDER BY updated DESC, id DESC LIMIT 1").fetchone()
+        return row['id'] if row else None
+
+    def add_message(self, conversation_id, sender, content, created=None):
+        created = created or time.time()
+        with self.lock, self.conn:
+            message_id = self.conn.execute(
+                "INSERT INTO messages (conversation_id, sender, content, created) VALUES (?, ?, ?, ?)",
+                (conversation_id, sender, content, created)).lastrowid
+            self.conn.execute("UPDATE conversations SET updated = ? WHERE id = ?", (time.time(), conversation_id))
+        return {'id': message_id, 'sender': sender, 'content': content, 'created': created}
+
+    def messages(self, conversation_id, before=None, after=None, limit=50):
+        # Oldest first: the `limit` messages just before/after a message id, or the latest ones
+        query = "SELECT id, sender, content, created FROM messages WHERE conversation_id = ?"
+        args = [conversation_id]
+        if after is not None:
+            query += " AND id > ? ORDER BY id ASC LIMIT ?"
+            args += [after, limit]
+        else:
+            if before is not None:
+                query += " AND id < ?"
+                args.append(before)
+            query += " ORDER BY id DESC LIMIT ?"
+            args.append(limit)
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute(query, args)]
+        return rows if after is not None else rows[::-1]
+
+    def has_messages(self, conversation_id, before=None, after=None):
+        query = "SELECT 1 FROM messages WHERE conversation_id = ?"
+        args = [conversation_id]
+        if before is not None:
+            query += " AND id < ?"
+            args.append(before)
+        if after is not None:
+            query += " AND id > ?"
+            args.append(after)
+        with self.lock:
+            return self.conn.execute(query + " LIMIT 1", args).fetchone() is not None
+
+    def turns(self, conversation_id, after=None, before=None):
+        # Chat turns (no system notes) with their ids, oldest first
+        query = "SELECT id, sender, content FROM messages WHERE conversation_id = ? AND sender IN ('You', 'AI')"
+        args = [conversation_id]
+        if after is not None:
+            query += " AND id > ?"
+            args.append(after)
+        if before is not None:
+            query += " AND id < ?"
+            args.append(before)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY id", args).fetchall()
+        return [{'id': row['id'], 'role': ROLES[row['sender']], 'content': row['content']} for row in rows]
+
+    def history(self, conversation_id, limit):
+        # The last `limit` chat turns as conversation_history entries, for restoring a session
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT sender, content FROM messages WHERE conversation_id = ? AND sender IN ('You', 'AI') "
+                "ORDER BY id DESC LIMIT ?", (conversation_id, limit)).fetchall()
+        return [{'role': ROLES[row['sender']], 'content': row['content']} for row in reversed(rows)]
+
+    def save_context(self, message_id, query, chunks):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO contexts (message_id, query, chunks) VALUES (?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET query = excluded.query, chunks = excluded.chunks",
+                (message_id, query, json.dumps(chunks)))
+
+    def save_trace(self, message_id, trace):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO contexts (message_id, trace) VALUES (?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET trace = excluded.trace",
+                (message_id, json.dumps(trace)))
+
+    def get_context(self, message_id):
+        with self.lock:
+            row = self.conn.execute("SELECT query, chunks, trace FROM contexts WHERE message_id = ?",
+                                    (message_id,)).fetchone()
+        if row is None:
+            return None
+        context = {'query': row['query'], 'chunks': json.loads(row['chunks'])}
+        if row['trace']:
+            context['trace'] = json.loads(row['trace'])
+        return context
+
+    def get_summary(self, conversation_id):
+        with self.lock:
+            row = self.conn.execute("SELECT summary, through_id FROM summaries WHERE conversation_id = ?",
+                                    (conversation_id,)).fetchone()
+        return (row['summary'], row['through_id']) if row else (None, None)
+
+    def save_summary(self, conversation_id, summary, through_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO summaries (conversation_id, summary, through_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(conversation_id) DO UPDATE SET summary = excluded.summary, through_id = excluded.through_id",
+                (conversation_id, summary, through_id))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
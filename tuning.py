@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import platform
+import time
+
+# Hardware-aware LLM runtime settings. Defaults come from psutil (physical cores, RAM);
+# calibrate() times prompt eval and decode over a few thread/batch/affinity settings and saves
+# the fastest per machine and model, so later starts use it without measuring again
+
+TUNING_FILE = "locai_tuning.json"
+BATCH_OPTIONS = (256, 512)
+CALIBRATION_PROMPT_TOKENS = 256
+CALIBRATION_DECODE_TOKENS = 32
+MLOCK_RAM_HEADROOM = 2 * 2**30  # lock the model in RAM only if this much is left over
+CPU_AFFINITY_MODES = (None, "physical")  # None leaves thread placement to the OS
+ALL_CPUS = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+
+def physical_cores():
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    # SMT siblings share execution units, so llama.cpp rarely gains from them
+    return cores or max(1, (os.cpu_count() or 2) // 2)
+
+def physical_core_cpus():
+    # One logical CPU per physical core (Linux sysfs topology), or None where that is unknown
+    if ALL_CPUS is None:
+        return None
+    cores = {}
+    for cpu in ALL_CPUS:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{topology}/physical_package_id") as f:
+                package = f.read().strip()
+            with open(f"{topology}/core_id") as f:
+                core = f.read().strip()
+        except OSError:
+            return None
+        cores.setdefault((package, core), cpu)
+    return sorted(cores.values())
+
+def set_cpu_affinity(mode):
+    # "physical" keeps llama.cpp's threads off SMT siblings. Applied to every thread of the
+    # process, since the threads llama.cpp starts later inherit it from the one that starts them
+    cpus = physical_core_cpus() if mode == "physical" else ALL_CPUS
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    try:
+        tids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass  # thread already gone
+    return True
+
+def memlock_limit():
+    # Bytes this process may lock (RLIMIT_MEMLOCK); None where there is no such limit (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return float("inf") if soft == resource.RLIM_INFINITY else soft
+
+def available_ram():
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+def machine_key(model_path):
+    # Same machine and same model file -> same tuned settings
+    try:
+        import psutil
+        total_ram = psutil.virtual_memory().total // 2**30
+    except ImportError:
+        total_ram = None
+    try:
+        model_size = os.path.getsize(model_path)
+    except OSError:
+        model_size = None
+    ident = [platform.node(), platform.machine(), platform.processor(), os.cpu_count(), physical_cores(),
+             total_ram, os.path.basename(model_path), model_size]
+    return hashlib.blake2b(json.dumps(ident).encode("utf-8"), digest_size=8).hexdigest()
+
+def default_config(model_path):
+    ram = available_ram()
+    try:
+        model_size = os.path.getsize(model_path)
+    except OSError:
+        model_size = None
+    limit = memlock_limit()
+    return {
+        'n_threads': physical_cores(),
+        'n_threads_batch': physical_cores(),
+        'n_batch': 512,
+        # mlock keeps the weights from being paged out between messages, if there is room for them
+        # and the memlock limit allows it (Linux defaults to a few MB, where mlock only fails)
+        'use_mlock': bool(ram and model_size and ram > model_size + MLOCK_RAM_HEADROOM
+                          and (limit is None or limit >= model_size)),
+        'use_mmap': True,
+        'cpu_affinity': None,
+    }
+
+def load_all():
+    try:
+        with open(TUNING_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_config(model_path):
+    config = default_config(model_path)
+    saved = load_all().get(machine_key(model_path))
+    if saved:
+        config.update(saved['config'])
+    return config
+
+def default_threads(model_path=None):
+    if model_path is None:
+        from response import model_path
+    return load_config(model_path)['n_threads']
+
+def save_config(model_path, config, measurements):
+    tuned = load_all()
+    tuned[machine_key(model_path)] = {'config': config, 'measurements': measurements, 'time': time.time(),
+                                      'model': os.path.basename(model_path)}
+    tmp_path = TUNING_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(tuned, f, indent=2)
+    os.replace(tmp_path, TUNING_FILE)
+
+def thread_options():
+    physical = physical_cores()
+    logical = os.cpu_count() or physical
+    return sorted({max(1, physical // 2), max(1, physical - 1), physical, logical})
+
+def measure(llm):
+    # Prompt eval and decode speed of the loaded model, from an empty KV cache
+    prompt = [llm.token_bos()] + [llm.tokenize(b" hello", add_bos=False)[0]] * (CALIBRATION_PROMPT_TOKENS - 1)
+    llm.reset()
+    start = time.perf_counter()
+    llm.eval(prompt)
+    prompt_sec = time.perf_counter() - start
+    token = prompt[-1]
+    start = time.perf_counter()
+    for _ in range(CALIBRATION_DECODE_TOKENS):
+        llm.eval([token])
+    decode_sec = time.perf_counter() - start
+    llm.reset()
+    return len(prompt) / prompt_sec, CALIBRATION_DECODE_TOKENS / decode_sec
+
+def calibrate(engine, progress=None):
+    # Reloads the model once per setting; mmap keeps each reload short after the first
+    config = default_config(engine.model_path)
+    settings = [(threads, n_batch) for n_batch in BATCH_OPTIONS for threads in thread_options()]
+    measurements = []
+    with engine.lock:
+        for i, (threads, n_batch) in enumerate(settings, 1):
+            if progress is not None:
+                progress(f"Calibrating {i}/{len(settings)}: {threads} threads, batch {n_batch}")
+            engine.configure(n_threads=threads, n_threads_batch=threads, n_batch=n_batch,
+                             use_mlock=False, use_mmap=True, cpu_affinity=None)
+            prompt_rate, decode_rate = measure(engine.get())
+            measurements.append({'n_threads': threads, 'n_batch': n_batch, 'cpu_affinity': None,
+                                 'prompt_tokens_per_sec': prompt_rate, 'decode_tokens_per_sec': decode_rate})
+
+        # Decode and prompt eval peak at different thread counts, so they are picked separately
+        best_decode = max(measurements, key=lambda m: m['decode_tokens_per_sec'])
+        best_prompt = max(measurements, key=lambda m: m['prompt_tokens_per_sec'])
+        config.update(n_threads=best_decode['n_threads'], n_threads_batch=best_prompt['n_threads'],
+                      n_batch=best_prompt['n_batch'])
+
+        # Then the chosen threads pinned to physical cores, if they fit on them, against the OS's placement
+        physical = physical_core_cpus()
+        if physical and max(config['n_threads'], config['n_threads_batch']) <= len(physical):
+            if progress is not None:
+                progress("Calibrating thread affinity")
+            engine.configure(**dict(config, use_mlock=False, cpu_affinity="physical"))
+            prompt_rate, decode_rate = measure(engine.get())
+            measurements.append({'n_threads': config['n_threads'], 'n_batch': config['n_batch'],
+                                 'cpu_affinity': "physical",
+                                 'prompt_tokens_per_sec': prompt_rate, 'decode_tokens_per_sec': decode_rate})
+            if decode_rate > best_decode['decode_tokens_per_sec']:
+                config['cpu_affinity'] = "physical"
+        engine.configure(**config)
+    save_config(engine.model_path, config, measurements)
+    return config, measurements
+
+def main():
+    from response import default_engine
+    print(f"{physical_cores()} physical cores, {os.cpu_count()} logical, "
+          f"{(available_ram() or 0) / 2**30:.1f} GB RAM available")
+    config, measurements = calibrate(default_engine, progress=print)
+    for m in measurements:
+        print(f"  threads {m['n_threads']:>3}  batch {m['n_batch']:>4}  affinity {m['cpu_affinity'] or 'os':>8}  "
+              f"prompt {m['prompt_tokens_per_sec']:8.1f} tok/s  decode {m['decode_tokens_per_sec']:6.1f} tok/s")
+    print(f"Saved to {TUNING_FILE}: {config}")
+
+if __name__ == "__main__":
+    main()
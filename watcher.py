@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from pathlib import Path
+import RAG
+
+# Live indexing: file system events on the indexed folder are collected, coalesced and, once
+# the folder has been quiet for DEBOUNCE_SEC, applied as a small incremental build of just the
+# changed paths. Builds run on a low-priority thread and pause while a response is generated.
+# watchdog (inotify, FSEvents, ReadDirectoryChangesW) is used when installed; otherwise, or
+# when the folder can't be watched, the folder is polled for mtime/size changes
+
+DEBOUNCE_SEC = 2.0  # quiet time before a batch is applied
+MAX_DELAY_SEC = 30.0  # apply anyway if events never stop for this long
+BATCH_MAX_PATHS = 64  # paths per incremental build
+POLL_INTERVAL_SEC = 10.0
+IDLE_CHECK_SEC = 0.2
+WATCH_NICE = 10  # added niceness of the build thread, where the OS allows it per thread
+
+def lower_thread_priority():
+    # Linux keeps niceness per thread, and threads and pool workers started from here inherit it
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WATCH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+class PollingScanner:
+    # Fallback for file systems without change notifications (network shares, some containers)
+    def __init__(self, folder, on_change, interval=POLL_INTERVAL_SEC):
+        self.folder = folder
+        self.on_change = on_change
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def snapshot(self):
+        signatures = {}
+        for file_path in RAG.iter_source_files(self.folder):
+            try:
+                signatures[file_path] = RAG.file_signature(file_path)
+            except OSError:
+                pass  # removed while listing
+        return signatures
+
+    def run(self):
+        lower_thread_priority()
+        previous = self.snapshot()
+        while not self.stop_event.wait(self.interval):
+            current = self.snapshot()
+            changed = [path for path, signature in current.items() if previous.get(path) != signature]
+            changed += [path for path in previous if path not in current]
+            previous = current
+            if changed:
+                self.on_change(changed)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+class FolderWatcher:
+    # on_update(index, metadata) is called from the watcher thread after each applied batch;
+    # is_busy() returning True pauses builds until it turns False again
+    def __init__(self, folder, on_update=None, is_busy=None, on_status=None, use_polling=False):
+        self.folder = folder
+        self.on_update = on_update
+        self.is_busy = is_busy or (lambda: False)
+        self.on_status = on_status
+        self.use_polling = use_polling
+        self.pending = set()
+        self.first_event = None
+        self.last_event = None
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.observer = None
+        self.mode = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def source_path(self, path):
+        # Same form as the paths iter_source_files yields for the folder, which the manifest is keyed by
+        return str(Path(self.folder) / os.path.relpath(path, self.folder or "."))
+
+    def is_source(self, path, directory=False):
+        # Only documents (or folders that may hold some) outside the index queue an update; the chat
+        # database, logs and settings the app writes next to them when watching the working directory don't
+        path = os.path.abspath(path)
+        index_dir = os.path.abspath(RAG.INDEX_DIR)
+        if path == index_dir or path.startswith(index_dir + os.sep):
+            return False
+        return directory or Path(path).suffix.lower() in RAG.SOURCE_SUFFIXES
+
+    def add_paths(self, paths, directory=False):
+        paths = [self.source_path(p) for p in paths if self.is_source(p, directory)]
+        if not paths:
+            return
+        with self.condition:
+            now = time.monotonic()
+            self.pending.update(paths)
+            self.first_event = self.first_event or now
+            self.last_event = now
+            self.condition.notify()
+
+    def start_observer(self):
+        if not self.use_polling:
+            try:
+                from watchdog.observers import Observer
+                from watchdog.events import FileSystemEventHandler
+
+                watcher = self
+
+                class Handler(FileSystemEventHandler):
+                    def on_any_event(self, event):
+                        if event.is_directory and event.event_type == "modified":
+                            return  # a file inside changed; that file has its own event
+                        if event.event_type in ("created", "modified", "deleted", "moved"):
+                            # A rename is a delete of the old path and a create of the new one
+                            watcher.add_paths([event.src_path] + ([event.dest_path] if event.event_type == "moved" else []),
+                                              event.is_directory)
+
+                self.observer = Observer()
+                self.observer.schedule(Handler(), self.folder or ".", recursive=True)
+                self.observer.daemon = True
+                self.observer.start()
+                self.mode = "events"
+                return
+            except ImportError:
+                print("watchdog is not installed; polling the folder for changes")
+            except Exception as e:
+                print(f"Could not watch {self.folder or '.'} ({e}); polling it for changes")
+        self.observer = PollingScanner(self.folder, self.add_paths)
+        self.observer.start()
+        self.mode = "polling"
+
+    def start(self):
+        self.start_observer()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+        if self.observer is not None:
+            self.observer.stop()
+
+    def wait_idle(self):
+        # Passed to the build as its throttle: a running generation gets the CPU to itself
+        while self.is_busy() and not self.stop_event.is_set():
+            self.stop_event.wait(IDLE_CHECK_SEC)
+
+    def next_batch(self):
+        with self.condition:
+            while not self.stop_event.is_set():
+                if self.pending:
+                    now = time.monotonic()
+                    quiet = now - self.last_event
+                    waited = now - self.first_event
+                    if quiet >= DEBOUNCE_SEC or waited >= MAX_DELAY_SEC:
+                        batch = sorted(self.pending)[:BATCH_MAX_PATHS]
+                        self.pending.difference_update(batch)
+                        self.first_event = now if self.pending else None
+                        return batch
+                    self.condition.wait(min(DEBOUNCE_SEC - quiet, MAX_DELAY_SEC - waited))
+                else:
+                    self.condition.wait()
+        return None
+
+    def status(self, text):
+        if self.on_status is not None:
+            self.on_status(text)
+
+    def apply(self, paths):
+        self.wait_idle()
+        if self.stop_event.is_set():
+            return
+        label = f"{len(paths)} changed path{'s' if len(paths) != 1 else ''}" if paths is not None else "the folder"
+        self.status(f"Indexing {label}...")
+        progress = {}
+        updated = RAG.build_embeddings(self.folder, progress=progress.update, cancel_event=self.stop_event,
+                                       paths=paths, throttle=self.wait_idle)
+        if updated and progress.get('published'):
+            index, metadata = RAG.load_faiss_index_and_metadata()
+            if self.on_update is not None:
+                self.on_update(index, metadata)
+        if not self.stop_event.is_set():
+            self.status(f"Watching for changes ({self.mode}); last update {time.strftime('%H:%M:%S')}")
+
+    def run(self):
+        lower_thread_priority()
+        try:
+            # Catch up on changes made while nothing was watching (a scan without changes is cheap)
+            self.apply(None)
+        except Exception as e:
+            print(f"Live index update failed: {e}")
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            try:
+                self.apply(batch)
+            except Exception as e:
+                print(f"Live index update failed: {e}")
+                self.status(f"Live update failed: {e}")